@@ -1,30 +1,259 @@
+import logging
 import os
 import sys
-import cv2
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import tensorflow as tf
-from tensorflow import keras
-import matplotlib
-import matplotlib.pyplot as plt
-matplotlib.use('Agg')
-from PIL import Image
-from flask import Flask, render_template, request, redirect, url_for, session, g, jsonify, flash
+from flask import Flask, Response, render_template, request, redirect, url_for, session, g, jsonify, flash, stream_with_context, send_file, send_from_directory
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
-from db import create_connection, init_db, insert_history, get_all_history, register_user, authenticate_user, get_user_by_id, insert_feedback, get_feedback_by_history_id, get_all_feedback, get_feedback_stats, get_all_users, update_user_role
-from env import DB_CONFIG, SECRET_KEY
-import io
+from db import PoolExhausted, close_request_connection, release_request_connection, get_pool_stats, init_db, insert_history, get_history_by_image_hash, get_all_history, get_history_page, get_feedback_page, get_recent_history, register_user, authenticate_user, get_user_by_id, insert_feedback, get_feedback_by_history_id, get_all_feedback, get_feedback_stats, get_all_users, update_user_role, delete_user, get_user_by_username, backfill_history_columns, rebuild_prediction_stats, update_artifact_status, get_history_artifacts
+from env import (DB_CONFIG, SECRET_KEY, MODEL_PATH, MODEL_VERSION, INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_WAIT_MS,
+                 PREDICTION_CACHE_SIZE, BULK_BATCH_SIZE, USER_CACHE_TTL, RECENT_ACTIVITY_LIMIT,
+                 ARTIFACT_WORKERS, ARTIFACT_MAX_PENDING, ARTIFACT_RENDER_TIMEOUT, INFERENCE_BACKEND, TFLITE_MODEL_PATH, TFLITE_NUM_THREADS,
+                 MODEL_LOAD_TIMEOUT, TF_INTRA_OP_THREADS, TF_INTER_OP_THREADS, UPLOAD_FOLDER, ARTIFACT_FORMAT,
+                 ARTIFACT_QUALITY, UPLOAD_MAX_AGE_DAYS, UPLOAD_MAX_SIZE_GB, STORE_ORIGINALS, PREPROCESS_WORKERS,
+                 LOG_LEVEL, METRICS_TOKEN, EXPLAIN_METHOD, EXPLAIN_BUDGET_MS, GRADCAM_LAYER, SMOOTHGRAD_SAMPLES,
+                 SMOOTHGRAD_NOISE)
+from batcher import InferenceBatcher
+from runtime import FAILED as MODEL_FAILED, ModelRuntime
+from cache import PredictionCache, TTLCache, image_digest
+from explain import EXPLAIN_LABELS, ExplainBudget
+from artifacts import ArtifactQueue, PENDING, READY, FAILED, NO_ARTIFACTS
+from render import save_artifacts
+from storage import UploadStore
+from metrics import REGISTRY, STAGE_SECONDS, REQUEST_SECONDS, DB_QUERIES_PER_REQUEST
+from preprocessing import batch_buffers, decode_image, preprocess_batch, preprocess_image
+from dicom_io import DICOM_EXTENSIONS, DicomError, dicom_supported, is_dicom
+import click
+import json
+import zipfile
+
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s [%(process)d]: %(message)s')
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = 'static/uploads'
+app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.secret_key = SECRET_KEY
 
-# Inisialisasi database
-init_db()
+# Skema database dibuat/dimigrasi lewat perintah terpisah: flask --app app init-db
+# Satu koneksi pool per request, dikembalikan ke pool saat request selesai (atau lebih awal lewat
+# release_request_connection sebelum menunggu inferensi atau mengirim respons streaming)
+app.teardown_appcontext(close_request_connection)
+
+@app.errorhandler(PoolExhausted)
+def database_busy(error):
+    # Semua koneksi pool terpakai lebih lama dari DB_POOL_TIMEOUT: minta klien mencoba lagi
+    response = Response("Database sedang sibuk, silakan coba lagi sebentar lagi.", status=503, mimetype='text/plain')
+    response.headers['Retry-After'] = '1'
+    return response
+
+def load_model(runtime):
+    """Muat engine inferensi (Keras atau TFLite) dan tentukan versi model"""
+    # TensorFlow baru diimport di sini, bukan saat app.py diimport
+    from engine import load_engine, model_file_digest, set_thread_budget
+    num_threads = runtime.num_threads or TFLITE_NUM_THREADS or None
+    set_thread_budget(runtime.num_threads or TF_INTRA_OP_THREADS, TF_INTER_OP_THREADS)
+    with runtime.stage('load'):
+        engine, serving_model_path = load_engine(INFERENCE_BACKEND, MODEL_PATH, TFLITE_MODEL_PATH or None,
+                                                 num_threads=num_threads, model_content=runtime.model_content,
+                                                 warmup=False, explain_method=EXPLAIN_METHOD,
+                                                 gradcam_layer=GRADCAM_LAYER or None,
+                                                 smoothgrad_samples=SMOOTHGRAD_SAMPLES, smoothgrad_noise=SMOOTHGRAD_NOISE)
+    with runtime.stage('warmup'):
+        engine.warmup()
+    if engine.fused_saliency:
+        # Biaya tiap metode saliency diukur sekali agar request pertama sudah bisa diturunkan
+        with runtime.stage('explain calibration'):
+            dummy = np.zeros((1, 150, 150, 1), dtype=np.float32)
+            explain_budget.calibrate(lambda method: engine.predict_batch(dummy, method=method))
+    with runtime.stage('model digest'):
+        version = MODEL_VERSION or model_file_digest(serving_model_path)[:16]
+    return engine, version
+
+# Model dimuat sekali: di thread background (create_app) atau saat pertama kali dibutuhkan
+runtime = ModelRuntime(load_model)
+
+# Metode saliency map (Grad-CAM, gradient, SmoothGrad) dengan batas waktu per request
+explain_budget = ExplainBudget(EXPLAIN_METHOD, EXPLAIN_BUDGET_MS)
+
+def run_inference_batch(batch, deadline):
+    """Prediksi satu batch; metode saliency diturunkan jika batch tidak akan selesai sebelum deadline"""
+    engine = runtime.engine
+    if not engine.fused_saliency:
+        # Backend TFLite hanya menghitung probabilitas di sini; saliency map dibuat bersama visualisasi di background
+        return engine.predict_batch(batch, saliency=False) + (None,)
+    method = explain_budget.choose(len(batch), deadline)
+    started = time.perf_counter()
+    probabilities, saliencies = engine.predict_batch(batch, method=method)
+    explain_budget.record(method, len(batch), time.perf_counter() - started)
+    return probabilities, saliencies, [method] * len(batch)
+
+# Antrian micro-batching untuk request /predict yang bersamaan
+inference_batcher = InferenceBatcher(run_inference_batch,
+                                     max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+                                     max_wait_ms=INFERENCE_MAX_WAIT_MS)
+
+# Gambar asli dan visualisasi disimpan per hash isi gambar (sharded, tanpa duplikasi). Path relatif
+# dihitung dari folder aplikasi, sama seperti send_file/send_from_directory
+upload_store = UploadStore(os.path.join(app.root_path, app.config['UPLOAD_FOLDER']), ARTIFACT_FORMAT, ARTIFACT_QUALITY)
+# File di upload store dilayani lewat route uploaded_file, jadi UPLOAD_FOLDER boleh berada di luar folder static
+UPLOAD_URL_PREFIX = '/uploads/'
+FILE_ENDPOINTS = ('static', 'uploaded_file')
+
+def upload_url(key):
+    return url_for('uploaded_file', key=key)
+
+@app.context_processor
+def inject_upload_urls():
+    # upload_url(key) untuk template, upload_base_url untuk JavaScript ("<base>" + key)
+    return {'upload_url': upload_url, 'upload_base_url': request.script_root + UPLOAD_URL_PREFIX}
+
+ARTIFACT_KEYS = ('filename', 'prediction', 'confidence', 'clahe_filename', 'saliency_filename', 'overlay_filename',
+                 'image_key', 'explain_method')
+
+def lookup_cached_prediction(image_hash, version, method):
+    """Cari hasil prediksi sebelumnya untuk gambar yang sama (model dan metode saliency sama) di tabel history"""
+    row = get_history_by_image_hash(image_hash, version, method)
+    if not row:
+        return None
+    entry = dict(zip(ARTIFACT_KEYS, row), image_hash=image_hash, artifact_status=READY)
+    # Riwayat lama: gambar asli tersimpan dengan nama file aslinya, saliency map dari gradient input
+    entry['image_key'] = entry['image_key'] or entry['filename']
+    entry['explain_method'] = entry['explain_method'] or 'gradient'
+    return entry
+
+def upload_exists(key):
+    return upload_store.exists(key)
+
+def artifacts_exist(entry):
+    """Pastikan gambar asli dan visualisasi dari hasil cache masih ada (atau sedang dibuat) di folder upload"""
+    if entry.get('artifact_status') == PENDING \
+            and artifact_queue.is_pending((entry['image_hash'], runtime.model_version, entry['explain_method'])):
+        return upload_exists(entry['image_key'])
+    return all(upload_exists(entry[key]) for key in ('image_key', 'clahe_filename', 'saliency_filename', 'overlay_filename'))
+
+# Cache hasil prediksi berdasarkan hash isi gambar + versi model + metode saliency
+prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE,
+                                   persistent_lookup=lookup_cached_prediction,
+                                   validate=artifacts_exist)
+
+# Thread pool praproses untuk prediksi massal (decode PIL dan OpenCV melepas GIL)
+preprocess_pool = ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS, thread_name_prefix='preprocess')
+
+# Gambar asli ditulis ke disk di luar jalur request (satu thread cukup: hanya menulis bytes)
+upload_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upload-writer')
+
+def write_upload(image_key, data):
+    with STAGE_SECONDS.time('upload save'):
+        upload_store.put_bytes(image_key, data)
+
+def save_upload(image_key, data):
+    """Simpan file gambar asli ke upload store di background (gambar yang sama hanya disimpan sekali)"""
+    upload_writer.submit(write_upload, image_key, data)
+
+def keeps_original(data):
+    """Gambar asli disimpan kecuali dimatikan; DICOM tidak bisa ditampilkan browser (arsipnya tetap di PACS)"""
+    return STORE_ORIGINALS and not is_dicom(data)
+
+def make_entry(filename, probability, saliency, image_hash, explain_method, artifact_status=READY, keep_original=True):
+    """Data hasil prediksi beserta key gambar asli dan visualisasinya"""
+    result = runtime.engine.to_prediction(probability, saliency)
+    clahe_key, saliency_key, overlay_key = upload_store.artifact_keys(image_hash, runtime.model_version, explain_method)
+    return {
+        'filename': filename,
+        'prediction': result.label,
+        'confidence': f"{result.confidence:.2f}%",
+        'clahe_filename': clahe_key,
+        'saliency_filename': saliency_key,
+        'overlay_filename': overlay_key,
+        # Tanpa penyimpanan gambar asli, gambar CLAHE yang ditampilkan sebagai gambar asli
+        'image_key': upload_store.original_key(image_hash, filename) if keep_original else clahe_key,
+        'image_hash': image_hash,
+        'artifact_status': artifact_status,
+        'explain_method': explain_method,
+    }
+
+def render_entry(entry, img_clahe, saliency, img_input=None):
+    """Simpan gambar CLAHE, saliency map dan overlay (150x150) tanpa matplotlib"""
+    if saliency is None:
+        # Backend TFLite: saliency map dihitung lewat model Keras
+        method = entry['explain_method']
+        started = time.perf_counter()
+        with STAGE_SECONDS.time('saliency'):
+            saliency = runtime.engine.saliency_batch(img_input, method)[0]
+        explain_budget.record(method, 1, time.perf_counter() - started)
+    with STAGE_SECONDS.time('render'):
+        save_artifacts(upload_store.root, entry['clahe_filename'], entry['saliency_filename'],
+                       entry['overlay_filename'], img_clahe, saliency, quality=upload_store.quality,
+                       heatmap_filename=upload_store.heatmap_key(entry['image_hash'], runtime.model_version,
+                                                                 entry['explain_method']))
+
+def store_prediction(filename, data, img_clahe, probability, saliency, image_hash, explain_method):
+    """Simpan gambar upload beserta visualisasinya dan kembalikan data hasil prediksi"""
+    keep_original = keeps_original(data)
+    entry = make_entry(filename, probability, saliency, image_hash, explain_method, keep_original=keep_original)
+    if keep_original:
+        save_upload(entry['image_key'], data)
+    render_entry(entry, img_clahe, saliency)
+    return entry
+
+def artifacts_done(key, status):
+    """Dipanggil worker visualisasi: perbarui status di cache dan tabel history"""
+    image_hash, version, method = key
+    entry = prediction_cache.peek(image_hash, version, method)
+    if entry is not None:
+        entry['artifact_status'] = status
+    if status == FAILED:
+        prediction_cache.invalidate(image_hash, version, method)
+    update_artifact_status(image_hash, version, method, status)
 
-# Load model
-model = tf.keras.models.load_model("modelPneumonia.h5")
-labels = ["Normal", "Pneumonia"]
+# Pembuatan visualisasi di background agar /predict langsung mengembalikan label dan confidence
+artifact_queue = ArtifactQueue(render_entry, artifacts_done,
+                               max_workers=ARTIFACT_WORKERS, max_pending=ARTIFACT_MAX_PENDING)
+
+def record_history(user_id, entry, image_hash):
+    """Simpan hasil prediksi ke tabel history"""
+    with STAGE_SECONDS.time('db write'):
+        return insert_history(user_id, entry['filename'], entry['prediction'], entry['confidence'],
+                              entry['clahe_filename'], entry['saliency_filename'], entry['overlay_filename'],
+                              image_hash=image_hash, model_version=runtime.model_version,
+                              artifact_status=entry.get('artifact_status', READY), image_key=entry['image_key'],
+                              explain_method=entry['explain_method'])
+
+# Cache user/role antar request (invalidasi saat role diubah)
+user_cache = TTLCache(USER_CACHE_TTL)
+
+def load_user(user_id):
+    """Ambil data user (id, username, role) dari cache TTL atau database"""
+    user = user_cache.get(user_id)
+    if user is None:
+        user = get_user_by_id(user_id)
+        if user:
+            user_cache.put(user_id, user)
+    return user
+
+def get_current_user():
+    """User yang sedang login, dimuat sekali per request dan disimpan di g"""
+    if 'user' not in g:
+        user_id = session.get('user_id')
+        g.user = load_user(user_id) if user_id is not None else None
+    return g.user
+
+def is_admin():
+    """Cek role admin langsung ke database (sekali per request), bukan dari cache user.
+
+    Cache user hanya berlaku per proses: dengan serve.py, worker lain baru melihat
+    perubahan role setelah USER_CACHE_TTL, jadi hak akses admin tidak boleh bergantung padanya.
+    """
+    if '_is_admin' not in g:
+        user_id = session.get('user_id')
+        user = get_user_by_id(user_id) if user_id is not None else None
+        if user:
+            user_cache.put(user_id, user)
+            g.user = user
+        g._is_admin = bool(user and user[2] == 'admin')
+    return g._is_admin
 
 def login_required(f):
     """Decorator untuk memeriksa apakah pengguna sudah login"""
@@ -43,8 +272,7 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login'))
-        user = get_user_by_id(session['user_id'])
-        if not user or user[2] != 'admin':  # user[2] is role
+        if not is_admin():
             return redirect(url_for('index'))
         return f(*args, **kwargs)
     return decorated_function
@@ -56,25 +284,82 @@ def non_admin_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login'))
-        user = get_user_by_id(session['user_id'])
+        user = get_current_user()
         if user and user[2] == 'admin':  # Jika pengguna adalah admin
             return redirect(url_for('admin_dashboard'))  # Arahkan ke dashboard admin
         return f(*args, **kwargs)
     return decorated_function
 
+def model_required(f):
+    """Decorator untuk menunggu model selesai dimuat sebelum request POST diproses"""
+    from functools import wraps
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # Form upload (GET) tidak membutuhkan model
+        if request.method == 'POST' and not runtime.wait(MODEL_LOAD_TIMEOUT):
+            if runtime.state == MODEL_FAILED:
+                # Pemuatan gagal (lihat log server); dicoba lagi otomatis setelah backoff
+                response = Response("Model gagal dimuat. Hubungi administrator; server akan mencoba memuat ulang.",
+                                    status=503, mimetype='text/plain')
+                response.headers['Retry-After'] = str(max(int(runtime.retry_in()) + 1, 5))
+                return response
+            response = Response("Model sedang dimuat, silakan coba lagi sebentar lagi.", status=503, mimetype='text/plain')
+            response.headers['Retry-After'] = '5'
+            return response
+        # Batas waktu saliency dihitung mulai dari sini: waktu menunggu model dimuat tidak ikut dihitung
+        g._budget_started = time.perf_counter()
+        return f(*args, **kwargs)
+    return decorated_function
+
+@app.before_request
+def start_request_timer():
+    g._request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('_request_started')
+    if started is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, request.endpoint or 'unknown', request.method,
+                                str(response.status_code))
+        if request.endpoint not in FILE_ENDPOINTS:
+            DB_QUERIES_PER_REQUEST.observe(g.get('_db_queries', 0))
+    return response
+
+# Gambar asli dan visualisasi di upload store diberi nama berdasarkan hash gambar (+ versi model dan metode
+# saliency untuk visualisasi), yaitu semua yang menentukan isinya, jadi isinya tidak pernah berubah: browser
+# boleh menyimpannya tanpa validasi ulang. Ini citra X-ray pasien, jadi hanya cache browser (private), tidak
+# boleh disimpan proxy/CDN bersama
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+CONTENT_ADDRESSED_PREFIXES = ('originals/', 'artifacts/')
+
+@app.after_request
+def cache_content_addressed_files(response):
+    if request.endpoint == 'uploaded_file' and response.status_code in (200, 206, 304) \
+            and request.view_args.get('key', '').startswith(CONTENT_ADDRESSED_PREFIXES):
+        response.cache_control.no_cache = None
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+# Gambar asli dan visualisasi dari upload store (UPLOAD_FOLDER)
+@app.route(UPLOAD_URL_PREFIX + '<path:key>')
+def uploaded_file(key):
+    return send_from_directory(upload_store.root, key)
+
 @app.before_request
 def load_logged_in_user():
-    user_id = session.get('user_id')
-    if user_id is None:
-        g.user = None
-    else:
-        g.user = get_user_by_id(user_id)
+    # Request file statis dan file upload tidak membutuhkan data user
+    if request.endpoint in FILE_ENDPOINTS:
+        return
+    get_current_user()
 
 # Beranda / Landing Page
 @app.route('/')
 def index():
     user = getattr(g, 'user', None)
-    records = get_all_history()
+    records = get_recent_history(RECENT_ACTIVITY_LIMIT)
     return render_template('index.html', history=records, user=user)
 
 
@@ -83,99 +368,318 @@ def index():
 @app.route('/predict', methods=['GET', 'POST'])
 @login_required
 @non_admin_required
+@model_required
 def predict():
     user = getattr(g, 'user', None)
     if request.method == 'POST':
         file = request.files['image']
         if file:
-            filename = file.filename
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-
-            # Load dan praproses gambar
-            img = Image.open(filepath).convert('L').resize((150,150))
-            img_array = np.array(img)
-            
-            # Terapkan CLAHE untuk meningkatkan kontras
-            clahe = cv2.createCLAHE(clipLimit=1.0, tileGridSize=(8,8))
-            img_clahe = clahe.apply(img_array)
-            
-            # Normalisasi kembali ke range [0,1]
-            img_clahe_normalized = img_clahe / 255.0
-            img_input = img_clahe_normalized.reshape(1, 150, 150, 1)  # Siapkan untuk input model
-
-            # Lakukan prediksi tunggal tanpa TTA
-            pred = model.predict(img_input)[0][0]
-            prediction = labels[int(pred >= 0.5)]
-            confidence = f"{(pred if pred >= 0.5 else 1 - pred)*100:.2f}%"
-
-            # Simpan gambar CLAHE untuk ditampilkan dengan ukuran konsisten
-            clahe_filename = f"clahe_{filename}"
-            clahe_path = os.path.join('static/uploads', clahe_filename)
-            clahe_pil_img = Image.fromarray(img_clahe)
-            if clahe_pil_img.size != (150, 150):
-                clahe_pil_img = clahe_pil_img.resize((150, 150), Image.LANCZOS)
-            clahe_pil_img.save(clahe_path)
-            
-            # Saliency Map (gunakan gambar CLAHE untuk visualisasi)
-            input_tensor = tf.convert_to_tensor(img_input)
-            with tf.GradientTape() as tape:
-                tape.watch(input_tensor)
-                preds = model(input_tensor)
-                top_class = tf.argmax(preds[0])
-                top_output = preds[:, top_class]
-
-            grads = tape.gradient(top_output, input_tensor)[0]
-            saliency = np.abs(grads.numpy())
-            saliency = np.max(saliency, axis=-1)
-            saliency = (saliency - saliency.min()) / (saliency.max() - saliency.min())
-
-            # Save Saliency Map (berdasarkan CLAHE) dengan ukuran konsisten
-            saliency_filename = f'saliency_{filename}'
-            saliency_path = os.path.join('static/uploads', saliency_filename)
-            plt.imsave(saliency_path, saliency, cmap='hot')
-            
-            # Pastikan ukuran saliency map konsisten
-            saliency_img = Image.open(saliency_path)
-            if saliency_img.size != (150, 150):
-                saliency_img = saliency_img.resize((150, 150), Image.LANCZOS)
-                saliency_img.save(saliency_path)
-
-            # OVERLAY SALIENCY MAP (menggunakan gambar CLAHE)
-            fig, ax = plt.subplots(figsize=(150/100, 150/100), dpi=100)  # Ukuran konsisten 150x150 pixels
-            ax.imshow(img_clahe, cmap='gray')   # Gambar CLAHE grayscale (0-255)
-            ax.imshow(saliency, cmap='hot', alpha=0.7)   # Overlay saliency map dengan transparansi
-            ax.axis('off')
-            ax.margins(0,0)
-            ax.xaxis.set_major_locator(plt.NullLocator())
-            ax.yaxis.set_major_locator(plt.NullLocator())
-
-            # SAVE OVERLAY SALIENCY MAP dengan ukuran konsisten
-            overlay_filename = f'overlay_{filename}'
-            overlay_path = os.path.join('static/uploads', overlay_filename)
-            plt.savefig(overlay_path, bbox_inches='tight', pad_inches=0, dpi=100)
-            plt.close()
-            
-            # Pastikan ukuran file overlay konsisten dengan gambar lain
-            overlay_img = Image.open(overlay_path)
-            if overlay_img.size != (150, 150):
-                overlay_img = overlay_img.resize((150, 150), Image.LANCZOS)
-                overlay_img.save(overlay_path)
-
-            # Simpan ke database
-            history_id = insert_history(session['user_id'], filename, prediction, confidence, clahe_filename, saliency_filename, overlay_filename)
-
-            return render_template('result.html',
-                                   filename=filename,
-                                   clahe_filename=clahe_filename,
-                                   saliency_filename=saliency_filename,
-                                   overlay_filename=overlay_filename,
-                                   prediction=prediction,
-                                   confidence=confidence,
-                                   saliency=saliency.tolist(),
-                                   history_id=history_id,
-                                   user=user)
-    return render_template('predict.html', user=user)
+            data = file.read()
+            image_hash = image_digest(data)
+
+            # Gambar yang sama sudah pernah diprediksi oleh model ini dengan metode saliency yang dikonfigurasi:
+            # pakai hasil sebelumnya (hasil yang diturunkan ke metode lebih murah tidak dipakai ulang di sini)
+            entry = prediction_cache.get(image_hash, runtime.model_version, explain_budget.method)
+            if entry is not None:
+                # Nama file tampilan mengikuti upload ini; file gambarnya dipakai bersama
+                entry = dict(entry, filename=file.filename)
+                history_id = record_history(session['user_id'], entry, image_hash)
+            else:
+                try:
+                    with STAGE_SECONDS.time('preprocess'):
+                        img_clahe, img_input = preprocess_image(decode_image(data))
+                except Exception as e:
+                    # Bukan gambar yang valid (rusak, terlalu besar/decompression bomb, DICOM tidak valid
+                    # atau tanpa pydicom): tampilkan lagi form upload. Detail error decoder hanya di log;
+                    # pesan DicomError dibuat sendiri dan aman ditampilkan
+                    if isinstance(e, DicomError):
+                        error = f"File DICOM tidak dapat dibaca: {e}"
+                    else:
+                        logger.exception("Cannot decode upload %r", file.filename)
+                        error = "File tidak dapat dibaca sebagai gambar X-ray."
+                    return render_template('predict.html', user=user, dicom_supported=dicom_supported(),
+                                           error=error), 400
+
+                # Koneksi database tidak ditahan selama menunggu batch inferensi
+                release_request_connection()
+                # Prediksi + saliency map melalui antrian batch (termasuk waktu tunggu batch);
+                # batas waktu dihitung sejak model siap (lihat model_required), termasuk decode dan preprocessing
+                deadline = explain_budget.deadline(g._budget_started)
+                with STAGE_SECONDS.time('inference'):
+                    probability, saliency, method = inference_batcher.submit(img_input, deadline)
+                if method is None:
+                    # Saliency map dibuat di background: antrian visualisasi ikut diperhitungkan
+                    method = explain_budget.choose(1 + artifact_queue.stats()['pending'],
+                                                   explain_budget.deadline(time.perf_counter()))
+                keep_original = keeps_original(data)
+                entry = make_entry(file.filename, probability, saliency, image_hash, method, artifact_status=PENDING,
+                                   keep_original=keep_original)
+                if keep_original:
+                    save_upload(entry['image_key'], data)
+
+                # Simpan ke database dulu, baru visualisasi dibuat di background
+                history_id = record_history(session['user_id'], entry, image_hash)
+                job_key = (image_hash, runtime.model_version, method)
+                prediction_cache.put(*job_key, entry)
+                if not artifact_queue.submit(job_key, entry, img_clahe, saliency, img_input):
+                    # Antrian penuh: buat visualisasi langsung di request ini
+                    try:
+                        render_entry(entry, img_clahe, saliency, img_input)
+                        status = READY
+                    except (OSError, ValueError):
+                        status = FAILED
+                    artifacts_done(job_key, status)
+
+            with STAGE_SECONDS.time('template render'):
+                # Heatmap mentah tidak disisipkan ke halaman; diambil lewat /predict/heatmap bila dibutuhkan
+                return render_template('result.html',
+                                       history_id=history_id,
+                                       user=user,
+                                       explain_labels=EXPLAIN_LABELS,
+                                       **entry)
+    return render_template('predict.html', user=user, dicom_supported=dicom_supported())
+
+# Status visualisasi untuk halaman hasil (dipolling sampai siap)
+@app.route('/predict/status/<int:history_id>')
+@login_required
+def artifact_status(history_id):
+    row = get_history_artifacts(history_id)
+    if not row or (row[0] != session['user_id'] and not is_admin()):
+        return jsonify({'error': 'not found'}), 404
+    _, status, clahe_filename, saliency_filename, overlay_filename, image_hash, version, method, age = row
+    if status == PENDING and not artifact_queue.is_pending((image_hash, version, method)) \
+            and (age is None or age > ARTIFACT_RENDER_TIMEOUT):
+        # Tidak ada job di proses ini dan batas waktu render sudah lewat (mis. server restart): tentukan
+        # dari file yang ada. Sebelum itu baris tetap 'pending' karena worker lain mungkin sedang membuatnya.
+        status = READY if all(upload_exists(name) for name in (clahe_filename, saliency_filename, overlay_filename)) else FAILED
+        update_artifact_status(image_hash, version, method, status)
+    result = {'status': status}
+    if status == READY:
+        result.update({
+            'clahe_url': upload_url(clahe_filename),
+            'saliency_url': upload_url(saliency_filename),
+            'overlay_url': upload_url(overlay_filename),
+        })
+    return jsonify(result)
+
+# Heatmap mentah (PNG grayscale 8-bit) untuk tampilan interaktif di halaman hasil
+@app.route('/predict/heatmap/<int:history_id>')
+@login_required
+def heatmap(history_id):
+    row = get_history_artifacts(history_id)
+    if not row or (row[0] != session['user_id'] and not is_admin()):
+        return jsonify({'error': 'not found'}), 404
+    _, status, _, _, _, image_hash, version, method, _ = row
+    key = upload_store.heatmap_key(image_hash, version, method) if image_hash else None
+    if status != READY or not upload_exists(key):
+        # Masih dibuat, gagal, atau riwayat lama tanpa heatmap
+        return jsonify({'error': 'not available', 'status': status}), 404
+    # Isi file ditentukan oleh hash gambar + versi model + metode saliency (sama dengan nama file-nya),
+    # jadi tidak pernah berubah
+    response = send_file(upload_store.path(key), mimetype='image/png', etag=f"{image_hash}-{version}-{method}",
+                         conditional=True, max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+BULK_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png') + DICOM_EXTENSIONS
+
+def iter_bulk_uploads(files):
+    """Hasilkan (filename, bytes) satu per satu dari file yang diunggah dan isi arsip ZIP"""
+    for file in files:
+        if not file or not file.filename:
+            continue
+        if not file.filename.lower().endswith('.zip'):
+            yield file.filename, file.read()
+            continue
+        try:
+            with zipfile.ZipFile(file.stream) as archive:
+                for info in archive.infolist():
+                    name = os.path.basename(info.filename)
+                    if info.is_dir() or name.upper() == 'DICOMDIR':
+                        continue
+                    if not name.lower().endswith(BULK_IMAGE_EXTENSIONS):
+                        # Ekspor seri DICOM dari PACS sering tanpa ekstensi: cek header file
+                        if os.path.splitext(name)[1]:
+                            continue
+                        with archive.open(info) as member:
+                            if not is_dicom(member.read(132)):
+                                continue
+                    # Baca satu anggota arsip per iterasi agar memori tetap datar
+                    yield name, archive.read(info)
+        except zipfile.BadZipFile:
+            yield file.filename, None
+
+def iter_chunks(items, size):
+    """Kelompokkan iterator menjadi list berukuran maksimal `size`"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def bulk_result_line(entry, history_id, cached):
+    """Satu baris NDJSON untuk hasil prediksi massal"""
+    result = {
+        'filename': entry['filename'],
+        'prediction': entry['prediction'],
+        'confidence': entry['confidence'],
+        'history_id': history_id,
+        'cached': cached,
+        'image_url': upload_url(entry['image_key']),
+        'clahe_url': upload_url(entry['clahe_filename']),
+        'saliency_url': upload_url(entry['saliency_filename']),
+        'overlay_url': upload_url(entry['overlay_filename']),
+    }
+    return json.dumps(result) + '\n'
+
+def bulk_error_line(filename, message):
+    return json.dumps({'filename': filename, 'error': message}) + '\n'
+
+# Prediksi massal: banyak file atau arsip ZIP, hasil dikirim per baris (NDJSON)
+@app.route('/predict/bulk', methods=['POST'])
+@login_required
+@non_admin_required
+@model_required
+def predict_bulk():
+    user_id = session['user_id']
+
+    def result_line(entry, image_hash, cached):
+        try:
+            history_id = record_history(user_id, entry, image_hash)
+        except PoolExhausted:
+            # Respons sudah mulai dikirim: laporkan sebagai error item ini, jangan memutus stream
+            return bulk_error_line(entry['filename'], 'Database sedang sibuk, hasil tidak tersimpan')
+        return bulk_result_line(entry, history_id, cached)
+
+    def generate():
+        # Stream bisa berlangsung lama: koneksi database dipinjam per query, tidak ditahan sepanjang stream
+        release_request_connection()
+        files = request.files.getlist('images')
+        # Buffer batch dipakai ulang untuk setiap chunk (tanpa alokasi per gambar)
+        buffers = batch_buffers(BULK_BATCH_SIZE)
+        for chunk in iter_chunks(iter_bulk_uploads(files), BULK_BATCH_SIZE):
+            pending = []
+            for filename, data in chunk:
+                if data is None:
+                    yield bulk_error_line(filename, 'Arsip ZIP tidak valid')
+                    continue
+                image_hash = image_digest(data)
+                entry = prediction_cache.get(image_hash, runtime.model_version, explain_budget.method)
+                if entry is not None:
+                    entry = dict(entry, filename=filename)
+                    yield result_line(entry, image_hash, True)
+                    continue
+                pending.append((filename, data, image_hash))
+
+            if not pending:
+                continue
+            # Decode + CLAHE paralel langsung ke buffer input float32
+            with STAGE_SECONDS.time('bulk preprocess'):
+                clahe_batch, input_batch, errors = preprocess_batch([item[1] for item in pending], buffers,
+                                                                    preprocess_pool)
+            for (filename, _, _), error in zip(pending, errors):
+                if error is not None:
+                    yield bulk_error_line(filename, 'File bukan gambar yang valid')
+            pending = [item for item, error in zip(pending, errors) if error is None]
+            if not pending:
+                continue
+            # Satu forward/backward pass untuk seluruh gambar dalam chunk (tanpa batas waktu per request)
+            method = explain_budget.choose(len(pending))
+            started = time.perf_counter()
+            with STAGE_SECONDS.time('bulk inference'):
+                probabilities, saliencies = runtime.engine.predict_batch(input_batch, method=method)
+            explain_budget.record(method, len(pending), time.perf_counter() - started)
+            for (filename, data, image_hash), img_clahe, probability, saliency in zip(pending, clahe_batch, probabilities, saliencies):
+                entry = store_prediction(filename, data, img_clahe, probability, saliency, image_hash, method)
+                prediction_cache.put(image_hash, runtime.model_version, method, entry)
+                yield result_line(entry, image_hash, False)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+# Parameter DataTables server-side
+DATATABLES_MAX_LENGTH = 100
+USER_HISTORY_COLUMNS = [None, 'filename', 'prediction', 'confidence', 'timestamp', None]
+ADMIN_HISTORY_COLUMNS = [None, 'username', 'filename', 'prediction', 'confidence', 'timestamp', None]
+FEEDBACK_COLUMNS = [None, 'username', 'filename', 'is_accurate', 'usefulness_rating', 'reason', 'created_at']
+
+def datatables_query(columns, default_sort):
+    """Terjemahkan parameter DataTables (start, length, search, order) dan cursor keyset ke argumen query"""
+    args = request.args
+    start = max(args.get('start', 0, type=int), 0)
+    length = min(max(args.get('length', 10, type=int), 1), DATATABLES_MAX_LENGTH)
+    order_index = args.get('order[0][column]', type=int)
+    sort = default_sort
+    if order_index is not None and 0 <= order_index < len(columns) and columns[order_index]:
+        sort = columns[order_index]
+    after = None
+    after_id = args.get('after_id', type=int)
+    if args.get('after_ts') and after_id is not None:
+        after = (args['after_ts'], after_id)
+    return {
+        'limit': length,
+        'offset': start,
+        'after': after,
+        'search': args.get('search[value]', '').strip() or None,
+        'sort': sort,
+        'descending': args.get('order[0][dir]', 'desc') != 'asc',
+    }
+
+def datatables_response(query, rows, total, filtered, filtered_capped, to_dict, keyset_index):
+    """Respons JSON DataTables beserta cursor (timestamp, id) untuk halaman berikutnya.
+
+    `filtered_capped`: hasil pencarian dihitung sampai batas tertentu, jadi jumlahnya minimal `filtered`
+    """
+    data = [to_dict(row, query['offset'] + i + 1) for i, row in enumerate(rows)]
+    cursor = None
+    if rows:
+        cursor = {'ts': str(rows[-1][keyset_index]), 'id': rows[-1][0]}
+    return jsonify({
+        'draw': request.args.get('draw', 0, type=int),
+        'recordsTotal': total,
+        'recordsFiltered': filtered,
+        'filtered_capped': filtered_capped,
+        'data': data,
+        'cursor': cursor,
+        'next_start': query['offset'] + query['limit'],
+    })
+
+def history_row(row, number):
+    """Satu baris history untuk DataTables (nama file visualisasi dengan fallback lama)"""
+    # Dinilai offline tanpa visualisasi (score.py tanpa --artifacts): tidak ada file gambar, tampilan memakai placeholder
+    stored = row[10] != NO_ARTIFACTS
+    return {
+        'no': number,
+        'id': row[0],
+        'username': row[9],
+        'filename': row[2],
+        'prediction': row[3],
+        'confidence': row[4],
+        'clahe_filename': (row[5] or f'clahe_{row[2]}') if stored else None,
+        'saliency_filename': (row[6] or f'saliency_{row[2]}') if stored else None,
+        'overlay_filename': (row[7] or f'overlay_{row[2]}') if stored else None,
+        'timestamp': str(row[8]),
+        'artifact_status': row[10],
+        # Riwayat lama menyimpan gambar asli dengan nama file aslinya
+        'image_key': (row[11] or row[2]) if stored else None,
+    }
+
+def feedback_row(row, number):
+    """Satu baris feedback untuk DataTables"""
+    return {
+        'no': number,
+        'id': row[0],
+        'username': row[9],
+        'filename': row[6],
+        'is_accurate': bool(row[2]),
+        'usefulness_rating': row[3],
+        'reason': row[4],
+        'created_at': str(row[5]),
+    }
 
 # Riwayat prediksi
 @app.route('/history')
@@ -183,10 +687,15 @@ def predict():
 @non_admin_required
 def history():
     user = getattr(g, 'user', None)
-    print(f"DEBUG: User accessing history - ID: {session.get('user_id')}, Username: {user[1] if user else 'None'}")
-    history_records = get_all_history(session['user_id'])
-    print(f"DEBUG: Found {len(history_records)} history records for user {session.get('user_id')}")
-    return render_template('history.html', history=history_records, user=user)
+    return render_template('history.html', user=user)
+
+# Data riwayat prediksi (DataTables server-side)
+@app.route('/history/data')
+@login_required
+@non_admin_required
+def history_data():
+    query = datatables_query(USER_HISTORY_COLUMNS, 'timestamp')
+    return datatables_response(query, *get_history_page(session['user_id'], **query), history_row, 8)
 
 # Submit feedback
 @app.route('/feedback', methods=['POST'])
@@ -201,7 +710,9 @@ def submit_feedback():
         
         # Convert values
         is_accurate = is_accurate == 'true'
-        usefulness_rating = int(usefulness_rating) if usefulness_rating else None
+        usefulness_rating = int(usefulness_rating) if usefulness_rating and usefulness_rating.isdigit() else None
+        if usefulness_rating not in (1, 2, 3, 4, 5):
+            usefulness_rating = None
         
         # Insert feedback
         insert_feedback(history_id, is_accurate, usefulness_rating, reason)
@@ -233,7 +744,7 @@ def login():
         if user_id:
             session['user_id'] = user_id
             # Check if user is admin
-            user = get_user_by_id(user_id)
+            user = load_user(user_id)
             if user and user[2] == 'admin':  # user[2] is role
                 return redirect(url_for('admin_dashboard'))
             else:
@@ -256,27 +767,147 @@ def admin_dashboard():
     user = getattr(g, 'user', None)
     # Get statistics
     stats = get_feedback_stats()
-    # Get all history
-    all_history = get_all_history()
-    # Get all feedback
-    all_feedback = get_all_feedback()
-    # Get all users
+    # Get all users (riwayat dan feedback dimuat per halaman lewat endpoint data)
     all_users = get_all_users()
     
     return render_template('admin/dashboard.html', 
                           user=user, 
                           stats=stats, 
-                          history=all_history,
-                          feedback=all_feedback,
                           users=all_users)
 
+# Data riwayat prediksi semua user (DataTables server-side)
+@app.route('/admin/history/data')
+@admin_required
+def admin_history_data():
+    query = datatables_query(ADMIN_HISTORY_COLUMNS, 'timestamp')
+    return datatables_response(query, *get_history_page(**query), history_row, 8)
+
+# Data feedback (DataTables server-side)
+@app.route('/admin/feedback/data')
+@admin_required
+def admin_feedback_data():
+    query = datatables_query(FEEDBACK_COLUMNS, 'created_at')
+    return datatables_response(query, *get_feedback_page(**query), feedback_row, 5)
+
 # Admin user management
 @app.route('/admin/users/<int:user_id>/role', methods=['POST'])
 @admin_required
 def update_user_role_route(user_id):
     role = request.form.get('role', 'user')
     update_user_role(user_id, role)
+    user_cache.invalidate(user_id)
     return redirect(url_for('admin_dashboard'))
 
+# Statistik antrian inferensi
+@app.route('/admin/inference-stats')
+@admin_required
+def inference_stats():
+    return jsonify(dict(inference_batcher.stats(), artifacts=artifact_queue.stats(), explain=explain_budget.stats()))
+
+# Statistik cache prediksi
+@app.route('/admin/cache-stats')
+@admin_required
+def cache_stats():
+    return jsonify({'predictions': prediction_cache.stats(), 'users': user_cache.stats()})
+
+# Statistik connection pool database
+@app.route('/admin/db-stats')
+@admin_required
+def db_stats():
+    return jsonify(get_pool_stats())
+
+# Hitung ulang kolom confidence_value/label dan tabel prediction_stats dari data yang ada
+# (init_db sudah menjalankannya otomatis saat prediction_stats pertama kali dibuat):
+#   flask --app app backfill-stats
+@app.cli.command('backfill-stats')
+def backfill_stats_command():
+    backfill_history_columns()
+    rebuild_prediction_stats()
+
+# Hapus user beserta riwayat dan feedback-nya; prediction_stats dikurangi dalam transaksi yang sama:
+#   flask --app app delete-user <username>
+@app.cli.command('delete-user')
+@click.argument('username')
+def delete_user_command(username):
+    user = get_user_by_username(username)
+    if user is None:
+        raise click.ClickException(f"User {username!r} tidak ditemukan")
+    if not delete_user(user[0]):
+        raise click.ClickException(f"User {username!r} gagal dihapus (lihat log)")
+    print(f"User {username!r} beserta riwayat dan feedback-nya dihapus")
+
+# RSS/PSS dan throughput per worker saat dijalankan lewat serve.py
+@app.route('/admin/worker-stats')
+@admin_required
+def worker_stats():
+    snapshot = app.config.get('WORKER_STATS')
+    if snapshot is None:
+        return jsonify({'error': 'not running under serve.py'}), 404
+    return jsonify(snapshot())
+
+# Kedalaman antrian dan counter yang sudah ada, dibaca saat /metrics di-scrape
+REGISTRY.gauge('pneumonia_model_ready', 'Whether the model is loaded and warmed up', lambda: int(runtime.ready()))
+REGISTRY.gauge('pneumonia_inference_queue_depth', 'Requests waiting for an inference batch',
+               inference_batcher.queue_depth)
+REGISTRY.gauge('pneumonia_artifact_queue_pending', 'Visualizations queued or being rendered',
+               lambda: artifact_queue.stats()['pending'])
+REGISTRY.gauge('pneumonia_artifacts_total', 'Visualization jobs by outcome',
+               lambda: {k: v for k, v in artifact_queue.stats().items() if k in ('completed', 'failed', 'rejected')},
+               labelname='outcome', metric_type='counter')
+REGISTRY.gauge('pneumonia_explained_images_total', 'Saliency maps computed by explanation method',
+               lambda: explain_budget.stats()['images'], labelname='method', metric_type='counter')
+REGISTRY.gauge('pneumonia_db_pool_in_use', 'Pooled database connections checked out', lambda: get_pool_stats()['in_use'])
+REGISTRY.gauge('pneumonia_db_pool_waits_total', 'Checkouts that had to wait for a free connection',
+               lambda: get_pool_stats()['waits'], metric_type='counter')
+REGISTRY.gauge('pneumonia_db_pool_wait_seconds_total', 'Total time spent waiting for a pooled connection',
+               lambda: get_pool_stats()['total_wait_ms'] / 1000.0, metric_type='counter')
+REGISTRY.gauge('pneumonia_prediction_cache_lookups_total', 'Prediction cache lookups by result',
+               lambda: {k: v for k, v in prediction_cache.stats().items() if k in ('memory_hits', 'persistent_hits', 'misses')},
+               labelname='result', metric_type='counter')
+
+# Metrik format Prometheus (histogram latensi per tahap, query DB, kedalaman antrian)
+@app.route('/metrics')
+def metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return Response('Forbidden', status=403, mimetype='text/plain')
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+# Liveness: proses berjalan; readiness: model sudah dimuat dan di-warm-up
+@app.route('/health/live')
+def health_live():
+    return jsonify({'status': 'ok'})
+
+@app.route('/health/ready')
+def health_ready():
+    # Probe pertama juga memulai pemuatan model jika belum berjalan
+    runtime.start()
+    status = runtime.status()
+    return jsonify(status), (200 if status['status'] == 'ready' else 503)
+
+# Retensi upload store (umur dan ukuran total): flask --app app prune-uploads
+@app.cli.command('prune-uploads')
+def prune_uploads_command():
+    result = upload_store.prune(max_age_seconds=UPLOAD_MAX_AGE_DAYS * 86400 if UPLOAD_MAX_AGE_DAYS else None,
+                                max_bytes=int(UPLOAD_MAX_SIZE_GB * 2**30) if UPLOAD_MAX_SIZE_GB else None)
+    print(f"Removed {result['removed_files']} of {result['files']} files "
+          f"({result['removed_bytes'] / 2**20:.1f} of {result['bytes'] / 2**20:.1f} MB)")
+
+# Buat/migrasi skema database: flask --app app init-db
+@app.cli.command('init-db')
+def init_db_command():
+    init_db()
+
+def create_app(warmup=True):
+    """Siapkan aplikasi untuk dijalankan: model dimuat di thread background.
+
+    Import app.py tidak memuat TensorFlow, model maupun koneksi database;
+    jalankan dengan `flask --app "app:create_app()" run`.
+    """
+    if warmup:
+        runtime.start()
+    return app
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    init_db()
+    # Dengan reloader, hanya proses anak (WERKZEUG_RUN_MAIN) yang memuat model; produksi: python serve.py
+    create_app(warmup=os.environ.get('WERKZEUG_RUN_MAIN') == 'true').run(debug=True)
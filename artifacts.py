@@ -0,0 +1,86 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+READY = 'ready'
+FAILED = 'failed'
+# Scored without visualizations (score.py without --artifacts): there is nothing to render or show
+NO_ARTIFACTS = 'none'
+
+
+class ArtifactQueue:
+    """Render visualization artifacts on a bounded pool of background threads.
+
+    `render(*args)` does the actual work for one job and `on_done(key, status)`
+    is called with READY or FAILED when it finishes. At most `max_pending` jobs
+    are queued or running; `submit` returns False when the queue is full so the
+    caller can render in its own thread instead of piling up work.
+    """
+
+    def __init__(self, render, on_done, max_workers=2, max_pending=64):
+        self.render = render
+        self.on_done = on_done
+        self.max_workers = int(max_workers)
+        self.max_pending = int(max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='artifacts')
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._total_run = 0.0
+
+    def submit(self, key, *args):
+        with self._lock:
+            if key in self._pending:
+                return True
+            if len(self._pending) >= self.max_pending:
+                self._rejected += 1
+                return False
+            self._pending.add(key)
+            self._submitted += 1
+        self._executor.submit(self._run, key, args)
+        return True
+
+    def is_pending(self, key):
+        with self._lock:
+            return key in self._pending
+
+    def _run(self, key, args):
+        started = time.perf_counter()
+        status = READY
+        try:
+            self.render(*args)
+        except Exception:
+            logger.exception("Rendering artifacts for %s failed", key)
+            status = FAILED
+        elapsed = time.perf_counter() - started
+        try:
+            self.on_done(key, status)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+                self._total_run += elapsed
+                if status == READY:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+
+    def stats(self):
+        with self._lock:
+            finished = self._completed + self._failed
+            return {
+                'max_workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'pending': len(self._pending),
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'avg_render_ms': (self._total_run / finished * 1000.0) if finished else 0.0,
+            }
@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class _PendingRequest:
+    """A single caller waiting for its slice of a batch"""
+
+    __slots__ = ('input', 'deadline', 'enqueued_at', 'done', 'result', 'error')
+
+    def __init__(self, input_array, deadline=None):
+        self.input = input_array
+        self.deadline = deadline
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class InferenceBatcher:
+    """Collect concurrent model inputs into one batch per forward pass.
+
+    `run_batch` receives a float32 array of shape (N, 150, 150, 1) and the
+    earliest `deadline` (time.perf_counter() value) given by the callers in
+    the batch, or None, and must return a tuple of per-sample arrays (e.g.
+    probabilities and saliency maps); a None entry in the tuple is passed
+    through as None to every caller.
+    A batch is dispatched as soon as `max_batch_size` inputs are waiting or the
+    oldest input has waited `max_wait_ms` milliseconds.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=10.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.run_batch = run_batch
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait_ms = float(max_wait_ms)
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._worker = None
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._total_requests = 0
+        self._total_batches = 0
+        self._total_errors = 0
+        self._largest_batch = 0
+        self._batch_size_counts = {}
+        self._total_queue_wait = 0.0
+        self._total_run_time = 0.0
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._loop, name='inference-batcher', daemon=True)
+            self._worker.start()
+
+    def submit(self, input_array, deadline=None):
+        """Queue one preprocessed input and block until its result is ready.
+
+        Accepts an array of shape (150, 150, 1) or (1, 150, 150, 1) and returns
+        the tuple produced by `run_batch`, sliced down to this input.
+        `deadline` is passed on to `run_batch` (e.g. to pick cheaper work).
+        """
+        input_array = np.asarray(input_array, dtype=np.float32)
+        if input_array.ndim == 4:
+            input_array = input_array[0]
+        pending = _PendingRequest(input_array, deadline)
+        with self._cond:
+            self._ensure_worker()
+            self._queue.append(pending)
+            self._cond.notify()
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _collect(self):
+        """Wait for the first request, then gather more until full or timed out"""
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            deadline = self._queue[0].enqueued_at + self.max_wait_ms / 1000.0
+            while len(self._queue) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            count = min(len(self._queue), self.max_batch_size)
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            try:
+                deadlines = [p.deadline for p in batch if p.deadline is not None]
+                outputs = self.run_batch(np.stack([p.input for p in batch]), min(deadlines, default=None))
+                for i, pending in enumerate(batch):
+                    pending.result = tuple(None if output is None else output[i] for output in outputs)
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+            finished = time.perf_counter()
+            self._record(batch, started, finished)
+            for pending in batch:
+                pending.done.set()
+
+    def _record(self, batch, started, finished):
+        size = len(batch)
+        with self._stats_lock:
+            self._total_requests += size
+            self._total_batches += 1
+            if batch[0].error is not None:
+                self._total_errors += 1
+            self._largest_batch = max(self._largest_batch, size)
+            self._batch_size_counts[size] = self._batch_size_counts.get(size, 0) + 1
+            self._total_queue_wait += sum(started - p.enqueued_at for p in batch)
+            self._total_run_time += finished - started
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    def stats(self):
+        """Return configuration and counters as a JSON-serializable dict"""
+        with self._stats_lock:
+            batches = self._total_batches
+            requests = self._total_requests
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'queue_depth': self.queue_depth(),
+                'total_requests': requests,
+                'total_batches': batches,
+                'failed_batches': self._total_errors,
+                'largest_batch': self._largest_batch,
+                'avg_batch_size': (requests / batches) if batches else 0.0,
+                'avg_queue_wait_ms': (self._total_queue_wait / requests * 1000.0) if requests else 0.0,
+                'avg_batch_run_ms': (self._total_run_time / batches * 1000.0) if batches else 0.0,
+                'batch_size_counts': {str(k): v for k, v in sorted(self._batch_size_counts.items())},
+            }
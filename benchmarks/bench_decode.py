@@ -0,0 +1,191 @@
+"""Compare upload decoding paths on large chest films.
+
+`disk` is the old upload path: write the upload to disk, re-open it by path
+and decode it at full resolution before resizing to 150x150. `memory` is the
+current path (preprocessing.decode_image + preprocess_image): decode from the
+request bytes, with JPEG draft mode reducing the image while it is decoded.
+
+Each path runs in its own process so peak RSS (Linux /proc) is measured
+separately. Draft decoding and the reducing_gap resize change the pixels the
+model sees, so the run also compares the two paths' model inputs (maximum
+absolute difference) and predictions (label agreement, largest probability
+difference) and exits with status 1 when they diverge beyond the limits:
+
+    python benchmarks/bench_decode.py --size 3000 --repeat 20
+    python benchmarks/bench_decode.py --images /data/xrays/test --limit 50 --model modelPneumonia.h5
+
+Without --model a stand-in CNN with fixed weights is used (see
+bench_pipeline.py); only the real model says whether labels really agree.
+"""
+import argparse
+import io
+import os
+import resource
+import sys
+import tempfile
+import time
+from multiprocessing import get_context
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocessing import CLAHE_CLIP_LIMIT, CLAHE_TILE_GRID, IMAGE_SIZE, decode_image, preprocess_image
+
+MODES = ('disk', 'memory')
+
+
+def synthetic_film(size, fmt, seed=0):
+    """Encoded grayscale test image of size x size with smooth structure and noise"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    pixels = 128 + 60 * np.sin(6 * x) * np.cos(4 * y) + rng.normal(0, 12, (size, size))
+    buf = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).convert('RGB').save(buf, fmt, quality=90)
+    return buf.getvalue()
+
+
+def preprocess_from_disk(data, folder):
+    """The old request path: file.save(), Image.open(path), full decode, resize, CLAHE"""
+    import cv2
+    path = os.path.join(folder, 'upload')
+    with open(path, 'wb') as f:
+        f.write(data)
+    img_array = np.array(Image.open(path).convert('L').resize((IMAGE_SIZE, IMAGE_SIZE)))
+    clahe = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=CLAHE_TILE_GRID)
+    img_clahe = clahe.apply(img_array)
+    return img_clahe, (img_clahe / 255.0).reshape(1, IMAGE_SIZE, IMAGE_SIZE, 1)
+
+
+def current_rss_kb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() // 1024
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak RSS counter (VmHWM) for this process; Linux only"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_mode(mode, images, repeat):
+    """Child process body: (seconds per image, peak RSS growth in MB, CLAHE outputs, model inputs)"""
+    import cv2  # noqa: F401  (imported up front so it does not count towards the first image)
+    reset_peak_rss()
+    baseline = current_rss_kb()
+    outputs = []
+    with tempfile.TemporaryDirectory() as folder:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            outputs = []
+            inputs = []
+            for data in images:
+                if mode == 'disk':
+                    img_clahe, img_input = preprocess_from_disk(data, folder)
+                else:
+                    img_clahe, img_input = preprocess_image(decode_image(data))
+                outputs.append(img_clahe)
+                inputs.append(np.asarray(img_input, dtype=np.float32).reshape(IMAGE_SIZE, IMAGE_SIZE, 1))
+        seconds = (time.perf_counter() - started) / (repeat * len(images))
+    return seconds, (peak_rss_kb() - baseline) / 1024, outputs, inputs
+
+
+def prediction_parity(model_path, disk_inputs, memory_inputs):
+    """(label agreement in [0, 1], largest absolute probability difference) of the two paths' inputs"""
+    from engine import load_engine
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if model_path is None:
+            from bench_pipeline import build_standin_model
+            model_path = build_standin_model(os.path.join(workdir, 'standin.h5'))
+        engine, _ = load_engine('keras', model_path, warmup=False)
+        disk, _ = engine.predict_batch(np.stack(disk_inputs), saliency=False)
+        memory, _ = engine.predict_batch(np.stack(memory_inputs), saliency=False)
+    labels = [engine.to_prediction(a, None).label == engine.to_prediction(b, None).label
+              for a, b in zip(disk, memory)]
+    return float(np.mean(labels)), float(np.max(np.abs(np.asarray(disk) - np.asarray(memory))))
+
+
+def load_images(args):
+    if not args.images:
+        return ([synthetic_film(args.size, args.format, seed) for seed in range(args.count)],
+                f"{args.count} synthetic {args.size}x{args.size} {args.format}")
+    paths = []
+    for dirpath, _, filenames in os.walk(args.images):
+        paths.extend(os.path.join(dirpath, n) for n in sorted(filenames)
+                     if n.lower().endswith(('.jpg', '.jpeg', '.png')))
+    paths = sorted(paths)[:args.limit]
+    if not paths:
+        sys.exit(f"No images found in {args.images}")
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append(f.read())
+    return images, f"{len(images)} images from {args.images}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark upload decoding: old disk path vs in-memory draft decode.")
+    parser.add_argument('--images', help="folder of real images (default: one synthetic film)")
+    parser.add_argument('--limit', type=int, default=50, help="images to use from --images (default: %(default)s)")
+    parser.add_argument('--size', type=int, default=3000, help="synthetic film size in pixels (default: %(default)s)")
+    parser.add_argument('--format', default='JPEG', choices=('JPEG', 'PNG'), help="synthetic film format")
+    parser.add_argument('--count', type=int, default=4, help="synthetic films (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=10, help="passes over the images (default: %(default)s)")
+    parser.add_argument('--model', help="Keras model for the prediction parity check (default: a stand-in CNN)")
+    parser.add_argument('--max-input-diff', type=float, default=0.1,
+                        help="allowed max absolute model input difference, 0-1 scale (default: %(default)s)")
+    parser.add_argument('--max-prob-diff', type=float, default=0.02,
+                        help="allowed max absolute probability difference (default: %(default)s)")
+    parser.add_argument('--min-agreement', type=float, default=1.0,
+                        help="required fraction of images with the same label (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    images, description = load_images(args)
+    print(f"{description}, {sum(map(len, images)) / 2**20:.1f} MB encoded, {args.repeat} passes")
+    results = {}
+    ctx = get_context('spawn')
+    for mode in MODES:
+        with ctx.Pool(1) as pool:
+            results[mode] = pool.apply(run_mode, (mode, images, args.repeat))
+
+    print(f"{'path':<10}{'ms/image':>10}{'peak RSS +MB':>14}")
+    for mode, (seconds, peak_mb, _, _) in results.items():
+        print(f"{mode:<10}{seconds * 1000:>10.2f}{peak_mb:>14.1f}")
+    # Draft decoding changes the pixels slightly; report how far the CLAHE inputs move
+    diffs = [np.abs(a.astype(np.int16) - b).mean() for a, b in zip(results['disk'][2], results['memory'][2])]
+    print(f"speed-up {results['disk'][0] / results['memory'][0]:.1f}x, "
+          f"mean absolute CLAHE pixel difference {np.mean(diffs):.2f} (0-255)")
+
+    disk_inputs, memory_inputs = results['disk'][3], results['memory'][3]
+    input_diff = max(float(np.abs(a - b).max()) for a, b in zip(disk_inputs, memory_inputs))
+    agreement, prob_diff = prediction_parity(args.model, disk_inputs, memory_inputs)
+    print(f"max absolute model input difference {input_diff:.4f} (0-1), "
+          f"label agreement {agreement:.0%}, max probability difference {prob_diff:.4f}")
+    failures = []
+    if input_diff > args.max_input_diff:
+        failures.append(f"input difference {input_diff:.4f} > {args.max_input_diff}")
+    if prob_diff > args.max_prob_diff:
+        failures.append(f"probability difference {prob_diff:.4f} > {args.max_prob_diff}")
+    if agreement < args.min_agreement:
+        failures.append(f"label agreement {agreement:.0%} < {args.min_agreement:.0%}")
+    if failures:
+        print("Parity check failed: " + "; ".join(failures))
+        sys.exit(1)
+    print("Parity check passed")
+
+
+if __name__ == '__main__':
+    main()
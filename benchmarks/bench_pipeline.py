@@ -0,0 +1,318 @@
+"""Time every stage of a prediction, at several batch sizes.
+
+The real model is not part of the repository, so by default a stand-in CNN
+with the same contract (150x150x1 input, one sigmoid output) is built with
+fixed weights and loaded through engine.load_engine like the app does. The
+images are synthetic chest-film-like JPEGs generated in memory. Stages:
+
+    decode          decode_image + JPEG draft decode of the upload bytes
+    preprocess      grayscale, resize, CLAHE, normalize into the batch buffer
+    inference       forward pass only (label and confidence)
+    inference+saliency  the fused forward/backward pass used by predict()
+                    (--explain-method: gradcam, gradient or smoothgrad)
+    render          saliency colormap and overlay
+    artifact write  original + CLAHE/saliency/overlay files in an UploadStore
+    db insert       db.insert_history per image, against an SQLite stand-in
+
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --batch-sizes 1 8 64 --update-baseline
+    python benchmarks/bench_pipeline.py --model modelPneumonia.h5 --tolerance 0.2
+
+Results (median ms per batch and per image) are written to --output, then
+compared with the baseline: any stage that got more than --tolerance slower
+per image fails the run with exit status 1. Without a baseline file the run
+fails with exit status 2 instead of passing silently. Baselines are
+machine-specific: record one with --update-baseline on the machine that
+runs the check, or pass --no-check to only record results.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db
+from explain import EXPLAIN_METHODS
+from preprocessing import IMAGE_SIZE, batch_buffers, decode_image, preprocess_into
+from render import render_batch, write_artifacts, write_heatmap
+from storage import UploadStore
+
+BATCH_SIZES = (1, 2, 4, 8, 16, 32, 64)
+STAGES = ('decode', 'preprocess', 'inference', 'inference+saliency', 'render', 'artifact write', 'db insert')
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+DEFAULT_OUTPUT = os.path.join(ROOT, 'benchmarks', 'results.json')
+
+HISTORY_SCHEMA = """
+CREATE TABLE history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER, filename TEXT, prediction TEXT, confidence TEXT,
+    clahe_filename TEXT, saliency_filename TEXT, overlay_filename TEXT,
+    image_hash TEXT, model_version TEXT, confidence_value REAL, label TEXT,
+    artifact_status TEXT, image_key TEXT, explain_method TEXT,
+    timestamp TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX idx_history_image_hash ON history (image_hash, model_version);
+CREATE TABLE prediction_stats (
+    id INTEGER PRIMARY KEY, total_predictions INTEGER, normal_predictions INTEGER,
+    pneumonia_predictions INTEGER, confidence_sum REAL
+);
+INSERT INTO prediction_stats VALUES (1, 0, 0, 0, 0);
+"""
+
+
+class _Cursor:
+    """sqlite3 cursor accepting the MySQL %s placeholders used in db.py"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(sql.replace('%s', '?'), params)
+
+    def executemany(self, sql, rows):
+        self._cursor.executemany(sql.replace('%s', '?'), rows)
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+
+class SqliteConnection:
+    """Local stand-in for a pooled MySQL connection (measures db.py's own cost, not network round-trips)"""
+
+    def __init__(self):
+        self._connection = sqlite3.connect(':memory:', check_same_thread=False)
+        self._connection.executescript(HISTORY_SCHEMA)
+
+    def cursor(self):
+        return _Cursor(self._connection.cursor())
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+
+def build_standin_model(path, seed=0):
+    """Small CNN with the production contract: (150, 150, 1) -> sigmoid"""
+    import tensorflow as tf
+
+    tf.keras.utils.set_random_seed(seed)
+    model = tf.keras.Sequential([
+        tf.keras.Input((IMAGE_SIZE, IMAGE_SIZE, 1)),
+        tf.keras.layers.Conv2D(32, 3, activation='relu'),
+        tf.keras.layers.MaxPooling2D(),
+        tf.keras.layers.Conv2D(64, 3, activation='relu'),
+        tf.keras.layers.MaxPooling2D(),
+        tf.keras.layers.Conv2D(64, 3, activation='relu'),
+        tf.keras.layers.MaxPooling2D(),
+        tf.keras.layers.Flatten(),
+        tf.keras.layers.Dense(64, activation='relu'),
+        tf.keras.layers.Dense(1, activation='sigmoid'),
+    ])
+    model.save(path)
+    return path
+
+
+def synthetic_xray(size, seed):
+    """JPEG bytes of a film-like image: dark lung fields, rib bands, bright mediastinum, noise"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    img = 0.75 - 0.25 * ((x - 0.5) ** 2 + (y - 0.5) ** 2)
+    for cx in (0.32, 0.68):
+        lung = ((x - cx) / 0.16) ** 2 + ((y - 0.52) / 0.3) ** 2 < 1
+        img = np.where(lung, img - 0.35, img)
+    img += 0.05 * np.sin(40 * y + 6 * np.abs(x - 0.5)) * (np.abs(x - 0.5) > 0.08)
+    img += 0.25 * np.exp(-((x - 0.5) / 0.07) ** 2)
+    img += rng.normal(0, 0.03, (size, size)) + rng.uniform(-0.05, 0.05)
+    buf = io.BytesIO()
+    Image.fromarray((np.clip(img, 0, 1) * 255).astype(np.uint8)).save(buf, 'JPEG', quality=90)
+    return buf.getvalue()
+
+
+def measure(fn, repeat):
+    """Median seconds of `fn()` over `repeat` runs"""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def run_batch(engine, images, batch_size, repeat, store):
+    """Per-stage median seconds for one batch of `batch_size` images"""
+    from cache import image_digest
+
+    data = [images[i % len(images)] for i in range(batch_size)]
+    hashes = [image_digest(d) for d in data]
+    clahe, inputs = batch_buffers(batch_size)
+    decoded = []
+
+    def decode():
+        decoded.clear()
+        for d in data:
+            img = decode_image(d)
+            img.draft('L', (IMAGE_SIZE, IMAGE_SIZE))
+            img.load()
+            decoded.append(img)
+
+    def preprocess():
+        for i, img in enumerate(decoded):
+            preprocess_into(img, clahe[i], inputs[i])
+
+    outputs = {}
+
+    def forward_backward():
+        outputs['probs'], outputs['saliency'] = engine.predict_batch(inputs, saliency=True)
+
+    def render():
+        outputs['rgb'] = render_batch(clahe, outputs['saliency'])
+
+    def write():
+        saliency_rgb, overlay_rgb = outputs['rgb']
+        for i, image_hash in enumerate(hashes):
+            store.put_bytes(store.original_key(image_hash, 'upload.jpg'), data[i])
+            write_artifacts(store.root, *store.artifact_keys(image_hash, 'bench', engine.explain_method), clahe[i],
+                            saliency_rgb[i], overlay_rgb[i], quality=store.quality)
+            write_heatmap(store.root, store.heatmap_key(image_hash, 'bench', engine.explain_method), outputs['saliency'][i])
+
+    def insert():
+        for i, image_hash in enumerate(hashes):
+            result = engine.to_prediction(outputs['probs'][i], None)
+            keys = store.artifact_keys(image_hash, 'bench', engine.explain_method)
+            db.insert_history(1, 'upload.jpg', result.label, f"{result.confidence:.2f}%", *keys,
+                              image_hash=image_hash, model_version='bench',
+                              image_key=store.original_key(image_hash, 'upload.jpg'),
+                              explain_method=engine.explain_method)
+
+    stages = [
+        ('decode', decode),
+        ('preprocess', preprocess),
+        ('inference', lambda: engine.predict_batch(inputs, saliency=False)),
+        ('inference+saliency', forward_backward),
+        ('render', render),
+        ('artifact write', write),
+        ('db insert', insert),
+    ]
+    # One untimed pass: traces the model for this batch shape and fills `outputs`
+    for _, fn in stages:
+        fn()
+    return {name: measure(fn, repeat) for name, fn in stages}
+
+
+def compare(results, baseline, tolerance):
+    """Stages slower per image than baseline * (1 + tolerance), as printable lines"""
+    regressions = []
+    for batch_size, stages in results.items():
+        for stage, current in stages.items():
+            reference = baseline.get(batch_size, {}).get(stage)
+            if reference and current['per_image_ms'] > reference['per_image_ms'] * (1 + tolerance):
+                regressions.append(f"batch {batch_size} {stage}: {current['per_image_ms']:.3f} ms/image "
+                                   f"vs baseline {reference['per_image_ms']:.3f} "
+                                   f"(+{current['per_image_ms'] / reference['per_image_ms'] - 1:.0%})")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the prediction pipeline.")
+    parser.add_argument('--model', help="Keras model file (default: a generated stand-in CNN)")
+    parser.add_argument('--explain-method', default='gradient', choices=EXPLAIN_METHODS,
+                        help="saliency method timed in inference+saliency (default: %(default)s)")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=list(BATCH_SIZES))
+    parser.add_argument('--image-size', type=int, default=2048, help="synthetic film size (default: %(default)s)")
+    parser.add_argument('--images', type=int, default=8, help="distinct synthetic images (default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs per stage (default: %(default)s)")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="results JSON (default: %(default)s)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline JSON (default: %(default)s)")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed per-image slowdown vs the baseline (default: %(default)s)")
+    parser.add_argument('--update-baseline', action='store_true', help="write the results as the new baseline")
+    parser.add_argument('--no-check', action='store_true', help="only record results, skip the baseline comparison")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from engine import load_engine
+
+    with tempfile.TemporaryDirectory() as workdir:
+        model_path = args.model or build_standin_model(os.path.join(workdir, 'standin.h5'))
+        engine, _ = load_engine('keras', model_path, explain_method=args.explain_method)
+        images = [synthetic_xray(args.image_size, seed) for seed in range(args.images)]
+        store = UploadStore(os.path.join(workdir, 'uploads'))
+
+        # db.insert_history runs unchanged; only its connection comes from SQLite
+        connection = SqliteConnection()
+        db.create_connection = lambda: connection
+        db.release_connection = lambda conn: None
+
+        results = {}
+        print(f"{'batch':>5}  " + ''.join(f"{name:>20}" for name in STAGES))
+        for batch_size in args.batch_sizes:
+            seconds = run_batch(engine, images, batch_size, args.repeat, store)
+            results[str(batch_size)] = {
+                stage: {'batch_ms': s * 1000.0, 'per_image_ms': s * 1000.0 / batch_size}
+                for stage, s in seconds.items()
+            }
+            print(f"{batch_size:>5}  " + ''.join(f"{r['per_image_ms']:>17.3f} ms" for r in results[str(batch_size)].values()))
+        print("(median ms per image)")
+
+    import tensorflow as tf
+    report = {
+        'meta': {
+            'model': args.model or 'stand-in CNN',
+            'explain_method': args.explain_method,
+            'image_size': args.image_size,
+            'repeat': args.repeat,
+            'python': platform.python_version(),
+            'tensorflow': tf.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline updated: {args.baseline}")
+        return
+    if args.no_check:
+        return
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}: record one on this machine with --update-baseline "
+              f"(or pass --no-check to only record results)")
+        sys.exit(2)
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"Regressions beyond {args.tolerance:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print(f"No stage slower than the baseline by more than {args.tolerance:.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,480 @@
+"""Load test the app with concurrent simulated users and report latency per route.
+
+Each simulated user has its own login session and picks operations at random
+according to --mix:
+
+    predict   POST /predict with a synthetic chest film (JPEG)
+    history   GET /history/data, the first page of the user's history
+    feedback  POST /feedback on one of the user's earlier predictions
+    admin     GET /admin as an admin user
+
+Two load shapes are supported. By default (closed loop) --concurrency users
+send their next request as soon as the previous one is answered, which
+measures the throughput the server sustains. With --rate, requests arrive as
+a Poisson process at that many per second and are served by --concurrency
+users; latency is measured from the scheduled arrival, so time spent queued
+behind a slow server is included (open loop, no coordinated omission).
+
+Uploads are made unique by appending random bytes after the JPEG end marker
+(decoders ignore them, the image hash changes), so every predict is a cache
+miss unless --hit-ratio sends some of them as repeats of a small hot set.
+
+Against a running server (users are registered on first use; admin traffic
+needs an existing admin account):
+
+    python benchmarks/loadtest.py --url http://127.0.0.1:8000 --admin-user admin --admin-password secret
+
+Or let the harness start serve.py with a stand-in model and the database from
+.env (use a scratch DB_NAME: test users and history rows are written to it),
+so serving configurations can be compared run to run:
+
+    python benchmarks/loadtest.py --launch --workers 1 --env DB_NAME=pneumonia_loadtest --json w1.json
+    python benchmarks/loadtest.py --launch --workers 4 --env DB_NAME=pneumonia_loadtest --json w4.json
+    python benchmarks/loadtest.py --launch --env INFERENCE_MAX_BATCH_SIZE=16 --rate 20 --duration 120
+
+In launch mode the test admin account is promoted directly in that database.
+With --max-error-rate the run exits with status 1 when more requests fail.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import platform
+import queue
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+OPERATIONS = ('predict', 'history', 'feedback', 'admin')
+DEFAULT_MIX = 'predict=6,history=3,feedback=2,admin=1'
+HISTORY_ID = re.compile(rb'id="history_id" value="(\d+)"')
+HISTORY_QUERY = urllib.parse.urlencode({'draw': 1, 'start': 0, 'length': 10,
+                                        'order[0][column]': 0, 'order[0][dir]': 'desc'})
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # A redirect (e.g. to /login) is reported as the response itself
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Client:
+    """One simulated user: its own cookie jar (the Flask session) and prediction history"""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.history_ids = []
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, method, path, body=None, content_type=None):
+        """(status, body); status is 0 when no HTTP response was received"""
+        headers = {'Content-Type': content_type} if content_type else {}
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self._opener.open(req, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+        except (urllib.error.URLError, OSError):
+            return 0, b''
+
+    def post_form(self, path, fields):
+        return self.request('POST', path, urllib.parse.urlencode(fields).encode(),
+                            'application/x-www-form-urlencoded')
+
+    def post_file(self, path, field, filename, data, content_type):
+        boundary = uuid.uuid4().hex
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                f'Content-Type: {content_type}\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+        return self.request('POST', path, body, f'multipart/form-data; boundary={boundary}')
+
+    def login(self, username, password):
+        # Successful logins redirect; a failed one re-renders the form with 200
+        status, _ = self.post_form('/login', {'username': username, 'password': password})
+        return status == 302
+
+
+class Uploads:
+    """Synthetic films to upload; unique per request except for the --hit-ratio share"""
+
+    def __init__(self, count, size, hit_ratio, seed=0):
+        from bench_pipeline import synthetic_xray
+
+        self.images = [synthetic_xray(size, seed + i) for i in range(count)]
+        self.hit_ratio = hit_ratio
+
+    def next(self, rng):
+        data = rng.choice(self.images)
+        if rng.random() < self.hit_ratio:
+            return data
+        return data + rng.randbytes(16)
+
+
+def parse_mix(text):
+    weights = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r} (choose from {', '.join(OPERATIONS)})")
+        weights[name] = float(weight or 1)
+    if not any(weights.values()):
+        raise argparse.ArgumentTypeError("at least one operation needs a positive weight")
+    return weights
+
+
+def run_operation(name, client, admin, uploads, rng):
+    """Perform one operation; returns (route, HTTP status, success)"""
+    if name == 'feedback' and not client.history_ids:
+        # Nothing to rate yet: predict first
+        name = 'predict'
+    if name == 'predict':
+        status, body = client.post_file('/predict', 'image', 'loadtest.jpg', uploads.next(rng), 'image/jpeg')
+        match = HISTORY_ID.search(body) if status == 200 else None
+        if match:
+            client.history_ids.append(int(match.group(1)))
+        return 'POST /predict', status, match is not None
+    if name == 'history':
+        status, body = client.request('GET', f'/history/data?{HISTORY_QUERY}')
+        return 'GET /history/data', status, status == 200 and body.startswith(b'{')
+    if name == 'feedback':
+        status, _ = client.post_form('/feedback', {
+            'history_id': rng.choice(client.history_ids),
+            'is_accurate': rng.choice(('true', 'false')),
+            'usefulness_rating': rng.randint(1, 5),
+            'reason': 'load test',
+        })
+        return 'POST /feedback', status, status == 200
+    status, _ = admin.request('GET', '/admin')
+    return 'GET /admin', status, status == 200
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = []  # (route, started offset, seconds, status, ok)
+        self._lock = threading.Lock()
+
+    def add(self, *sample):
+        with self._lock:
+            self.samples.append(sample)
+
+
+def closed_loop(args, clients, admins, uploads, weights, recorder, t0):
+    """--concurrency users, each sending its next request when the previous one completes"""
+    deadline = t0 + args.warmup + args.duration
+    names, probabilities = list(weights), list(weights.values())
+
+    def user(index):
+        rng = random.Random(args.seed + index)
+        client, admin = clients[index % len(clients)], admins[index % len(admins)] if admins else None
+        while True:
+            started = time.perf_counter()
+            if started >= deadline:
+                return
+            route, status, ok = run_operation(rng.choices(names, probabilities)[0], client, admin, uploads, rng)
+            recorder.add(route, started - t0, time.perf_counter() - started, status, ok)
+            if args.think_time:
+                time.sleep(rng.expovariate(1.0 / args.think_time))
+
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return 0
+
+
+def open_loop(args, clients, admins, uploads, weights, recorder, t0):
+    """Poisson arrivals at --rate per second, served by --concurrency users.
+
+    Returns the number of arrivals still waiting when the run ended.
+    """
+    deadline = t0 + args.warmup + args.duration
+    names, probabilities = list(weights), list(weights.values())
+    arrivals = queue.Queue()
+    late = []
+
+    def schedule():
+        rng = random.Random(args.seed)
+        at = t0
+        while True:
+            at += rng.expovariate(args.rate)
+            if at >= deadline:
+                break
+            arrivals.put((at, rng.choices(names, probabilities)[0]))
+            time.sleep(max(0.0, at - time.perf_counter()))
+        for _ in range(args.concurrency):
+            arrivals.put(None)
+
+    def user(index):
+        rng = random.Random(args.seed + 1 + index)
+        client, admin = clients[index % len(clients)], admins[index % len(admins)] if admins else None
+        while True:
+            item = arrivals.get()
+            if item is None:
+                return
+            scheduled, name = item
+            time.sleep(max(0.0, scheduled - time.perf_counter()))
+            if time.perf_counter() >= deadline:
+                # Still queued when the run ended: the server fell behind the arrival rate
+                late.append(name)
+                continue
+            route, status, ok = run_operation(name, client, admin, uploads, rng)
+            # From the scheduled arrival: includes time queued for a free user
+            recorder.add(route, scheduled - t0, time.perf_counter() - scheduled, status, ok)
+
+    threads = [threading.Thread(target=schedule, daemon=True)]
+    threads += [threading.Thread(target=user, args=(i,), daemon=True) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    threads[0].join()
+    for thread in threads[1:]:
+        thread.join()
+    return len(late)
+
+
+def summarize(samples, warmup, duration):
+    """Per-route and overall statistics over the samples started after the warm-up"""
+    measured = [s for s in samples if s[1] >= warmup]
+    routes = sorted({s[0] for s in measured})
+    report = {}
+    for route in routes + ['all']:
+        rows = [s for s in measured if route == 'all' or s[0] == route]
+        seconds = np.array([s[2] for s in rows]) * 1000.0
+        errors = [s for s in rows if not s[4]]
+        statuses = {}
+        for s in errors:
+            statuses[str(s[3])] = statuses.get(str(s[3]), 0) + 1
+        report[route] = {
+            'requests': len(rows),
+            'throughput_rps': len(rows) / duration,
+            'errors': len(errors),
+            'error_rate': len(errors) / len(rows),
+            'error_statuses': statuses,
+            'mean_ms': float(seconds.mean()),
+            'p50_ms': float(np.percentile(seconds, 50)),
+            'p90_ms': float(np.percentile(seconds, 90)),
+            'p99_ms': float(np.percentile(seconds, 99)),
+            'max_ms': float(seconds.max()),
+        }
+    return report
+
+
+def print_report(report):
+    print(f"{'route':<20}{'requests':>9}{'req/s':>9}{'errors':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for route, r in report.items():
+        print(f"{route:<20}{r['requests']:>9}{r['throughput_rps']:>9.2f}{r['error_rate']:>8.1%}"
+              f"{r['p50_ms']:>10.1f}{r['p90_ms']:>10.1f}{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}")
+    statuses = {route: r['error_statuses'] for route, r in report.items() if r['error_statuses'] and route != 'all'}
+    for route, counts in statuses.items():
+        print(f"  {route} errors by status (0 = no response): "
+              + ', '.join(f"{status}: {count}" for status, count in sorted(counts.items())))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def launch_server(args, workdir, env):
+    """Start serve.py with a stand-in model and wait for /health/ready; returns (process, base URL)"""
+    if not args.model:
+        from bench_pipeline import build_standin_model
+        env.setdefault('MODEL_PATH', build_standin_model(os.path.join(workdir, 'standin.h5')))
+        env.setdefault('MODEL_VERSION', 'loadtest-standin')
+    else:
+        env.setdefault('MODEL_PATH', os.path.abspath(args.model))
+    # Unique uploads would otherwise pile up in static/uploads
+    env.setdefault('UPLOAD_FOLDER', os.path.join(workdir, 'uploads'))
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'init-db'], cwd=ROOT, env=env, check=True)
+
+    port = args.port or free_port()
+    command = [sys.executable, 'serve.py', '--host', '127.0.0.1', '--port', str(port),
+               '--workers', str(args.workers), '--report-interval', '0'] + args.server_arg
+    log = open(os.path.join(workdir, 'server.log'), 'wb')
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+    probe = Client(base_url, timeout=5)
+    deadline = time.monotonic() + args.ready_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        if probe.request('GET', '/health/ready')[0] == 200:
+            print(f"Server ready at {base_url} ({' '.join(command[1:])})")
+            return process, base_url
+        time.sleep(0.5)
+    stop_server(process)
+    log.close()
+    with open(log.name, encoding='utf-8', errors='replace') as f:
+        sys.exit(f"Server did not become ready; last output:\n{f.read()[-2000:]}")
+
+
+def stop_server(process):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def login_users(args, base_url, weights):
+    """Register (first run only) and log in the test users; returns (clients, admin clients)"""
+    clients = []
+    for i in range(args.users):
+        client = Client(base_url, args.timeout)
+        username = f'{args.user_prefix}{i}'
+        # Fails harmlessly when the user exists from an earlier run
+        client.post_form('/register', {'username': username, 'password': args.password})
+        if not client.login(username, args.password):
+            sys.exit(f"Could not log in as {username}")
+        clients.append(client)
+
+    if not weights.get('admin'):
+        return clients, []
+    username, password = args.admin_user, args.admin_password
+    if username is None:
+        if not args.launch:
+            sys.exit("Admin traffic needs --admin-user/--admin-password (or --mix without admin)")
+        # Launch mode shares the database: promote a test account directly
+        from db import get_user_by_username, update_user_role
+        username, password = f'{args.user_prefix}admin', args.password
+        Client(base_url, args.timeout).post_form('/register', {'username': username, 'password': password})
+        update_user_role(get_user_by_username(username)[0], 'admin')
+    admins = []
+    for _ in range(min(args.users, args.concurrency)):
+        admin = Client(base_url, args.timeout)
+        if not admin.login(username, password):
+            sys.exit(f"Could not log in as admin {username}")
+        admins.append(admin)
+    return clients, admins
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test /predict, /history, /feedback and /admin.")
+    target = parser.add_argument_group('target')
+    target.add_argument('--url', default='http://127.0.0.1:8000', help="running server (default: %(default)s)")
+    target.add_argument('--launch', action='store_true', help="start serve.py with a stand-in model instead")
+    target.add_argument('--model', help="with --launch: Keras model file (default: generated stand-in CNN)")
+    target.add_argument('--workers', type=int, default=1, help="with --launch: serve.py workers (default: %(default)s)")
+    target.add_argument('--port', type=int, help="with --launch: port (default: a free port)")
+    target.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help="with --launch: server environment override, repeatable (e.g. INFERENCE_MAX_BATCH_SIZE=16)")
+    target.add_argument('--server-arg', action='append', default=[], metavar='ARG',
+                        help="with --launch: extra serve.py argument, repeatable (e.g. --server-arg=--intra-op-threads=2)")
+    target.add_argument('--ready-timeout', type=float, default=300.0, help="seconds to wait for the model to load")
+
+    load = parser.add_argument_group('load')
+    load.add_argument('--concurrency', type=int, default=8, help="simulated users sending requests (default: %(default)s)")
+    load.add_argument('--rate', type=float, help="open loop: Poisson arrivals per second (default: closed loop)")
+    load.add_argument('--think-time', type=float, default=0.0, help="closed loop: mean pause between requests, seconds")
+    load.add_argument('--duration', type=float, default=60.0, help="measured seconds (default: %(default)s)")
+    load.add_argument('--warmup', type=float, default=10.0, help="unmeasured seconds before (default: %(default)s)")
+    load.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help="operation weights (default: %(default)s)")
+    load.add_argument('--hit-ratio', type=float, default=0.0,
+                      help="share of uploads repeating a hot image, i.e. prediction cache hits (default: %(default)s)")
+    load.add_argument('--images', type=int, default=16, help="distinct synthetic films (default: %(default)s)")
+    load.add_argument('--image-size', type=int, default=1024, help="synthetic film size (default: %(default)s)")
+    load.add_argument('--seed', type=int, default=0)
+
+    users = parser.add_argument_group('users')
+    users.add_argument('--users', type=int, default=8, help="test accounts to log in (default: %(default)s)")
+    users.add_argument('--user-prefix', default='loadtest-', help="test account name prefix (default: %(default)s)")
+    users.add_argument('--password', default='loadtest-password')
+    users.add_argument('--admin-user', help="existing admin account (default with --launch: a promoted test account)")
+    users.add_argument('--admin-password')
+    users.add_argument('--timeout', type=float, default=60.0, help="per-request timeout, seconds")
+
+    output = parser.add_argument_group('output')
+    output.add_argument('--label', help="name of this configuration in the JSON report")
+    output.add_argument('--json', help="write the report to this file")
+    output.add_argument('--max-error-rate', type=float, help="exit with status 1 above this overall error rate")
+    args = parser.parse_args(argv)
+    if args.concurrency < 1 or args.users < 1:
+        parser.error("--concurrency and --users must be at least 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    overrides = dict(item.split('=', 1) for item in args.env)
+    process = None
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            base_url = args.url
+            if args.launch:
+                # The harness talks to the same database as the server it starts
+                os.environ.update(overrides)
+                process, base_url = launch_server(args, workdir, dict(os.environ))
+            clients, admins = login_users(args, base_url, args.mix)
+            uploads = Uploads(args.images, args.image_size, args.hit_ratio, args.seed)
+
+            shape = f"open loop at {args.rate:g}/s" if args.rate else "closed loop"
+            print(f"{shape}, {args.concurrency} concurrent users, {args.warmup:g}s warm-up + {args.duration:g}s measured")
+            recorder = Recorder()
+            t0 = time.perf_counter()
+            run = open_loop if args.rate else closed_loop
+            unstarted = run(args, clients, admins, uploads, args.mix, recorder, t0)
+        finally:
+            if process is not None:
+                stop_server(process)
+
+    if not any(s[1] >= args.warmup for s in recorder.samples):
+        sys.exit("No requests completed after the warm-up")
+    report = summarize(recorder.samples, args.warmup, args.duration)
+    print_report(report)
+    if unstarted:
+        print(f"{unstarted} arrivals were still queued when the run ended (the server fell behind --rate)")
+
+    if args.json:
+        result = {
+            'meta': {
+                'label': args.label,
+                'target': 'launch' if args.launch else args.url,
+                'workers': args.workers if args.launch else None,
+                'env': overrides,
+                'server_args': args.server_arg,
+                'shape': 'open' if args.rate else 'closed',
+                'rate': args.rate,
+                'concurrency': args.concurrency,
+                'duration': args.duration,
+                'warmup': args.warmup,
+                'mix': args.mix,
+                'hit_ratio': args.hit_ratio,
+                'unstarted': unstarted,
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'cpus': os.cpu_count(),
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            },
+            'routes': report,
+        }
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"Report written to {args.json}")
+
+    if args.max_error_rate is not None and report['all']['error_rate'] > args.max_error_rate:
+        print(f"Error rate {report['all']['error_rate']:.1%} above {args.max_error_rate:.1%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def image_digest(data):
+    """SHA-256 hex digest of the uploaded image bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class PredictionCache:
+    """Two-tier cache of prediction results keyed on image content, model version and explanation method.
+
+    The first tier is an in-memory LRU of at most `max_entries` results. On a
+    miss, `persistent_lookup(image_hash, model_version, explain_method)` is consulted (e.g. the
+    history table) and its result is promoted into memory. `validate(entry)`
+    lets the caller reject entries whose artifacts no longer exist.
+    """
+
+    def __init__(self, max_entries=256, persistent_lookup=None, validate=None):
+        self.max_entries = int(max_entries)
+        self.persistent_lookup = persistent_lookup
+        self.validate = validate
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._memory_hits = 0
+        self._persistent_hits = 0
+        self._misses = 0
+
+    def _is_valid(self, entry):
+        return entry is not None and (self.validate is None or self.validate(entry))
+
+    def get(self, image_hash, model_version, explain_method):
+        key = (image_hash, model_version, explain_method)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._is_valid(entry):
+                    self._entries.move_to_end(key)
+                    self._memory_hits += 1
+                    return entry
+                del self._entries[key]
+
+        if self.persistent_lookup is not None:
+            entry = self.persistent_lookup(image_hash, model_version, explain_method)
+            if self._is_valid(entry):
+                self.put(image_hash, model_version, explain_method, entry)
+                with self._lock:
+                    self._persistent_hits += 1
+                return entry
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def peek(self, image_hash, model_version, explain_method):
+        """Return the in-memory entry without validation, LRU update or stats"""
+        with self._lock:
+            return self._entries.get((image_hash, model_version, explain_method))
+
+    def put(self, image_hash, model_version, explain_method, entry):
+        if self.max_entries <= 0:
+            return
+        key = (image_hash, model_version, explain_method)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, image_hash, model_version, explain_method):
+        with self._lock:
+            self._entries.pop((image_hash, model_version, explain_method), None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._memory_hits + self._persistent_hits + self._misses
+            hits = self._memory_hits + self._persistent_hits
+            return {
+                'max_entries': self.max_entries,
+                'size': len(self._entries),
+                'memory_hits': self._memory_hits,
+                'persistent_hits': self._persistent_hits,
+                'misses': self._misses,
+                'hit_rate': (hits / lookups) if lookups else 0.0,
+            }
+
+
+class TTLCache:
+    """Small thread-safe cache whose entries expire `ttl` seconds after being stored"""
+
+    def __init__(self, ttl=60.0, max_entries=1024):
+        self.ttl = float(ttl)
+        self.max_entries = int(max_entries)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                expires_at, value = item
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._entries[key]
+            self._misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ttl': self.ttl,
+                'max_entries': self.max_entries,
+                'size': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses,
+            }
@@ -1,21 +1,170 @@
+import functools
+import logging
+import threading
+import time
 import mysql.connector
-from mysql.connector import Error
-from env import DB_CONFIG
+from mysql.connector import Error, pooling
+from mysql.connector.errors import PoolError
+from flask import g, has_app_context
+from env import DB_CONFIG, DB_POOL_SIZE, DB_POOL_TIMEOUT
 from werkzeug.security import generate_password_hash, check_password_hash
+from metrics import DB_QUERY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+# One slot per pooled connection: waiting for a free connection blocks on this instead of polling the pool
+_pool_slots = threading.BoundedSemaphore(DB_POOL_SIZE)
+_stats_lock = threading.Lock()
+_pool_stats = {
+    'checkouts': 0,
+    'request_reuses': 0,
+    'waits': 0,
+    'timeouts': 0,
+    'in_use': 0,
+    'total_wait_ms': 0.0,
+    'max_wait_ms': 0.0,
+}
+
+class PoolExhausted(Exception):
+    """No pooled connection became free within DB_POOL_TIMEOUT"""
+
+def _get_pool():
+    """Create the shared connection pool on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pooling.MySQLConnectionPool(pool_name='pneumonia_pool', pool_size=DB_POOL_SIZE,
+                                                    pool_reset_session=True, **DB_CONFIG)
+                logger.info("Connected to MySQL database (pool of %d connections)", DB_POOL_SIZE)
+    return _pool
+
+def _checkout():
+    """Take a connection from the pool, blocking up to DB_POOL_TIMEOUT seconds if it is exhausted.
+
+    The pool pings each connection as it is handed out and reconnects it if the
+    server has dropped it, so stale connections are never returned.
+    """
+    pool = _get_pool()
+    started = time.perf_counter()
+    waited = not _pool_slots.acquire(blocking=False)
+    if waited and not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        with _stats_lock:
+            _pool_stats['timeouts'] += 1
+        raise PoolError("No pooled connection available")
+    try:
+        connection = pool.get_connection()
+    except Exception:
+        _pool_slots.release()
+        raise
+    wait_ms = (time.perf_counter() - started) * 1000.0
+    with _stats_lock:
+        _pool_stats['checkouts'] += 1
+        _pool_stats['in_use'] += 1
+        _pool_stats['total_wait_ms'] += wait_ms
+        _pool_stats['max_wait_ms'] = max(_pool_stats['max_wait_ms'], wait_ms)
+        if waited:
+            _pool_stats['waits'] += 1
+    return connection
+
+def _return_to_pool(connection):
+    with _stats_lock:
+        _pool_stats['in_use'] -= 1
+    try:
+        connection.close()  # Returns a pooled connection to the pool
+    finally:
+        _pool_slots.release()
 
 def create_connection():
-    """Create a database connection to MySQL"""
-    connection = None
+    """Get a pooled connection to MySQL.
+
+    Inside a Flask request the same connection is reused by every query until
+    the app context is torn down (see close_request_connection), unless the
+    request gave it back early with release_request_connection(). Outside a
+    request (background threads, CLI) each call checks out its own connection.
+    Raises PoolExhausted when no connection becomes free within
+    DB_POOL_TIMEOUT; other connection errors return None.
+    """
+    pinned = has_app_context() and not g.get('_db_unpinned', False)
+    if pinned:
+        connection = g.get('_db_connection')
+        if connection is not None:
+            with _stats_lock:
+                _pool_stats['request_reuses'] += 1
+            return connection
     try:
-        connection = mysql.connector.connect(**DB_CONFIG)
-        if connection.is_connected():
-            print("Connected to MySQL database")
+        connection = _checkout()
+    except PoolError as e:
+        logger.warning("Connection pool exhausted (%d connections) after %.0f s", DB_POOL_SIZE, DB_POOL_TIMEOUT)
+        raise PoolExhausted(str(e)) from e
     except Error as e:
-        print(f"Error while connecting to MySQL: {e}")
+        logger.error("Error while connecting to MySQL: %s", e)
+        return None
+    if pinned:
+        g._db_connection = connection
     return connection
 
+def release_connection(connection):
+    """Give a connection back unless it belongs to the current request"""
+    if has_app_context() and g.get('_db_connection') is connection:
+        return
+    _return_to_pool(connection)
+
+def release_request_connection():
+    """Give the request's connection back now and check out per query for the rest of the request.
+
+    For requests that go on to wait for something slow (an inference batch) or
+    stream their response, so they do not hold a connection meanwhile.
+    """
+    g._db_unpinned = True
+    close_request_connection()
+
+def close_request_connection(exception=None):
+    """Return the request's connection to the pool (registered as a teardown_appcontext handler)"""
+    connection = g.pop('_db_connection', None)
+    if connection is not None:
+        _return_to_pool(connection)
+
+def get_pool_stats():
+    """Connection pool usage and wait metrics"""
+    with _stats_lock:
+        stats = dict(_pool_stats)
+    checkouts = stats['checkouts']
+    stats['pool_size'] = DB_POOL_SIZE
+    stats['avg_wait_ms'] = (stats['total_wait_ms'] / checkouts) if checkouts else 0.0
+    return stats
+
+def _timed(func):
+    """Record the duration of a database operation and count it towards the current request"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, func.__name__)
+            if has_app_context():
+                g._db_queries = g.get('_db_queries', 0) + 1
+    return wrapper
+
+def _ensure_index(cursor, table, index_name, columns):
+    """Create an index if it does not exist yet"""
+    cursor.execute("""
+        SELECT COUNT(*) 
+        FROM INFORMATION_SCHEMA.STATISTICS 
+        WHERE TABLE_SCHEMA = DATABASE() 
+        AND TABLE_NAME = %s 
+        AND INDEX_NAME = %s
+    """, (table, index_name))
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"CREATE INDEX {index_name} ON {table} ({columns})")
+        logger.info("Added index %s on %s", index_name, table)
+
 def init_db():
     """Create the users and history tables if they don't exist and update structure if needed"""
+    seed_stats = False
     connection = create_connection()
     if connection is not None:
         try:
@@ -57,7 +206,7 @@ def init_db():
                 result = cursor.fetchone()
                 if result[0] == 0:  # Column doesn't exist
                     cursor.execute("ALTER TABLE history ADD COLUMN clahe_filename TEXT NULL")
-                    print("Added clahe_filename column to history table")
+                    logger.info("Added clahe_filename column to history table")
                 
                 # Check if saliency_filename column exists
                 cursor.execute("""
@@ -70,7 +219,7 @@ def init_db():
                 result = cursor.fetchone()
                 if result[0] == 0:  # Column doesn't exist
                     cursor.execute("ALTER TABLE history ADD COLUMN saliency_filename TEXT NULL")
-                    print("Added saliency_filename column to history table")
+                    logger.info("Added saliency_filename column to history table")
                 
                 # Check if overlay_filename column exists
                 cursor.execute("""
@@ -83,9 +232,94 @@ def init_db():
                 result = cursor.fetchone()
                 if result[0] == 0:  # Column doesn't exist
                     cursor.execute("ALTER TABLE history ADD COLUMN overlay_filename TEXT NULL")
-                    print("Added overlay_filename column to history table")
+                    logger.info("Added overlay_filename column to history table")
+
+                # Check if image_hash column exists (content-addressed prediction cache)
+                cursor.execute("""
+                    SELECT COUNT(*) 
+                    FROM INFORMATION_SCHEMA.COLUMNS 
+                    WHERE TABLE_SCHEMA = DATABASE() 
+                    AND TABLE_NAME = 'history' 
+                    AND COLUMN_NAME = 'image_hash'
+                """)
+                result = cursor.fetchone()
+                if result[0] == 0:  # Column doesn't exist
+                    cursor.execute("ALTER TABLE history ADD COLUMN image_hash CHAR(64) NULL")
+                    cursor.execute("ALTER TABLE history ADD COLUMN model_version VARCHAR(64) NULL")
+                    cursor.execute("CREATE INDEX idx_history_image_hash ON history (image_hash, model_version)")
+                    logger.info("Added image_hash and model_version columns to history table")
+
+                # Check if typed confidence_value/label columns exist
+                cursor.execute("""
+                    SELECT COUNT(*) 
+                    FROM INFORMATION_SCHEMA.COLUMNS 
+                    WHERE TABLE_SCHEMA = DATABASE() 
+                    AND TABLE_NAME = 'history' 
+                    AND COLUMN_NAME = 'confidence_value'
+                """)
+                result = cursor.fetchone()
+                if result[0] == 0:  # Column doesn't exist
+                    cursor.execute("ALTER TABLE history ADD COLUMN confidence_value DECIMAL(5,2) NULL")
+                    cursor.execute("ALTER TABLE history ADD COLUMN label ENUM('Normal', 'Pneumonia') NULL")
+                    logger.info("Added confidence_value and label columns to history table")
+
+                # Check if artifact_status column exists
+                cursor.execute("""
+                    SELECT COUNT(*) 
+                    FROM INFORMATION_SCHEMA.COLUMNS 
+                    WHERE TABLE_SCHEMA = DATABASE() 
+                    AND TABLE_NAME = 'history' 
+                    AND COLUMN_NAME = 'artifact_status'
+                """)
+                result = cursor.fetchone()
+                if result[0] == 0:  # Column doesn't exist
+                    cursor.execute("ALTER TABLE history ADD COLUMN artifact_status ENUM('pending', 'ready', 'failed', 'none') NOT NULL DEFAULT 'ready'")
+                    logger.info("Added artifact_status column to history table")
+
+                # Check if artifact_status allows 'none' (scored offline without visualizations)
+                cursor.execute("""
+                    SELECT COLUMN_TYPE
+                    FROM INFORMATION_SCHEMA.COLUMNS 
+                    WHERE TABLE_SCHEMA = DATABASE() 
+                    AND TABLE_NAME = 'history' 
+                    AND COLUMN_NAME = 'artifact_status'
+                """)
+                if "'none'" not in cursor.fetchone()[0]:
+                    cursor.execute("ALTER TABLE history MODIFY COLUMN artifact_status ENUM('pending', 'ready', 'failed', 'none') NOT NULL DEFAULT 'ready'")
+                    # Rows written by score.py without --artifacts have an image hash but no artifact files
+                    cursor.execute("""
+                        UPDATE history SET artifact_status = 'none'
+                        WHERE image_hash IS NOT NULL AND clahe_filename IS NULL
+                    """)
+                    logger.info("Added 'none' to history.artifact_status and marked %d rows without artifacts", cursor.rowcount)
+
+                # Check if image_key column exists (upload store key of the original image)
+                cursor.execute("""
+                    SELECT COUNT(*) 
+                    FROM INFORMATION_SCHEMA.COLUMNS 
+                    WHERE TABLE_SCHEMA = DATABASE() 
+                    AND TABLE_NAME = 'history' 
+                    AND COLUMN_NAME = 'image_key'
+                """)
+                result = cursor.fetchone()
+                if result[0] == 0:  # Column doesn't exist
+                    cursor.execute("ALTER TABLE history ADD COLUMN image_key VARCHAR(255) NULL")
+                    logger.info("Added image_key column to history table")
+
+                # Check if explain_method column exists (saliency map method; NULL = input gradients)
+                cursor.execute("""
+                    SELECT COUNT(*) 
+                    FROM INFORMATION_SCHEMA.COLUMNS 
+                    WHERE TABLE_SCHEMA = DATABASE() 
+                    AND TABLE_NAME = 'history' 
+                    AND COLUMN_NAME = 'explain_method'
+                """)
+                result = cursor.fetchone()
+                if result[0] == 0:  # Column doesn't exist
+                    cursor.execute("ALTER TABLE history ADD COLUMN explain_method VARCHAR(16) NULL")
+                    logger.info("Added explain_method column to history table")
             except Error as e:
-                print(f"Note: {e}")
+                logger.warning("Note: %s", e)
             
             # Create feedback table
             cursor.execute("""
@@ -100,42 +334,111 @@ def init_db():
                 )
             """)
             
+            # Create single-row rollup of prediction/feedback counters
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS prediction_stats (
+                    id TINYINT PRIMARY KEY,
+                    total_predictions INT NOT NULL DEFAULT 0,
+                    normal_predictions INT NOT NULL DEFAULT 0,
+                    pneumonia_predictions INT NOT NULL DEFAULT 0,
+                    confidence_sum DECIMAL(16,2) NOT NULL DEFAULT 0,
+                    total_feedback INT NOT NULL DEFAULT 0,
+                    accurate_feedback INT NOT NULL DEFAULT 0,
+                    rating_none INT NOT NULL DEFAULT 0,
+                    rating_1 INT NOT NULL DEFAULT 0,
+                    rating_2 INT NOT NULL DEFAULT 0,
+                    rating_3 INT NOT NULL DEFAULT 0,
+                    rating_4 INT NOT NULL DEFAULT 0,
+                    rating_5 INT NOT NULL DEFAULT 0
+                )
+            """)
+            cursor.execute("INSERT IGNORE INTO prediction_stats (id) VALUES (1)")
+            if cursor.rowcount == 1:
+                # The rollup row is new: seed it from existing rows once the schema is committed
+                cursor.execute("SELECT EXISTS(SELECT 1 FROM history)")
+                seed_stats = bool(cursor.fetchone()[0])
+            
+            # Indexes for keyset pagination (timestamp, id) and feedback lookups
+            _ensure_index(cursor, 'history', 'idx_history_user_ts', 'user_id, timestamp, id')
+            _ensure_index(cursor, 'history', 'idx_history_ts', 'timestamp, id')
+            _ensure_index(cursor, 'history', 'idx_history_confidence', 'confidence_value, id')
+            _ensure_index(cursor, 'feedback', 'idx_feedback_history', 'history_id')
+            _ensure_index(cursor, 'feedback', 'idx_feedback_created', 'created_at, id')
+            
             connection.commit()
-            print("Database initialized and updated successfully")
+            logger.info("Database initialized and updated successfully")
         except Error as e:
-            print(f"Error while initializing database: {e}")
+            logger.error("Error while initializing database: %s", e)
+            seed_stats = False
         finally:
             cursor.close()
-            connection.close()
+            release_connection(connection)
+    if seed_stats:
+        logger.info("prediction_stats was just created: seeding it from existing history and feedback")
+        backfill_history_columns()
+        rebuild_prediction_stats()
+
+LABELS = ('Normal', 'Pneumonia')
+RATING_COLUMNS = {None: 'rating_none', 1: 'rating_1', 2: 'rating_2', 3: 'rating_3', 4: 'rating_4', 5: 'rating_5'}
+
+def parse_confidence(confidence):
+    """Convert a stored confidence such as "93.12%" to a number (None if it is not numeric)"""
+    try:
+        return round(float(str(confidence).strip().rstrip('%')), 2)
+    except (TypeError, ValueError):
+        return None
+
+def _bump_prediction_stats(cursor, predictions):
+    """Add (label, confidence_value) pairs to the prediction_stats rollup in the caller's transaction"""
+    cursor.execute("""
+        UPDATE prediction_stats
+        SET total_predictions = total_predictions + %s,
+            normal_predictions = normal_predictions + %s,
+            pneumonia_predictions = pneumonia_predictions + %s,
+            confidence_sum = confidence_sum + %s
+        WHERE id = 1
+    """, (len(predictions),
+          sum(1 for label, _ in predictions if label == 'Normal'),
+          sum(1 for label, _ in predictions if label == 'Pneumonia'),
+          sum(value for _, value in predictions if value is not None)))
 
-def insert_history(user_id, filename, prediction, confidence, clahe_filename=None, saliency_filename=None, overlay_filename=None):
-    """Insert a new record into the history table"""
-    print(f"DEBUG: Inserting history for user_id={user_id}, filename={filename}")
+@_timed
+def insert_history(user_id, filename, prediction, confidence, clahe_filename=None, saliency_filename=None, overlay_filename=None,
+                   image_hash=None, model_version=None, artifact_status='ready', image_key=None, explain_method=None):
+    """Insert a new record into the history table and update the prediction_stats rollup"""
+    logger.debug("Inserting history for user_id=%s, filename=%s", user_id, filename)
+    confidence_value = parse_confidence(confidence)
+    label = prediction if prediction in LABELS else None
     connection = create_connection()
     if connection is not None:
         try:
             cursor = connection.cursor()
             cursor.execute("""
-                INSERT INTO history (user_id, filename, prediction, confidence, clahe_filename, saliency_filename, overlay_filename)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (user_id, filename, prediction, confidence, clahe_filename, saliency_filename, overlay_filename))
+                INSERT INTO history (user_id, filename, prediction, confidence, clahe_filename, saliency_filename, overlay_filename,
+                                     image_hash, model_version, confidence_value, label, artifact_status, image_key,
+                                     explain_method)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (user_id, filename, prediction, confidence, clahe_filename, saliency_filename, overlay_filename,
+                  image_hash, model_version, confidence_value, label, artifact_status, image_key, explain_method))
+            last_id = cursor.lastrowid
+            _bump_prediction_stats(cursor, [(label, confidence_value)])
             connection.commit()
-            print("Record inserted successfully")
+            logger.debug("Record inserted successfully")
             # Return the last inserted id
-            last_id = cursor.lastrowid
-            print(f"DEBUG: Inserted history record with ID: {last_id}")
+            logger.debug("Inserted history record with ID: %s", last_id)
             return last_id
         except Error as e:
-            print(f"Error while inserting record: {e}")
+            logger.error("Error while inserting record: %s", e)
             return None
         finally:
             cursor.close()
-            connection.close()
+            release_connection(connection)
     return None
 
+@_timed
 def get_all_history(user_id=None):
     """Retrieve all records from the history table, optionally filtered by user_id"""
-    print(f"DEBUG: Getting history for user_id={user_id}")
+    logger.debug("Getting history for user_id=%s", user_id)
     connection = create_connection()
     records = []
     if connection is not None:
@@ -145,21 +448,274 @@ def get_all_history(user_id=None):
                 cursor.execute("""SELECT id, user_id, filename, prediction, confidence, 
                                clahe_filename, saliency_filename, overlay_filename, timestamp 
                                FROM history WHERE user_id = %s ORDER BY timestamp DESC""", (user_id,))
-                print(f"DEBUG: Executing query for user_id {user_id}")
+                logger.debug("Executing query for user_id %s", user_id)
             else:
                 cursor.execute("""SELECT h.id, h.user_id, h.filename, h.prediction, h.confidence, 
                                h.clahe_filename, h.saliency_filename, h.overlay_filename, h.timestamp, u.username 
                                FROM history h JOIN users u ON h.user_id = u.id ORDER BY h.timestamp DESC""")
-                print("DEBUG: Executing query for all users")
+                logger.debug("Executing query for all users")
+            records = cursor.fetchall()
+            logger.debug("Retrieved %d records", len(records))
+        except Error as e:
+            logger.error("Error while retrieving records: %s", e)
+        finally:
+            cursor.close()
+            release_connection(connection)
+    return records
+
+@_timed
+def insert_history_many(rows):
+    """Insert many history records and their prediction_stats rollup in one transaction.
+
+    Each row is (user_id, filename, prediction, confidence, clahe_filename,
+    saliency_filename, overlay_filename, image_hash, model_version, image_key,
+    explain_method, artifact_status).
+    Returns the number of inserted rows.
+    """
+    if not rows:
+        return 0
+    connection = create_connection()
+    if connection is not None:
+        try:
+            cursor = connection.cursor()
+            typed = [(row[2] if row[2] in LABELS else None, parse_confidence(row[3])) for row in rows]
+            cursor.executemany("""
+                INSERT INTO history (user_id, filename, prediction, confidence, clahe_filename, saliency_filename, overlay_filename,
+                                     image_hash, model_version, image_key, explain_method, artifact_status,
+                                     confidence_value, label)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, [tuple(row) + (value, label) for row, (label, value) in zip(rows, typed)])
+            inserted = cursor.rowcount
+            _bump_prediction_stats(cursor, typed)
+            connection.commit()
+            return inserted
+        except Error as e:
+            logger.error("Error while inserting records: %s", e)
+            return 0
+        finally:
+            cursor.close()
+            release_connection(connection)
+    return 0
+
+@_timed
+def get_history_by_image_hash(image_hash, model_version, explain_method):
+    """Get the most recent prediction for an image hash made by the given model version and explanation method.
+
+    Only rows with stored artifacts qualify; rows scored without visualizations would fail
+    validation and hide an older usable row.
+    """
+    connection = create_connection()
+    if connection is not None:
+        try:
+            cursor = connection.cursor()
+            cursor.execute("""
+                SELECT filename, prediction, confidence, clahe_filename, saliency_filename, overlay_filename, image_key,
+                       explain_method
+                FROM history
+                WHERE image_hash = %s AND model_version = %s AND COALESCE(explain_method, 'gradient') = %s
+                AND artifact_status <> 'none' AND clahe_filename IS NOT NULL
+                AND saliency_filename IS NOT NULL AND overlay_filename IS NOT NULL
+                ORDER BY id DESC
+                LIMIT 1
+            """, (image_hash, model_version, explain_method))
+            return cursor.fetchone()
+        except Error as e:
+            logger.error("Error while retrieving cached prediction: %s", e)
+            return None
+        finally:
+            cursor.close()
+            release_connection(connection)
+    return None
+
+@_timed
+def update_artifact_status(image_hash, model_version, explain_method, status):
+    """Set artifact_status of the pending history rows for an image hash, model version and explanation method.
+
+    READY also replaces FAILED: the renderer's result is authoritative, even
+    when a status poll on another worker has already given the job up.
+    """
+    previous = ('pending', 'failed') if status == 'ready' else ('pending',)
+    connection = create_connection()
+    if connection is not None:
+        try:
+            cursor = connection.cursor()
+            cursor.execute(f"""
+                UPDATE history SET artifact_status = %s
+                WHERE image_hash = %s AND model_version = %s AND COALESCE(explain_method, 'gradient') = %s
+                AND artifact_status IN ({', '.join(['%s'] * len(previous))})
+            """, (status, image_hash, model_version, explain_method, *previous))
+            connection.commit()
+            return cursor.rowcount
+        except Error as e:
+            logger.error("Error while updating artifact status: %s", e)
+            return None
+        finally:
+            cursor.close()
+            release_connection(connection)
+    return None
+
+@_timed
+def get_history_artifacts(history_id):
+    """Get (user_id, artifact_status, clahe_filename, saliency_filename, overlay_filename, image_hash, model_version,
+    explain_method, age in seconds) of one history row"""
+    connection = create_connection()
+    if connection is not None:
+        try:
+            cursor = connection.cursor()
+            cursor.execute("""
+                SELECT user_id, artifact_status, clahe_filename, saliency_filename, overlay_filename,
+                       image_hash, model_version, COALESCE(explain_method, 'gradient'),
+                       TIMESTAMPDIFF(SECOND, timestamp, NOW())
+                FROM history WHERE id = %s
+            """, (history_id,))
+            return cursor.fetchone()
+        except Error as e:
+            logger.error("Error while retrieving artifact status: %s", e)
+            return None
+        finally:
+            cursor.close()
+            release_connection(connection)
+    return None
+
+# Searches (LIKE '%...%', no index) count at most this many matches past the current page;
+# a capped count is reported as "at least" so the UI can still offer the next page
+PAGE_COUNT_CAP = 10000
+
+HISTORY_COLUMNS = """h.id, h.user_id, h.filename, h.prediction, h.confidence,
+                     h.clahe_filename, h.saliency_filename, h.overlay_filename, h.timestamp"""
+HISTORY_SORT_COLUMNS = {
+    'username': 'u.username',
+    'filename': 'h.filename',
+    'prediction': 'h.prediction',
+    'confidence': 'h.confidence_value',
+    'timestamp': 'h.timestamp',
+}
+FEEDBACK_SORT_COLUMNS = {
+    'username': 'u.username',
+    'filename': 'h.filename',
+    'is_accurate': 'f.is_accurate',
+    'usefulness_rating': 'f.usefulness_rating',
+    'reason': 'f.reason',
+    'created_at': 'f.created_at',
+}
+
+def _count_total(cursor, count_sql, params, stats_column):
+    """Exact row count: from the prediction_stats rollup when `stats_column` is given, else COUNT(*)"""
+    if stats_column:
+        cursor.execute(f"SELECT {stats_column} FROM prediction_stats WHERE id = 1")
+        row = cursor.fetchone()
+        if row is not None:
+            return row[0]
+    cursor.execute(f"SELECT COUNT(*) FROM {count_sql}", tuple(params))
+    return cursor.fetchone()[0]
+
+def _count_capped(cursor, from_sql, where, params, cap):
+    """COUNT(*) of at most `cap` rows; returns (count, capped)"""
+    cursor.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM {from_sql}{where} LIMIT %s) AS capped",
+                   (*params, cap))
+    count = cursor.fetchone()[0]
+    return count, count >= cap
+
+def _fetch_page(columns_sql, from_sql, filters, params, search_columns, search,
+                sort_column, descending, keyset_columns, after, offset, limit, count_sql, stats_column=None):
+    """Fetch one sorted page plus total and filtered counts.
+
+    When sorting by the keyset timestamp column and `after` holds the
+    (timestamp, id) of the previous page's last row, the page is read with a
+    range condition instead of OFFSET, so its cost does not grow with depth.
+
+    `total` is exact: read from the prediction_stats rollup (`stats_column`)
+    for unfiltered tables, or counted over `count_sql` (an indexed filter on
+    the base table, without joins). A search is counted up to PAGE_COUNT_CAP
+    rows past the current page; `filtered_capped` is True when there are at
+    least `filtered` matches. Returns (rows, total, filtered, filtered_capped).
+    """
+    connection = create_connection()
+    if connection is None:
+        return [], 0, 0, False
+    try:
+        cursor = connection.cursor()
+        where = list(filters)
+        params = list(params)
+        total = _count_total(cursor, count_sql, params, stats_column if not filters else None)
+
+        filtered, filtered_capped = total, False
+        if search:
+            where.append("(" + " OR ".join(f"{column} LIKE %s" for column in search_columns) + ")")
+            params.extend([f"%{search}%"] * len(search_columns))
+            search_where = " WHERE " + " AND ".join(where)
+            filtered, filtered_capped = _count_capped(cursor, from_sql, search_where, params,
+                                                      offset + limit + PAGE_COUNT_CAP)
+
+        ts_column, id_column = keyset_columns
+        direction = "DESC" if descending else "ASC"
+        if after is not None and sort_column == ts_column:
+            op = "<" if descending else ">"
+            where.append(f"({ts_column} {op} %s OR ({ts_column} = %s AND {id_column} {op} %s))")
+            params.extend([after[0], after[0], after[1]])
+            offset = 0
+        page_where = (" WHERE " + " AND ".join(where)) if where else ""
+        cursor.execute(f"""SELECT {columns_sql} FROM {from_sql}{page_where}
+                           ORDER BY {sort_column} {direction}, {id_column} {direction}
+                           LIMIT %s OFFSET %s""", (*params, limit, offset))
+        return cursor.fetchall(), total, filtered, filtered_capped
+    except Error as e:
+        logger.error("Error while retrieving page: %s", e)
+        return [], 0, 0, False
+    finally:
+        cursor.close()
+        release_connection(connection)
+
+@_timed
+def get_history_page(user_id=None, limit=10, offset=0, after=None, search=None, sort='timestamp', descending=True):
+    """Get one page of history, optionally filtered by user_id.
+
+    Rows have the columns of get_all_history() followed by username (NULL when
+    filtered by user_id), artifact_status and image_key. Returns (rows, total,
+    filtered, filtered_capped), see _fetch_page.
+    """
+    sort_column = HISTORY_SORT_COLUMNS.get(sort, 'h.timestamp')
+    if user_id:
+        # Counted on idx_history_user_ts
+        return _fetch_page(HISTORY_COLUMNS + ", NULL, h.artifact_status, h.image_key", "history h", ["h.user_id = %s"], [user_id],
+                           ["h.filename", "h.prediction"], search, sort_column, descending,
+                           ("h.timestamp", "h.id"), after, offset, limit, "history h WHERE h.user_id = %s")
+    return _fetch_page(HISTORY_COLUMNS + ", u.username, h.artifact_status, h.image_key", "history h JOIN users u ON h.user_id = u.id", [], [],
+                       ["h.filename", "h.prediction", "u.username"], search, sort_column, descending,
+                       ("h.timestamp", "h.id"), after, offset, limit, "history", 'total_predictions')
+
+@_timed
+def get_feedback_page(limit=10, offset=0, after=None, search=None, sort='created_at', descending=True):
+    """Get one page of feedback with the same columns as get_all_feedback().
+
+    Returns (rows, total, filtered, filtered_capped), see _fetch_page.
+    """
+    sort_column = FEEDBACK_SORT_COLUMNS.get(sort, 'f.created_at')
+    return _fetch_page("f.*, h.filename, h.prediction, h.confidence, u.username",
+                       "feedback f JOIN history h ON f.history_id = h.id JOIN users u ON h.user_id = u.id", [], [],
+                       ["u.username", "h.filename", "f.reason"], search, sort_column, descending,
+                       ("f.created_at", "f.id"), after, offset, limit, "feedback", 'total_feedback')
+
+@_timed
+def get_recent_history(limit=5):
+    """Get the most recent predictions of all users, bounded by `limit`"""
+    connection = create_connection()
+    records = []
+    if connection is not None:
+        try:
+            cursor = connection.cursor()
+            cursor.execute(f"""SELECT {HISTORY_COLUMNS}, u.username
+                               FROM history h JOIN users u ON h.user_id = u.id
+                               ORDER BY h.timestamp DESC, h.id DESC LIMIT %s""", (limit,))
             records = cursor.fetchall()
-            print(f"DEBUG: Retrieved {len(records)} records")
         except Error as e:
-            print(f"Error while retrieving records: {e}")
+            logger.error("Error while retrieving records: %s", e)
         finally:
             cursor.close()
-            connection.close()
+            release_connection(connection)
     return records
 
+@_timed
 def register_user(username, password):
     """Register a new user"""
     connection = create_connection()
@@ -172,16 +728,17 @@ def register_user(username, password):
                 VALUES (%s, %s)
             """, (username, hashed_password))
             connection.commit()
-            print("User registered successfully")
+            logger.info("User registered: %s", username)
             return True
         except Error as e:
-            print(f"Error while registering user: {e}")
+            logger.error("Error while registering user: %s", e)
             return False
         finally:
             cursor.close()
-            connection.close()
+            release_connection(connection)
     return False
 
+@_timed
 def authenticate_user(username, password):
     """Authenticate a user"""
     connection = create_connection()
@@ -194,13 +751,14 @@ def authenticate_user(username, password):
                 return user[0]  # Return user ID
             return None
         except Error as e:
-            print(f"Error while authenticating user: {e}")
+            logger.error("Error while authenticating user: %s", e)
             return None
         finally:
             cursor.close()
-            connection.close()
+            release_connection(connection)
     return None
 
+@_timed
 def get_user_by_id(user_id):
     """Get user by ID"""
     connection = create_connection()
@@ -211,13 +769,32 @@ def get_user_by_id(user_id):
             user = cursor.fetchone()
             return user
         except Error as e:
-            print(f"Error while retrieving user: {e}")
+            logger.error("Error while retrieving user: %s", e)
             return None
         finally:
             cursor.close()
-            connection.close()
+            release_connection(connection)
     return None
 
+@_timed
+def get_user_by_username(username):
+    """Get user by username"""
+    connection = create_connection()
+    if connection is not None:
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT id, username, role FROM users WHERE username = %s", (username,))
+            user = cursor.fetchone()
+            return user
+        except Error as e:
+            logger.error("Error while retrieving user: %s", e)
+            return None
+        finally:
+            cursor.close()
+            release_connection(connection)
+    return None
+
+@_timed
 def get_all_users():
     """Get all users with their prediction count"""
     connection = create_connection()
@@ -234,13 +811,14 @@ def get_all_users():
             users = cursor.fetchall()
             return users
         except Error as e:
-            print(f"Error while retrieving users: {e}")
+            logger.error("Error while retrieving users: %s", e)
             return []
         finally:
             cursor.close()
-            connection.close()
+            release_connection(connection)
     return []
 
+@_timed
 def update_user_role(user_id, role):
     """Update user role"""
     connection = create_connection()
@@ -251,16 +829,65 @@ def update_user_role(user_id, role):
             connection.commit()
             return True
         except Error as e:
-            print(f"Error while updating user role: {e}")
+            logger.error("Error while updating user role: %s", e)
+            return False
+        finally:
+            cursor.close()
+            release_connection(connection)
+    return False
+
+@_timed
+def delete_user(user_id):
+    """Delete a user with their history and feedback (ON DELETE CASCADE).
+
+    Their rows are subtracted from the prediction_stats rollup in the same
+    transaction. Deleting users or history directly in SQL bypasses this;
+    run rebuild_prediction_stats() (flask backfill-stats) afterwards.
+    Returns True when the user existed and was deleted.
+    """
+    connection = create_connection()
+    if connection is not None:
+        try:
+            cursor = connection.cursor()
+            # Lock the rollup row first so concurrent inserts queue behind this transaction
+            cursor.execute("SELECT id FROM prediction_stats WHERE id = 1 FOR UPDATE")
+            cursor.fetchall()
+            cursor.execute("""
+                SELECT COUNT(*), COALESCE(SUM(label = 'Normal'), 0), COALESCE(SUM(label = 'Pneumonia'), 0),
+                       COALESCE(SUM(confidence_value), 0)
+                FROM history WHERE user_id = %s
+            """, (user_id,))
+            predictions = cursor.fetchone()
+            rating_sums = ", ".join(
+                "COALESCE(SUM(f.usefulness_rating IS NULL), 0)" if rating is None else f"COALESCE(SUM(f.usefulness_rating = {rating}), 0)"
+                for rating in RATING_COLUMNS)
+            cursor.execute(f"""
+                SELECT COUNT(*), COALESCE(SUM(f.is_accurate = 1), 0), {rating_sums}
+                FROM feedback f JOIN history h ON f.history_id = h.id
+                WHERE h.user_id = %s
+            """, (user_id,))
+            feedback = cursor.fetchone()
+            columns = ['total_predictions', 'normal_predictions', 'pneumonia_predictions', 'confidence_sum',
+                       'total_feedback', 'accurate_feedback', *RATING_COLUMNS.values()]
+            assignments = ", ".join(f"{column} = {column} - %s" for column in columns)
+            cursor.execute(f"UPDATE prediction_stats SET {assignments} WHERE id = 1", (*predictions, *feedback))
+            cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+            deleted = cursor.rowcount == 1
+            connection.commit()
+            return deleted
+        except Error as e:
+            connection.rollback()
+            logger.error("Error while deleting user: %s", e)
             return False
         finally:
             cursor.close()
-            connection.close()
+            release_connection(connection)
     return False
 
 # Feedback functions
+@_timed
 def insert_feedback(history_id, is_accurate, usefulness_rating, reason=None):
-    """Insert feedback for a prediction"""
+    """Insert feedback for a prediction and update the prediction_stats rollup"""
     connection = create_connection()
     if connection is not None:
         try:
@@ -269,17 +896,26 @@ def insert_feedback(history_id, is_accurate, usefulness_rating, reason=None):
                 INSERT INTO feedback (history_id, is_accurate, usefulness_rating, reason)
                 VALUES (%s, %s, %s, %s)
             """, (history_id, is_accurate, usefulness_rating, reason))
+            rating_column = RATING_COLUMNS.get(usefulness_rating)
+            rating_update = f", {rating_column} = {rating_column} + 1" if rating_column else ""
+            cursor.execute(f"""
+                UPDATE prediction_stats
+                SET total_feedback = total_feedback + 1,
+                    accurate_feedback = accurate_feedback + %s{rating_update}
+                WHERE id = 1
+            """, (1 if is_accurate else 0,))
             connection.commit()
-            print("Feedback inserted successfully")
+            logger.debug("Feedback inserted for history_id=%s", history_id)
             return True
         except Error as e:
-            print(f"Error while inserting feedback: {e}")
+            logger.error("Error while inserting feedback: %s", e)
             return False
         finally:
             cursor.close()
-            connection.close()
+            release_connection(connection)
     return False
 
+@_timed
 def get_feedback_by_history_id(history_id):
     """Get feedback for a specific history record"""
     connection = create_connection()
@@ -290,13 +926,14 @@ def get_feedback_by_history_id(history_id):
             feedback = cursor.fetchone()
             return feedback
         except Error as e:
-            print(f"Error while retrieving feedback: {e}")
+            logger.error("Error while retrieving feedback: %s", e)
             return None
         finally:
             cursor.close()
-            connection.close()
+            release_connection(connection)
     return None
 
+@_timed
 def get_all_feedback():
     """Get all feedback with user and history information"""
     connection = create_connection()
@@ -313,53 +950,141 @@ def get_all_feedback():
             feedback = cursor.fetchall()
             return feedback
         except Error as e:
-            print(f"Error while retrieving feedback: {e}")
+            logger.error("Error while retrieving feedback: %s", e)
             return []
         finally:
             cursor.close()
-            connection.close()
+            release_connection(connection)
     return []
 
+@_timed
 def get_feedback_stats():
-    """Get feedback statistics"""
+    """Get prediction and feedback statistics from the prediction_stats rollup"""
     connection = create_connection()
     if connection is not None:
         try:
-            cursor = connection.cursor()
-            
-            # Total predictions
-            cursor.execute("SELECT COUNT(*) FROM history")
-            total_predictions = cursor.fetchone()[0]
-            
-            # Total feedback
-            cursor.execute("SELECT COUNT(*) FROM feedback")
-            total_feedback = cursor.fetchone()[0]
-            
-            # Accuracy rate
-            cursor.execute("SELECT COUNT(*) FROM feedback WHERE is_accurate = 1")
-            accurate_predictions = cursor.fetchone()[0]
-            
-            accuracy_rate = (accurate_predictions / total_feedback * 100) if total_feedback > 0 else 0
-            
-            # Rating distribution
-            cursor.execute("""
-                SELECT usefulness_rating, COUNT(*) as count
-                FROM feedback
-                GROUP BY usefulness_rating
-                ORDER BY usefulness_rating
-            """)
-            rating_distribution = cursor.fetchall()
+            cursor = connection.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM prediction_stats WHERE id = 1")
+            row = cursor.fetchone()
+            if row is None:
+                return {}
+
+            total_predictions = row['total_predictions']
+            total_feedback = row['total_feedback']
+            accuracy_rate = (row['accurate_feedback'] / total_feedback * 100) if total_feedback > 0 else 0
+            average_confidence = (float(row['confidence_sum']) / total_predictions) if total_predictions > 0 else 0
+
+            # Rating distribution as (rating, count) pairs, like GROUP BY usefulness_rating
+            rating_distribution = [(rating, row[column]) for rating, column in RATING_COLUMNS.items() if row[column] > 0]
             
             return {
                 'total_predictions': total_predictions,
+                'normal_predictions': row['normal_predictions'],
+                'pneumonia_predictions': row['pneumonia_predictions'],
+                'average_confidence': average_confidence,
                 'total_feedback': total_feedback,
                 'accuracy_rate': accuracy_rate,
                 'rating_distribution': rating_distribution
             }
         except Error as e:
-            print(f"Error while retrieving feedback stats: {e}")
+            logger.error("Error while retrieving feedback stats: %s", e)
             return {}
         finally:
             cursor.close()
-            connection.close()
+            release_connection(connection)
     return {}
+
+def backfill_history_columns(chunk_size=1000):
+    """Fill confidence_value and label for existing history rows, one id-ordered chunk per transaction.
+
+    Returns the number of updated rows.
+    """
+    updated = 0
+    last_id = 0
+    connection = create_connection()
+    if connection is not None:
+        try:
+            cursor = connection.cursor()
+            while True:
+                cursor.execute("""
+                    SELECT id, prediction, confidence FROM history
+                    WHERE id > %s AND (confidence_value IS NULL OR label IS NULL)
+                    ORDER BY id LIMIT %s
+                """, (last_id, chunk_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                cursor.executemany("UPDATE history SET confidence_value = %s, label = %s WHERE id = %s",
+                                   [(parse_confidence(confidence), prediction if prediction in LABELS else None, row_id)
+                                    for row_id, prediction, confidence in rows])
+                connection.commit()
+                updated += len(rows)
+                last_id = rows[-1][0]
+                logger.info("Backfilled %d history rows (up to id %s)", updated, last_id)
+        except Error as e:
+            logger.error("Error while backfilling history: %s", e)
+        finally:
+            cursor.close()
+            release_connection(connection)
+    return updated
+
+def rebuild_prediction_stats(chunk_size=10000):
+    """Recompute the prediction_stats rollup from history and feedback in id-ordered chunks.
+
+    Run it after backfill_history_columns() while no predictions are being written,
+    since rows inserted during the rebuild may be counted twice or not at all.
+    """
+    connection = create_connection()
+    if connection is None:
+        return False
+    try:
+        cursor = connection.cursor()
+        totals = dict.fromkeys(['total_predictions', 'normal_predictions', 'pneumonia_predictions', 'confidence_sum',
+                                'total_feedback', 'accurate_feedback', *RATING_COLUMNS.values()], 0)
+
+        last_id = 0
+        while True:
+            cursor.execute("""
+                SELECT COUNT(*), COALESCE(SUM(label = 'Normal'), 0), COALESCE(SUM(label = 'Pneumonia'), 0),
+                       COALESCE(SUM(confidence_value), 0), MAX(id)
+                FROM (SELECT id, label, confidence_value FROM history WHERE id > %s ORDER BY id LIMIT %s) AS chunk
+            """, (last_id, chunk_size))
+            count, normal, pneumonia, confidence_sum, max_id = cursor.fetchone()
+            if not count:
+                break
+            totals['total_predictions'] += count
+            totals['normal_predictions'] += int(normal)
+            totals['pneumonia_predictions'] += int(pneumonia)
+            totals['confidence_sum'] += confidence_sum
+            last_id = max_id
+
+        rating_sums = ", ".join(
+            f"COALESCE(SUM(usefulness_rating IS NULL), 0)" if rating is None else f"COALESCE(SUM(usefulness_rating = {rating}), 0)"
+            for rating in RATING_COLUMNS)
+        last_id = 0
+        while True:
+            cursor.execute(f"""
+                SELECT COUNT(*), COALESCE(SUM(is_accurate = 1), 0), {rating_sums}, MAX(id)
+                FROM (SELECT id, is_accurate, usefulness_rating FROM feedback WHERE id > %s ORDER BY id LIMIT %s) AS chunk
+            """, (last_id, chunk_size))
+            count, accurate, *ratings, max_id = cursor.fetchone()
+            if not count:
+                break
+            totals['total_feedback'] += count
+            totals['accurate_feedback'] += int(accurate)
+            for column, value in zip(RATING_COLUMNS.values(), ratings):
+                totals[column] += int(value)
+            last_id = max_id
+
+        assignments = ", ".join(f"{column} = %s" for column in totals)
+        cursor.execute(f"UPDATE prediction_stats SET {assignments} WHERE id = 1", tuple(totals.values()))
+        connection.commit()
+        logger.info("Rebuilt prediction_stats from %d predictions and %d feedback rows",
+                    totals['total_predictions'], totals['total_feedback'])
+        return True
+    except Error as e:
+        logger.error("Error while rebuilding prediction stats: %s", e)
+        return False
+    finally:
+        cursor.close()
+        release_connection(connection)
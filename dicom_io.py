@@ -0,0 +1,146 @@
+"""DICOM decoding for the 150x150 model input.
+
+Chest films from a PACS are typically 2-3k pixels square at 12-16 bits. We
+never build a full-resolution copy of them: for uncompressed little-endian
+pixel data the frame is a zero-copy view into the upload bytes (or a
+memory-mapped file), and it is block-averaged down to the smallest size that
+is still at least 150x150, a strip of rows at a time. Rescale slope/intercept,
+the VOI window and MONOCHROME1 inversion are applied to that small array.
+Compressed transfer syntaxes are decoded by pydicom's pixel handlers (one
+frame only) and reduced the same way.
+
+pydicom (>= 3.0) is listed in requirements.txt but imported on first use, so
+the rest of the app still runs without it (see dicom_supported).
+"""
+import importlib.util
+import io
+import os
+
+import numpy as np
+
+DICOM_EXTENSIONS = ('.dcm', '.dicom')
+# Pixels converted to float per strip while reducing
+STRIP_PIXELS = 1 << 20
+
+
+class DicomError(ValueError):
+    """A DICOM upload that cannot be read; the message is safe to show to the user"""
+
+
+def is_dicom(data):
+    """Part 10 files carry the 'DICM' magic after a 128-byte preamble"""
+    return len(data) >= 132 and data[128:132] == b'DICM'
+
+
+def dicom_supported():
+    """True when pydicom is installed"""
+    return importlib.util.find_spec('pydicom') is not None
+
+
+def _pydicom():
+    try:
+        import pydicom
+    except ImportError:
+        raise DicomError("DICOM support requires pydicom (pip install pydicom)") from None
+    return pydicom
+
+
+def _first_value(value):
+    # Window Center/Width may be multi-valued; the first pair is the default
+    if value is None:
+        return None
+    try:
+        return float(value[0])
+    except TypeError:
+        return float(value)
+
+
+def _native_frame(ds, source, data):
+    """Zero-copy (rows, columns) view of the first frame, or None when it has to be decoded"""
+    syntax = ds.file_meta.get('TransferSyntaxUID')
+    if (syntax is None or syntax.is_compressed or not syntax.is_little_endian
+            or ds.get('SamplesPerPixel', 1) != 1 or ds.BitsAllocated not in (8, 16)):
+        return None
+    signed = ds.get('PixelRepresentation', 0) == 1
+    if signed and ds.get('BitsStored', ds.BitsAllocated) != ds.BitsAllocated:
+        # Needs sign extension of the stored bits; leave it to pydicom
+        return None
+    element = ds.get_item('PixelData', keep_deferred=True)
+    offset = getattr(element, 'value_tell', None)
+    if offset is None:
+        return None
+    dtype = np.dtype(f"<{'i' if signed else 'u'}{ds.BitsAllocated // 8}")
+    shape = (ds.Rows, ds.Columns)
+    if data is not None:
+        return np.frombuffer(data, dtype=dtype, count=shape[0] * shape[1], offset=offset).reshape(shape)
+    return np.memmap(source, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+
+def _decoded_frame(source, data):
+    """First frame decoded by pydicom's pixel handlers (compressed or unusual encodings)"""
+    from pydicom.pixels import pixel_array
+    frame = pixel_array(io.BytesIO(data) if data is not None else source, index=0)
+    if frame.ndim == 3:
+        # Color or multi-sample data: average the samples to a gray level
+        frame = frame.mean(axis=2)
+    return frame
+
+
+def block_reduce(frame, size, mask=None):
+    """Average `frame` over factor x factor blocks so both sides stay >= `size`, as float32"""
+    rows, cols = frame.shape
+    factor = max(1, min(rows, cols) // size)
+    out_rows, out_cols = rows // factor, cols // factor
+    out = np.empty((out_rows, out_cols), dtype=np.float32)
+    strip = max(1, STRIP_PIXELS // (factor * cols))
+    for start in range(0, out_rows, strip):
+        stop = min(start + strip, out_rows)
+        block = frame[start * factor:stop * factor, :out_cols * factor]
+        if mask is not None:
+            block = block & mask
+        block = block.astype(np.float32).reshape(stop - start, factor, out_cols, factor)
+        out[start:stop] = block.mean(axis=(1, 3))
+    return out
+
+
+def to_display(ds, values):
+    """Apply the modality rescale, VOI window and photometric inversion; return uint8"""
+    slope = float(ds.get('RescaleSlope', 1) or 1)
+    intercept = float(ds.get('RescaleIntercept', 0) or 0)
+    values = values * slope + intercept
+
+    center = _first_value(ds.get('WindowCenter'))
+    width = _first_value(ds.get('WindowWidth'))
+    if center is None or not width or width <= 1:
+        # No usable window: stretch the robust range of the image
+        low, high = np.percentile(values, (0.5, 99.5))
+    else:
+        low, high = center - width / 2, center + width / 2
+    scaled = np.clip((values - low) / max(high - low, 1e-6), 0.0, 1.0)
+    if ds.get('PhotometricInterpretation') == 'MONOCHROME1':
+        scaled = 1.0 - scaled
+    return (scaled * 255.0 + 0.5).astype(np.uint8)
+
+
+def read_dicom(source, size):
+    """Decode a DICOM file (bytes or path) to a uint8 gray array with both sides >= `size`.
+
+    Only the first frame of multi-frame objects is used.
+    """
+    pydicom = _pydicom()
+    data = source if isinstance(source, (bytes, bytearray, memoryview)) else None
+    fp = io.BytesIO(data) if data is not None else os.fspath(source)
+    try:
+        # Pixel data stays unread; only its position in the file is recorded
+        ds = pydicom.dcmread(fp, defer_size=1024)
+    except pydicom.errors.InvalidDicomError as e:
+        raise DicomError(str(e)) from None
+
+    frame = _native_frame(ds, source, data)
+    mask = None
+    if frame is None:
+        frame = _decoded_frame(source, data)
+    elif ds.get('BitsStored', ds.BitsAllocated) < ds.BitsAllocated:
+        # Unused high bits may hold overlay data
+        mask = frame.dtype.type((1 << ds.BitsStored) - 1)
+    return to_display(ds, block_reduce(frame, size, mask))
@@ -0,0 +1,378 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from explain import EXPLAIN_METHODS
+
+LABELS = ["Normal", "Pneumonia"]
+IMAGE_SIZE = 150
+
+logger = logging.getLogger(__name__)
+
+Prediction = namedtuple('Prediction', ['probability', 'label', 'confidence', 'saliency'])
+
+SMOOTHGRAD_SAMPLES = 16
+# Standard deviation of the SmoothGrad noise, relative to the [0, 1] input range
+SMOOTHGRAD_NOISE = 0.15
+
+
+def model_file_digest(model_path, chunk_size=1 << 20):
+    """SHA-256 hex digest of a model file, used to version cached predictions"""
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+_tf_module = None
+_tf_lock = threading.Lock()
+_thread_budget = {'intra_op': 0, 'inter_op': 0}
+
+
+def set_thread_budget(intra_op=0, inter_op=0):
+    """Limit TensorFlow's intra-/inter-op thread pools (0 keeps TensorFlow's default).
+
+    Takes effect when TensorFlow is first imported through this module, so it
+    must be called before any engine is created.
+    """
+    _thread_budget.update(intra_op=int(intra_op or 0), inter_op=int(inter_op or 0))
+
+
+def _tf():
+    """Import TensorFlow on first use so TFLite-only processes never load it"""
+    global _tf_module
+    if _tf_module is None:
+        with _tf_lock:
+            if _tf_module is None:
+                import tensorflow as tf
+                try:
+                    if _thread_budget['intra_op']:
+                        tf.config.threading.set_intra_op_parallelism_threads(_thread_budget['intra_op'])
+                    if _thread_budget['inter_op']:
+                        tf.config.threading.set_inter_op_parallelism_threads(_thread_budget['inter_op'])
+                except RuntimeError as e:
+                    # TensorFlow already ran ops in this process (e.g. imported elsewhere first)
+                    logger.warning("Could not apply TensorFlow thread budget: %s", e)
+                _tf_module = tf
+    return _tf_module
+
+
+class BaseEngine:
+    """Label/confidence handling shared by the Keras and TFLite backends.
+
+    Subclasses implement `predict_batch(batch, saliency=True, method=None)`
+    returning (probabilities, saliency maps or None). `method` is one of
+    explain.EXPLAIN_METHODS and defaults to `explain_method`.
+    `fused_saliency` tells callers whether the saliency map comes for free
+    with the forward pass; when it does not, they can skip it and call
+    `saliency_batch` later.
+    """
+
+    fused_saliency = True
+
+    def __init__(self, labels=LABELS, explain_method='gradient'):
+        if explain_method not in EXPLAIN_METHODS:
+            raise ValueError(f"Unknown explanation method: {explain_method}")
+        self.labels = list(labels)
+        self.explain_method = explain_method
+
+    def predict_batch(self, batch, saliency=True, method=None):
+        raise NotImplementedError
+
+    def saliency_batch(self, batch, method=None):
+        """Saliency maps (explanation `method`) for a batch of inputs"""
+        return self.predict_batch(batch, method=method)[1]
+
+    def warmup(self):
+        """Run one dummy batch ahead of the first real request.
+
+        With fused saliency every method up to `explain_method` is traced, so a
+        request downgraded to a cheaper method does not pay for tracing.
+        """
+        dummy = np.zeros((1, IMAGE_SIZE, IMAGE_SIZE, 1), dtype=np.float32)
+        if not self.fused_saliency:
+            self.predict_batch(dummy, saliency=False)
+            return
+        for method in EXPLAIN_METHODS[:EXPLAIN_METHODS.index(self.explain_method) + 1]:
+            self.predict_batch(dummy, method=method)
+
+    def to_prediction(self, probability, saliency):
+        """Turn a raw sigmoid output into label and confidence (in percent)"""
+        probability = float(probability)
+        label = self.labels[int(probability >= 0.5)]
+        confidence = (probability if probability >= 0.5 else 1 - probability) * 100
+        return Prediction(probability, label, confidence, saliency)
+
+    def predict(self, image_input, method=None):
+        """Predict a single preprocessed image of shape (150, 150, 1) or (1, 150, 150, 1)"""
+        probs, saliency = self.predict_batch(image_input, method=method)
+        return self.to_prediction(probs[0], saliency[0])
+
+
+def _as_batch(batch):
+    return np.asarray(batch, dtype=np.float32).reshape(-1, IMAGE_SIZE, IMAGE_SIZE, 1)
+
+
+def _normalize(maps):
+    """Scale every (H, W) map of a batch to [0, 1]"""
+    tf = _tf()
+    low = tf.reduce_min(maps, axis=[1, 2], keepdims=True)
+    return tf.math.divide_no_nan(maps - low, tf.reduce_max(maps, axis=[1, 2], keepdims=True) - low)
+
+
+def _split_at_feature_map(model, layer_name=None):
+    """Split a Sequential model's layers after the feature map Grad-CAM explains.
+
+    The feature map is `layer_name`, else the last convolution with a 4D
+    output. Returns (feature layers, head layers), or None when the model is
+    not a plain layer chain or has no such layer.
+    """
+    tf = _tf()
+    if not isinstance(model, tf.keras.Sequential):
+        return None
+    layers = list(model.layers)
+    if layer_name:
+        index = layers.index(model.get_layer(layer_name))
+    else:
+        spatial = [i for i, layer in enumerate(layers) if len(layer.output.shape) == 4]
+        convolutions = [i for i in spatial if 'Conv' in type(layers[i]).__name__]
+        if not spatial:
+            return None
+        index = (convolutions or spatial)[-1]
+    return layers[:index + 1], layers[index + 1:]
+
+
+class InferenceEngine(BaseEngine):
+    """Single-pass prediction and saliency map for the pneumonia model.
+
+    The Keras model is wrapped in `tf.function`s with a fixed input signature
+    of shape (None, 150, 150, 1), one per explanation method, so each is
+    traced once and every call afterwards computes the probability and the
+    saliency map from the same forward/backward pass:
+
+    - gradcam: gradients of the top output with respect to the last
+      convolutional feature map, channel-weighted and upsampled (bilinear)
+    - gradient: absolute input gradients
+    - smoothgrad: input gradients averaged over `smoothgrad_samples` noisy
+      copies, evaluated together with the clean inputs as one batch
+    """
+
+    def __init__(self, model, labels=LABELS, warmup=True, explain_method='gradient', gradcam_layer=None,
+                 smoothgrad_samples=SMOOTHGRAD_SAMPLES, smoothgrad_noise=SMOOTHGRAD_NOISE):
+        super().__init__(labels, explain_method)
+        tf = _tf()
+        self.model = model
+        self.smoothgrad_samples = int(smoothgrad_samples)
+        self.smoothgrad_noise = float(smoothgrad_noise)
+        signature = [tf.TensorSpec(shape=[None, IMAGE_SIZE, IMAGE_SIZE, 1], dtype=tf.float32)]
+        self._forward = tf.function(self._forward_impl, input_signature=signature)
+        self._explainers = {
+            'gradient': tf.function(self._gradient_impl, input_signature=signature),
+            'smoothgrad': tf.function(self._smoothgrad_impl, input_signature=signature),
+        }
+        self._cam_layers = _split_at_feature_map(model, gradcam_layer)
+        if self._cam_layers is not None:
+            self._explainers['gradcam'] = tf.function(self._gradcam_impl, input_signature=signature)
+        else:
+            logger.warning("Grad-CAM needs a Sequential model with a convolutional layer; using input gradients")
+            self._explainers['gradcam'] = self._explainers['gradient']
+        if warmup:
+            self.warmup()
+
+    @classmethod
+    def load(cls, model_path, **kwargs):
+        """Load a saved Keras model from disk and wrap it in an engine"""
+        model = _tf().keras.models.load_model(model_path)
+        return cls(model, **kwargs)
+
+    def _gradient_impl(self, inputs):
+        tf = _tf()
+        with tf.GradientTape() as tape:
+            tape.watch(inputs)
+            preds = self.model(inputs, training=False)
+            # Top-class output per sample, i.e. preds[i, argmax(preds[i])]
+            top_output = tf.reduce_max(preds, axis=-1)
+
+        grads = tape.gradient(top_output, inputs)
+        return preds[:, 0], _normalize(tf.reduce_max(tf.abs(grads), axis=-1))
+
+    def _gradcam_impl(self, inputs):
+        tf = _tf()
+        feature_layers, head_layers = self._cam_layers
+        features = inputs
+        for layer in feature_layers:
+            features = layer(features, training=False)
+        with tf.GradientTape() as tape:
+            tape.watch(features)
+            preds = features
+            for layer in head_layers:
+                preds = layer(preds, training=False)
+            top_output = tf.reduce_max(preds, axis=-1)
+
+        grads = tape.gradient(top_output, features)
+        # Channel weights: gradients averaged over the feature map
+        weights = tf.reduce_mean(grads, axis=[1, 2], keepdims=True)
+        cam = tf.nn.relu(tf.reduce_sum(weights * features, axis=-1, keepdims=True))
+        cam = tf.image.resize(cam, (IMAGE_SIZE, IMAGE_SIZE), method='bilinear')[..., 0]
+        return preds[:, 0], _normalize(cam)
+
+    def _smoothgrad_impl(self, inputs):
+        tf = _tf()
+        count = tf.shape(inputs)[0]
+        # One fixed set of noise samples, added to every image: an image gets the same map
+        # whatever micro-batch it lands in and at whatever position
+        noise = tf.random.stateless_normal([self.smoothgrad_samples, IMAGE_SIZE, IMAGE_SIZE, 1], seed=[0, 0])
+        noisy = tf.reshape(inputs[:, None] + self.smoothgrad_noise * noise[None],
+                           [-1, IMAGE_SIZE, IMAGE_SIZE, 1])
+        combined = tf.concat([inputs, noisy], axis=0)
+        with tf.GradientTape() as tape:
+            tape.watch(combined)
+            preds = self.model(combined, training=False)
+            # Only the noisy copies contribute gradients; the clean ones give the prediction
+            top_output = tf.reduce_max(preds[count:], axis=-1)
+
+        grads = tape.gradient(top_output, combined)[count:]
+        saliency = tf.reshape(tf.reduce_max(tf.abs(grads), axis=-1),
+                              [count, self.smoothgrad_samples, IMAGE_SIZE, IMAGE_SIZE])
+        return preds[:count, 0], _normalize(tf.reduce_mean(saliency, axis=1))
+
+    def _forward_impl(self, inputs):
+        return self.model(inputs, training=False)[:, 0]
+
+    def predict_batch(self, batch, saliency=True, method=None):
+        """Return (probabilities, saliency maps) as NumPy arrays for a batch of inputs.
+
+        With `saliency=False` only the forward pass runs and the maps are None.
+        """
+        inputs = _tf().convert_to_tensor(_as_batch(batch))
+        if not saliency:
+            return self._forward(inputs).numpy(), None
+        probs, saliency_maps = self._explainers[method or self.explain_method](inputs)
+        return probs.numpy(), saliency_maps.numpy()
+
+
+def _load_interpreter(model_path, num_threads, model_content=None):
+    """Create a TFLite interpreter, preferring the standalone runtimes over full TensorFlow.
+
+    `model_content` (the .tflite bytes) is used in place of reading `model_path`;
+    the interpreter keeps using that buffer, so bytes loaded before a fork stay
+    shared copy-on-write between processes.
+    """
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            Interpreter = _tf().lite.Interpreter
+    # Float models run through the XNNPACK delegate, which uses `num_threads`
+    if model_content is not None:
+        return Interpreter(model_content=model_content, num_threads=num_threads)
+    return Interpreter(model_path=model_path, num_threads=num_threads)
+
+
+class TFLiteEngine(BaseEngine):
+    """Probability-only inference from a (quantized) TFLite export of the model.
+
+    The interpreter cannot compute input gradients, so saliency maps come from
+    the Keras model at `saliency_model_path`, which is loaded on the first
+    `saliency_batch` call. `fused_saliency` is False: callers that need the
+    label quickly should predict with `saliency=False` and ask for the map
+    separately (e.g. while rendering artifacts in the background).
+    """
+
+    fused_saliency = False
+
+    def __init__(self, model_path, labels=LABELS, num_threads=None, saliency_model_path=None, warmup=True,
+                 model_content=None, **explain_options):
+        super().__init__(labels, explain_options.get('explain_method', 'gradient'))
+        self.model_path = model_path
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self.saliency_model_path = saliency_model_path
+        self._interpreter = _load_interpreter(model_path, self.num_threads, model_content)
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = None
+        # One interpreter is not safe to invoke from several threads at once
+        self._lock = threading.Lock()
+        # explain_method, gradcam_layer, smoothgrad_*: passed on to the Keras saliency engine
+        self._explain_options = explain_options
+        self._saliency_engine = None
+        self._saliency_lock = threading.Lock()
+        if warmup:
+            self.warmup()
+
+    @classmethod
+    def load(cls, model_path, **kwargs):
+        return cls(model_path, **kwargs)
+
+    def _quantize(self, batch):
+        scale, zero_point = self._input['quantization']
+        if self._input['dtype'] == np.float32 or not scale:
+            return batch.astype(self._input['dtype'])
+        return np.clip(np.rint(batch / scale + zero_point),
+                       np.iinfo(self._input['dtype']).min, np.iinfo(self._input['dtype']).max).astype(self._input['dtype'])
+
+    def _dequantize(self, output):
+        scale, zero_point = self._output['quantization']
+        if self._output['dtype'] == np.float32 or not scale:
+            return output.astype(np.float32)
+        return (output.astype(np.float32) - zero_point) * scale
+
+    def predict_proba(self, batch):
+        batch = _as_batch(batch)
+        with self._lock:
+            if self._batch_size != len(batch):
+                self._interpreter.resize_tensor_input(self._input['index'], [len(batch), IMAGE_SIZE, IMAGE_SIZE, 1])
+                self._interpreter.allocate_tensors()
+                self._batch_size = len(batch)
+            self._interpreter.set_tensor(self._input['index'], self._quantize(batch))
+            self._interpreter.invoke()
+            output = self._interpreter.get_tensor(self._output['index'])
+        return self._dequantize(output).reshape(len(batch), -1)[:, 0]
+
+    def saliency_batch(self, batch, method=None):
+        if self.saliency_model_path is None:
+            raise RuntimeError("TFLiteEngine needs saliency_model_path to compute saliency maps")
+        with self._saliency_lock:
+            if self._saliency_engine is None:
+                self._saliency_engine = InferenceEngine.load(self.saliency_model_path, labels=self.labels,
+                                                             **self._explain_options)
+        return self._saliency_engine.predict_batch(batch, method=method)[1]
+
+    def predict_batch(self, batch, saliency=True, method=None):
+        """Return (probabilities, saliency maps); the maps are None when `saliency=False`"""
+        probs = self.predict_proba(batch)
+        return probs, (self.saliency_batch(batch, method) if saliency else None)
+
+
+def tflite_model_path(model_path, variant):
+    """Default location of a TFLite export, e.g. modelPneumonia.int8.tflite"""
+    return f"{os.path.splitext(model_path)[0]}.{variant}.tflite"
+
+
+def serving_model_path(backend, model_path, tflite_path=None):
+    """Path of the file that serves predictions for a backend"""
+    if backend in ('tflite-fp16', 'tflite-int8'):
+        return tflite_path or tflite_model_path(model_path, backend.split('-', 1)[1])
+    return model_path
+
+
+def load_engine(backend, model_path, tflite_path=None, num_threads=None, model_content=None, **kwargs):
+    """Create the engine for INFERENCE_BACKEND ('keras', 'tflite-fp16' or 'tflite-int8').
+
+    `model_content` optionally holds the already-read TFLite file. Returns
+    (engine, path of the file that serves predictions).
+    """
+    path = serving_model_path(backend, model_path, tflite_path)
+    if backend == 'keras':
+        return InferenceEngine.load(model_path, **kwargs), path
+    if backend in ('tflite-fp16', 'tflite-int8'):
+        return TFLiteEngine.load(path, num_threads=num_threads, saliency_model_path=model_path,
+                                 model_content=model_content, **kwargs), path
+    raise ValueError(f"Unknown inference backend: {backend}")
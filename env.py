@@ -11,4 +11,81 @@ DB_CONFIG = {
     'port': int(os.getenv('DB_PORT', 3306))
 }
 
-SECRET_KEY = os.getenv('SECRET_KEY', 'fallback-very-secure-random-string-here')
\ No newline at end of file
+SECRET_KEY = os.getenv('SECRET_KEY', 'fallback-very-secure-random-string-here')
+
+MODEL_PATH = os.getenv('MODEL_PATH', 'modelPneumonia.h5')
+# Leave empty to use the model file's SHA-256 as its version
+MODEL_VERSION = os.getenv('MODEL_VERSION', '')
+
+# Micro-batching inference queue
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv('INFERENCE_MAX_BATCH_SIZE', 8))
+INFERENCE_MAX_WAIT_MS = float(os.getenv('INFERENCE_MAX_WAIT_MS', 10))
+
+# Bulk prediction endpoint (images per forward pass)
+BULK_BATCH_SIZE = int(os.getenv('BULK_BATCH_SIZE', 16))
+
+# Prediction cache (in-memory LRU tier; the persistent tier is the history table)
+PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', 256))
+
+# Seconds a user/role lookup stays cached across requests
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 60))
+
+# Number of recent predictions loaded for the landing page
+RECENT_ACTIVITY_LIMIT = int(os.getenv('RECENT_ACTIVITY_LIMIT', 5))
+
+# Background CLAHE/saliency/overlay rendering for /predict
+ARTIFACT_WORKERS = int(os.getenv('ARTIFACT_WORKERS', 2))
+ARTIFACT_MAX_PENDING = int(os.getenv('ARTIFACT_MAX_PENDING', 64))
+# Seconds after which a row still 'pending' with no job in this process is resolved from the files
+# on disk (another worker may be rendering it; its own final status always wins)
+ARTIFACT_RENDER_TIMEOUT = float(os.getenv('ARTIFACT_RENDER_TIMEOUT', 120))
+
+# Connection pool shared by all queries in a process. A connection is held for one query only;
+# the default (0) lets a full inference batch of requests and every renderer query at once
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 0)) or min(32, INFERENCE_MAX_BATCH_SIZE + ARTIFACT_WORKERS + 2)
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+
+# Inference backend: 'keras' (.h5 model, saliency in the same pass), 'tflite-fp16' or 'tflite-int8'
+# (export with `python quantize.py export`; saliency maps still come from the Keras model)
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'keras')
+# Leave empty to use <MODEL_PATH without extension>.<fp16|int8>.tflite
+TFLITE_MODEL_PATH = os.getenv('TFLITE_MODEL_PATH', '')
+# XNNPACK threads per TFLite interpreter (0 = all cores)
+TFLITE_NUM_THREADS = int(os.getenv('TFLITE_NUM_THREADS', 0))
+
+# Saliency map method: 'gradient' (input gradients), 'gradcam' (cheapest) or 'smoothgrad'
+EXPLAIN_METHOD = os.getenv('EXPLAIN_METHOD', 'gradient')
+# Per-request budget (ms, from request start): when the configured method would not finish in
+# time, a cheaper one is used (smoothgrad -> gradient -> gradcam); 0 = always EXPLAIN_METHOD
+EXPLAIN_BUDGET_MS = float(os.getenv('EXPLAIN_BUDGET_MS', 2000))
+# Layer explained by Grad-CAM (empty = last convolutional layer)
+GRADCAM_LAYER = os.getenv('GRADCAM_LAYER', '')
+# Noisy copies per image and noise level (std on the [0, 1] input) for SmoothGrad
+SMOOTHGRAD_SAMPLES = int(os.getenv('SMOOTHGRAD_SAMPLES', 16))
+SMOOTHGRAD_NOISE = float(os.getenv('SMOOTHGRAD_NOISE', 0.15))
+
+# Seconds a prediction request waits for the model to finish loading before returning 503
+MODEL_LOAD_TIMEOUT = float(os.getenv('MODEL_LOAD_TIMEOUT', 60))
+
+# TensorFlow thread pools per process (0 = TensorFlow default, i.e. all cores)
+TF_INTRA_OP_THREADS = int(os.getenv('TF_INTRA_OP_THREADS', 0))
+TF_INTER_OP_THREADS = int(os.getenv('TF_INTER_OP_THREADS', 0))
+
+# Logging level for the app and db modules (DEBUG shows every query)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# When set, /metrics requires the header `Authorization: Bearer <METRICS_TOKEN>`
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Threads decoding and preprocessing the images of one bulk prediction chunk
+PREPROCESS_WORKERS = int(os.getenv('PREPROCESS_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Upload store: hash-sharded originals and artifacts under UPLOAD_FOLDER
+UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'static/uploads')
+# Saliency/overlay encoding: 'webp' (lossy, ARTIFACT_QUALITY) or 'png' (optimized, lossless)
+ARTIFACT_FORMAT = os.getenv('ARTIFACT_FORMAT', 'webp')
+ARTIFACT_QUALITY = int(os.getenv('ARTIFACT_QUALITY', 85))
+# Keep uploaded originals (written in the background); 0 = only the 150x150 artifacts are stored
+STORE_ORIGINALS = os.getenv('STORE_ORIGINALS', '1') != '0'
+# Retention for `python storage.py prune` / `flask --app app prune-uploads` (0 = no limit)
+UPLOAD_MAX_AGE_DAYS = float(os.getenv('UPLOAD_MAX_AGE_DAYS', 0))
+UPLOAD_MAX_SIZE_GB = float(os.getenv('UPLOAD_MAX_SIZE_GB', 0))
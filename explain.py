@@ -0,0 +1,84 @@
+"""Choice of explanation method under a per-request latency budget.
+
+Methods, from cheapest to most expensive:
+
+    gradcam     Grad-CAM on the last convolutional layer: one backward pass
+                down to a small feature map, upsampled to 150x150
+    gradient    input-gradient saliency (backward pass to the input pixels)
+    smoothgrad  input gradients averaged over noisy copies of the image, all
+                copies in one batched forward/backward call
+
+ExplainBudget keeps a running estimate of each method's cost per image and,
+for a batch whose earliest deadline is known, picks the configured method or
+the most expensive cheaper one that still fits. When the server is busy
+(long queue waits, large batches) requests therefore downgrade towards
+Grad-CAM instead of missing their budget.
+"""
+import threading
+import time
+
+EXPLAIN_METHODS = ('gradcam', 'gradient', 'smoothgrad')
+EXPLAIN_LABELS = {'gradcam': 'Grad-CAM', 'gradient': 'Gradient', 'smoothgrad': 'SmoothGrad'}
+# Weight of the newest measurement in the running cost estimate
+SMOOTHING = 0.2
+
+
+class ExplainBudget:
+    def __init__(self, method='gradient', budget_ms=0.0):
+        if method not in EXPLAIN_METHODS:
+            raise ValueError(f"Unknown explanation method {method!r} (choose from {', '.join(EXPLAIN_METHODS)})")
+        self.method = method
+        self.budget_ms = float(budget_ms)
+        # Downgrade order: the configured method first, then every cheaper one
+        self._candidates = EXPLAIN_METHODS[:EXPLAIN_METHODS.index(method) + 1][::-1]
+        self._per_image = {}
+        self._counts = {m: 0 for m in EXPLAIN_METHODS}
+        self._downgrades = 0
+        self._lock = threading.Lock()
+
+    def deadline(self, started):
+        """perf_counter() deadline for a request that started at `started`, or None without a budget"""
+        return started + self.budget_ms / 1000.0 if self.budget_ms > 0 else None
+
+    def choose(self, batch_size, deadline=None, now=None):
+        """Most expensive allowed method whose estimated cost for the batch fits before `deadline`"""
+        if deadline is None:
+            return self.method
+        remaining = deadline - (time.perf_counter() if now is None else now)
+        with self._lock:
+            for method in self._candidates:
+                estimate = self._per_image.get(method)
+                # Not measured yet: try it once to learn its cost
+                if estimate is None or estimate * batch_size <= remaining:
+                    break
+            if method != self.method:
+                self._downgrades += 1
+        return method
+
+    def calibrate(self, run):
+        """Measure every allowed method once with `run(method)` (a one-image batch), after warm-up"""
+        for method in self._candidates:
+            started = time.perf_counter()
+            run(method)
+            with self._lock:
+                self._update(method, time.perf_counter() - started)
+
+    def record(self, method, batch_size, seconds):
+        """Update the cost estimate and counters with one measured batch"""
+        with self._lock:
+            self._update(method, seconds / max(batch_size, 1))
+            self._counts[method] += batch_size
+
+    def _update(self, method, per_image):
+        previous = self._per_image.get(method)
+        self._per_image[method] = per_image if previous is None else previous + SMOOTHING * (per_image - previous)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'method': self.method,
+                'budget_ms': self.budget_ms,
+                'per_image_ms': {m: s * 1000.0 for m, s in self._per_image.items()},
+                'images': dict(self._counts),
+                'downgraded_batches': self._downgrades,
+            }
@@ -0,0 +1,147 @@
+"""In-process metrics rendered in the Prometheus text exposition format.
+
+Histograms are updated on the request path; gauges and counters kept
+elsewhere (queue depths, pool usage, cache hits) are read from callbacks
+only when /metrics is scraped.
+
+    with STAGE_SECONDS.time('preprocess'):
+        ...
+
+Metrics are per process. Under serve.py every worker keeps its own values
+and a scrape is answered by whichever worker accepts the connection, so
+scrape each worker separately (or aggregate with the `pid` label) when
+running more than one.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers a cache hit (~1 ms) up to a slow cold batch
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, [('le', _format_value(float(bound)))])
+                yield f"{self.name}_bucket{le} {cumulative}"
+            label_text = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_text} {_format_value(total)}"
+            yield f"{self.name}_count{label_text} {cumulative}"
+
+
+class Gauge:
+    """Value read from `fn()` at scrape time; `fn` may return a number or {label value: number}"""
+
+    def __init__(self, name, documentation, fn, labelname=None, metric_type='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.labelname = labelname
+        self.metric_type = metric_type
+
+    def collect(self):
+        try:
+            value = self.fn()
+        except Exception:
+            # A failing source (e.g. no DB pool yet) must not break the scrape
+            return
+        if value is None:
+            return
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.metric_type}"
+        if isinstance(value, dict):
+            for key, item in sorted(value.items()):
+                yield f"{self.name}{_format_labels((self.labelname,), (key,))} {_format_value(item)}"
+        else:
+            yield f"{self.name} {_format_value(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'pneumonia_stage_seconds', 'Time spent in each stage of a prediction', ('stage',))
+REQUEST_SECONDS = REGISTRY.histogram(
+    'pneumonia_http_request_seconds', 'Request handling time until the response is returned',
+    ('endpoint', 'method', 'status'))
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    'pneumonia_db_query_seconds', 'Duration of database operations, including pool checkout', ('operation',))
+DB_QUERIES_PER_REQUEST = REGISTRY.histogram(
+    'pneumonia_db_queries_per_request', 'Database operations issued by one request', buckets=COUNT_BUCKETS)
+REGISTRY.gauge('pneumonia_process_info', 'Process id of the worker answering this scrape',
+               lambda: {str(os.getpid()): 1}, labelname='pid')
@@ -0,0 +1,114 @@
+import io
+import threading
+
+import numpy as np
+from PIL import Image
+
+from dicom_io import is_dicom, read_dicom
+
+IMAGE_SIZE = 150
+CLAHE_CLIP_LIMIT = 1.0
+CLAHE_TILE_GRID = (8, 8)
+# Box-reduce by an integer factor first when the image is at least this many
+# times larger than the target, then resample the rest (see Image.resize)
+REDUCING_GAP = 3.0
+
+
+def decode_image(source):
+    """Open an uploaded image from its bytes (or a file path) without touching the disk.
+
+    Only the header is parsed here; pixels are decoded by preprocess_image,
+    which can then ask the decoder for a reduced size. DICOM files are
+    decoded right away, already reduced to near the model input size (see
+    dicom_io).
+    """
+    if isinstance(source, (bytes, bytearray)):
+        if is_dicom(source):
+            return Image.fromarray(read_dicom(source, IMAGE_SIZE))
+        return Image.open(io.BytesIO(source))
+    with open(source, 'rb') as f:
+        head = f.read(132)
+    if is_dicom(head):
+        return Image.fromarray(read_dicom(source, IMAGE_SIZE))
+    return Image.open(source)
+
+
+_local = threading.local()
+
+
+def _clahe():
+    """CLAHE instance of the calling thread (cv2 CLAHE objects are not thread-safe, but reusable)"""
+    clahe = getattr(_local, 'clahe', None)
+    if clahe is None:
+        # OpenCV is imported on first use to keep startup fast
+        import cv2
+        clahe = _local.clahe = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=CLAHE_TILE_GRID)
+    return clahe
+
+
+def batch_buffers(size):
+    """Preallocated (CLAHE uint8 (N, 150, 150), model input float32 (N, 150, 150, 1)) buffers"""
+    return (np.empty((size, IMAGE_SIZE, IMAGE_SIZE), dtype=np.uint8),
+            np.empty((size, IMAGE_SIZE, IMAGE_SIZE, 1), dtype=np.float32))
+
+
+def preprocess_into(img, clahe_out, input_out):
+    """Grayscale, resize and CLAHE one PIL image into `clahe_out` (150, 150) and `input_out` (150, 150, 1)"""
+    # JPEG: decode directly to grayscale at 1/2, 1/4 or 1/8 scale, still at
+    # least 150x150, instead of decoding every pixel of a full-size film
+    img.draft('L', (IMAGE_SIZE, IMAGE_SIZE))
+    img_array = np.asarray(img.convert('L').resize((IMAGE_SIZE, IMAGE_SIZE), reducing_gap=REDUCING_GAP))
+
+    # Apply CLAHE to enhance contrast, then normalize to [0, 1] in place
+    _clahe().apply(img_array, dst=clahe_out)
+    np.divide(clahe_out, np.float32(255.0), out=input_out[..., 0])
+
+
+def preprocess_image(img):
+    """Grayscale, resize to 150x150 and apply CLAHE to a PIL image.
+
+    Returns the CLAHE image (uint8) and the normalized float32 model input of
+    shape (1, 150, 150, 1).
+    """
+    clahe, inputs = batch_buffers(1)
+    preprocess_into(img, clahe[0], inputs[0])
+    return clahe[0], inputs
+
+
+def preprocess_batch(sources, buffers=None, executor=None):
+    """Decode and preprocess a batch of images into one NHWC float32 batch.
+
+    `sources` are image bytes, file paths or PIL images. `buffers` (from
+    batch_buffers) are reused when given, so the returned arrays are views
+    that the next call overwrites. With an `executor` the images are
+    processed in parallel threads; PIL decoding and OpenCV release the GIL.
+
+    Returns (clahe, inputs, errors): rows of failed images are dropped from
+    `clahe` and `inputs`, and `errors[i]` holds the exception for sources[i]
+    (None on success).
+    """
+    count = len(sources)
+    clahe, inputs = buffers if buffers is not None and len(buffers[1]) >= count else batch_buffers(count)
+    errors = [None] * count
+
+    def run(i):
+        try:
+            source = sources[i]
+            img = source if isinstance(source, Image.Image) else decode_image(source)
+            preprocess_into(img, clahe[i], inputs[i])
+        except Exception as e:
+            # Any decoder failure (truncated file, decompression bomb, malformed DICOM, ...)
+            # is that image's error; the rest of the batch is still processed
+            errors[i] = e
+
+    if executor is not None and count > 1:
+        list(executor.map(run, range(count)))
+    else:
+        for i in range(count):
+            run(i)
+
+    ok = [i for i, error in enumerate(errors) if error is None]
+    if len(ok) == count:
+        return clahe[:count], inputs[:count], errors
+    # Compact the successful rows (copies; only happens when some images are invalid)
+    return clahe[ok], inputs[ok], errors
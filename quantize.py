@@ -0,0 +1,192 @@
+"""Export the Keras model to TFLite and compare backends.
+
+Export float16 and int8 variants, calibrating int8 on sample X-rays:
+
+    python quantize.py export --calibration /data/xrays/train --samples 200
+
+Report label agreement and probability drift against the Keras model on a
+labeled folder (one subfolder per class, e.g. NORMAL/ and PNEUMONIA/):
+
+    python quantize.py parity /data/xrays/test
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+from dicom_io import DICOM_EXTENSIONS
+from engine import LABELS, InferenceEngine, TFLiteEngine, tflite_model_path
+from env import MODEL_PATH, TFLITE_NUM_THREADS
+from preprocessing import decode_image, preprocess_batch, preprocess_image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png') + DICOM_EXTENSIONS
+VARIANTS = ('fp16', 'int8')
+
+
+def iter_labeled_images(root):
+    """Yield (path, label index or None) for images under `root`; the label is the class subfolder name"""
+    labels = {label.lower(): i for i, label in enumerate(LABELS)}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        label = labels.get(os.path.basename(dirpath).lower())
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(dirpath, name), label
+
+
+def load_input(path):
+    """Preprocessed float32 model input of shape (150, 150, 1)"""
+    _, img_input = preprocess_image(decode_image(path))
+    return img_input[0]
+
+
+def calibration_inputs(root, samples, seed=0):
+    """Random sample of preprocessed images for int8 calibration"""
+    paths = [path for path, _ in iter_labeled_images(root)]
+    if not paths:
+        sys.exit(f"No calibration images found in {root}")
+    random.Random(seed).shuffle(paths)
+    for path in paths[:samples]:
+        yield load_input(path)[np.newaxis]
+
+
+def export(model_path, variant, output_path, calibration=None, samples=200):
+    """Convert the Keras model to a float16 or int8 TFLite file"""
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(model_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if variant == 'fp16':
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        if calibration is None:
+            sys.exit("int8 export needs --calibration")
+        converter.representative_dataset = lambda: ([x] for x in calibration_inputs(calibration, samples))
+        # Integer kernels inside, float32 input/output so callers feed the same arrays as for Keras
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    data = converter.convert()
+    with open(output_path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+
+def run_export(args):
+    for variant in args.variants:
+        output_path = tflite_model_path(args.model, variant)
+        if args.output_dir:
+            output_path = os.path.join(args.output_dir, os.path.basename(output_path))
+        size = export(args.model, variant, output_path, args.calibration, args.samples)
+        print(f"{variant}: {output_path} ({size / 1e6:.1f} MB, Keras file {os.path.getsize(args.model) / 1e6:.1f} MB)")
+
+
+def score_backend(engine, inputs, batch_size):
+    """Probabilities for all inputs plus the mean seconds per image"""
+    probs = []
+    started = time.perf_counter()
+    for i in range(0, len(inputs), batch_size):
+        batch_probs, _ = engine.predict_batch(inputs[i:i + batch_size], saliency=False)
+        probs.append(batch_probs)
+    elapsed = time.perf_counter() - started
+    return np.concatenate(probs), elapsed / max(len(inputs), 1)
+
+
+def parity_report(reference, candidate, labels):
+    """Agreement and drift of `candidate` probabilities against the `reference` backend"""
+    ref_labels = reference >= 0.5
+    cand_labels = candidate >= 0.5
+    drift = np.abs(candidate - reference)
+    report = {
+        'label_agreement': float(np.mean(ref_labels == cand_labels)),
+        'disagreements': int(np.sum(ref_labels != cand_labels)),
+        'max_probability_drift': float(drift.max()),
+        'mean_probability_drift': float(drift.mean()),
+    }
+    known = labels >= 0
+    if known.any():
+        report['accuracy'] = float(np.mean(cand_labels[known] == labels[known].astype(bool)))
+    return report
+
+
+def run_parity(args):
+    items = list(iter_labeled_images(args.folder))
+    if args.limit:
+        items = items[:args.limit]
+    if not items:
+        sys.exit(f"No images found in {args.folder}")
+    _, inputs, errors = preprocess_batch([path for path, _ in items])
+    for (path, _), error in zip(items, errors):
+        if error is not None:
+            print(f"Skipping {path}: {error}")
+    items = [item for item, error in zip(items, errors) if error is None]
+    labels = np.array([-1 if label is None else label for _, label in items])
+
+    num_threads = args.threads or TFLITE_NUM_THREADS or None
+    engines = {'keras': InferenceEngine.load(args.model)}
+    for variant in args.variants:
+        path = tflite_model_path(args.model, variant)
+        if not os.path.exists(path):
+            print(f"Skipping {variant}: {path} not found (run `python quantize.py export` first)")
+            continue
+        engines[f"tflite-{variant}"] = TFLiteEngine.load(path, num_threads=num_threads)
+
+    results = {}
+    reference = None
+    for name, engine in engines.items():
+        probs, seconds = score_backend(engine, inputs, args.batch_size)
+        if reference is None:
+            reference = probs
+        results[name] = dict(parity_report(reference, probs, labels), ms_per_image=seconds * 1000.0)
+
+    print(f"{len(items)} images, {int((labels >= 0).sum())} labeled")
+    print(f"{'backend':<14}{'accuracy':>10}{'agreement':>11}{'max drift':>11}{'mean drift':>12}{'ms/image':>10}")
+    for name, r in results.items():
+        accuracy = f"{r['accuracy']:.4f}" if 'accuracy' in r else '-'
+        print(f"{name:<14}{accuracy:>10}{r['label_agreement']:>11.4f}{r['max_probability_drift']:>11.4f}"
+              f"{r['mean_probability_drift']:>12.4f}{r['ms_per_image']:>10.2f}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'images': len(items), 'backends': results}, f, indent=2)
+
+    if args.min_agreement is not None:
+        failing = [name for name, r in results.items() if r['label_agreement'] < args.min_agreement]
+        if failing:
+            sys.exit(f"Label agreement below {args.min_agreement} for: {', '.join(failing)}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export TFLite variants of the model and check their parity.")
+    parser.add_argument('--model', default=MODEL_PATH, help="Keras model file (default: %(default)s)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help="write <model>.fp16.tflite and <model>.int8.tflite")
+    export_parser.add_argument('--variants', nargs='+', choices=VARIANTS, default=list(VARIANTS))
+    export_parser.add_argument('--calibration', help="folder of sample X-rays for int8 calibration")
+    export_parser.add_argument('--samples', type=int, default=200, help="calibration images (default: %(default)s)")
+    export_parser.add_argument('--output-dir', help="destination folder (default: next to the model)")
+    export_parser.set_defaults(func=run_export)
+
+    parity_parser = commands.add_parser('parity', help="compare TFLite variants with the Keras model")
+    parity_parser.add_argument('folder', help="folder with one subfolder per class (Normal/Pneumonia)")
+    parity_parser.add_argument('--variants', nargs='+', choices=VARIANTS, default=list(VARIANTS))
+    parity_parser.add_argument('--batch-size', type=int, default=32)
+    parity_parser.add_argument('--threads', type=int, help="TFLite threads (default: TFLITE_NUM_THREADS or all cores)")
+    parity_parser.add_argument('--limit', type=int, help="only use the first N images")
+    parity_parser.add_argument('--json', help="also write the report to this file")
+    parity_parser.add_argument('--min-agreement', type=float,
+                               help="exit with an error when a backend agrees with Keras on fewer labels")
+    parity_parser.set_defaults(func=run_parity)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
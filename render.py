@@ -0,0 +1,108 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from storage import save_image
+
+LUT_SIZE = 256
+OVERLAY_ALPHA = 0.7
+
+# Segment data of matplotlib's 'hot' colormap: (x, y) anchor points per channel
+_HOT_SEGMENTS = {
+    'red': ((0.0, 0.0416), (0.365079, 1.0), (1.0, 1.0)),
+    'green': ((0.0, 0.0), (0.365079, 0.0), (0.746032, 1.0), (1.0, 1.0)),
+    'blue': ((0.0, 0.0), (0.746032, 0.0), (1.0, 1.0)),
+}
+
+
+def _build_lut(segments):
+    """Sample piecewise-linear channel segments into a (256, 3) uint8 table"""
+    x = np.linspace(0.0, 1.0, LUT_SIZE)
+    channels = []
+    for name in ('red', 'green', 'blue'):
+        xp, fp = zip(*segments[name])
+        channels.append(np.interp(x, xp, fp))
+    # Same float -> byte conversion as matplotlib's to_rgba(bytes=True)
+    return (np.stack(channels, axis=-1) * 255).astype(np.uint8)
+
+
+HOT_LUT = _build_lut(_HOT_SEGMENTS)
+
+
+def _lut_index(values):
+    """Map values in [0, 1] to LUT indices the way matplotlib colormaps do"""
+    return np.clip((np.asarray(values, dtype=np.float32) * LUT_SIZE).astype(np.int32), 0, LUT_SIZE - 1)
+
+
+def _normalize(images):
+    """Min-max scale each image of a (N, H, W) batch to [0, 1] (imshow autoscaling)"""
+    images = np.asarray(images, dtype=np.float32)
+    lo = images.min(axis=(-2, -1), keepdims=True)
+    span = images.max(axis=(-2, -1), keepdims=True) - lo
+    return (images - lo) / np.where(span > 0, span, 1.0)
+
+
+def colorize(saliency):
+    """Apply the 'hot' colormap to one (H, W) map or a (N, H, W) batch of maps"""
+    return HOT_LUT[_lut_index(saliency)]
+
+
+def overlay(img_clahe, saliency, alpha=OVERLAY_ALPHA):
+    """Alpha-blend the 'hot' heatmap onto the grayscale CLAHE image(s).
+
+    Accepts single images or batches; the CLAHE image is autoscaled to its own
+    min/max like `imshow(cmap='gray')` before blending. For a normalized saliency
+    map the result is within 2/255 of an unpadded matplotlib imshow composite
+    (checked by test_render); the old figure + LANCZOS resize path is not matched.
+    """
+    gray = _lut_index(_normalize(img_clahe)).astype(np.float32)
+    heat = colorize(saliency).astype(np.float32)
+    blended = alpha * heat + (1.0 - alpha) * gray[..., np.newaxis]
+    return np.clip(np.rint(blended), 0, 255).astype(np.uint8)
+
+
+def render_batch(clahe_batch, saliency_batch, alpha=OVERLAY_ALPHA):
+    """Render saliency and overlay RGB arrays for a whole batch in one pass"""
+    saliency_batch = np.asarray(saliency_batch)
+    return colorize(saliency_batch), overlay(clahe_batch, saliency_batch, alpha)
+
+
+def _fit(array, size):
+    img = Image.fromarray(array)
+    if img.size != size:
+        img = img.resize(size, Image.LANCZOS)
+    return img
+
+
+def write_artifacts(folder, clahe_filename, saliency_filename, overlay_filename,
+                    img_clahe, saliency_rgb, overlay_rgb, size=(150, 150), quality=None):
+    """Write already-rendered CLAHE, saliency and overlay images for one prediction.
+
+    Filenames may be store keys with '/' separators; the encoder (optimized
+    PNG, WebP at `quality`) follows each file's extension.
+    """
+    options = {'quality': quality} if quality else None
+    for filename, array in ((clahe_filename, np.asarray(img_clahe, dtype=np.uint8)),
+                            (saliency_filename, saliency_rgb), (overlay_filename, overlay_rgb)):
+        save_image(os.path.join(folder, *filename.split('/')), _fit(array, size), options)
+
+
+def quantize_heatmap(saliency):
+    """Saliency map in [0, 1] as uint8 (value / 255 recovers it to within 0.002)"""
+    return np.rint(np.clip(np.asarray(saliency, dtype=np.float32), 0.0, 1.0) * 255.0).astype(np.uint8)
+
+
+def write_heatmap(folder, heatmap_filename, saliency):
+    """Write the raw saliency map as an 8-bit grayscale PNG at the model's resolution"""
+    save_image(os.path.join(folder, *heatmap_filename.split('/')), Image.fromarray(quantize_heatmap(saliency)))
+
+
+def save_artifacts(folder, clahe_filename, saliency_filename, overlay_filename,
+                   img_clahe, saliency, size=(150, 150), quality=None, heatmap_filename=None):
+    """Render and write the CLAHE, saliency and overlay images (and the raw heatmap) for one prediction"""
+    saliency_rgb, overlay_rgb = render_batch(img_clahe, saliency)
+    write_artifacts(folder, clahe_filename, saliency_filename, overlay_filename,
+                    img_clahe, saliency_rgb, overlay_rgb, size, quality)
+    if heatmap_filename:
+        write_heatmap(folder, heatmap_filename, saliency)
@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+IDLE = 'idle'
+LOADING = 'loading'
+READY = 'ready'
+FAILED = 'failed'
+
+# Seconds before a failed load is retried, doubling after every failure
+RETRY_INITIAL = 5.0
+RETRY_MAX = 300.0
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRuntime:
+    """Load the inference engine once, in a background thread or on first use.
+
+    `loader(runtime)` must return (engine, model_version); it can wrap its
+    steps in `runtime.stage(name)` so their durations show up in `status()`.
+    `start()` begins loading without blocking, `wait(timeout)` blocks until
+    the engine is ready and returns whether it is.
+
+    A failed load is logged and retried by the next `start()` (a probe or a
+    request) once its backoff has passed: RETRY_INITIAL seconds, doubling up
+    to RETRY_MAX, so a broken model path does not spin but a transient
+    failure (e.g. a model file still being copied) recovers on its own.
+
+    A pre-fork server can set `model_content` (model file bytes read before
+    forking) and `num_threads` (per-process thread budget) for the loader.
+    """
+
+    def __init__(self, loader, retry_initial=RETRY_INITIAL, retry_max=RETRY_MAX):
+        self.loader = loader
+        self.model_content = None
+        self.num_threads = None
+        self.engine = None
+        self.model_version = None
+        self.state = IDLE
+        self.error = None
+        self.stages = OrderedDict()
+        self.retry_initial = retry_initial
+        self.retry_max = retry_max
+        self.failures = 0
+        self._retry_at = None
+        self._started_at = None
+        self._load_seconds = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self.state in (LOADING, READY):
+                return
+            if self.state == FAILED and time.monotonic() < self._retry_at:
+                return
+            self.state = LOADING
+            self._started_at = time.perf_counter()
+            self._done.clear()
+        threading.Thread(target=self._load, name='model-warmup', daemon=True).start()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = time.perf_counter() - started
+
+    def _load(self):
+        try:
+            self.engine, self.model_version = self.loader(self)
+            self.error = None
+            self.state = READY
+        except Exception as e:
+            self.failures += 1
+            backoff = min(self.retry_initial * 2 ** (self.failures - 1), self.retry_max)
+            logger.exception("Loading the model failed (attempt %d); retrying in %.0f s", self.failures, backoff)
+            self.error = f"{type(e).__name__}: {e}"
+            self._retry_at = time.monotonic() + backoff
+            self.state = FAILED
+        finally:
+            self._load_seconds = time.perf_counter() - self._started_at
+            self._done.set()
+
+    def load(self):
+        """Load synchronously in the calling thread (CLI commands, tests)"""
+        self.start()
+        self._done.wait()
+        return self.state == READY
+
+    def wait(self, timeout=None):
+        self.start()
+        self._done.wait(timeout)
+        return self.state == READY
+
+    def ready(self):
+        return self.state == READY
+
+    def retry_in(self):
+        """Seconds until a failed load may be retried (0 when it is not in the failed state)"""
+        if self.state != FAILED:
+            return 0.0
+        return max(self._retry_at - time.monotonic(), 0.0)
+
+    def status(self):
+        return {
+            'status': self.state,
+            'model_version': self.model_version,
+            'error': self.error,
+            'failures': self.failures,
+            'retry_in_seconds': round(self.retry_in(), 1),
+            'load_seconds': self._load_seconds,
+            'stages': {name: round(seconds, 4) for name, seconds in self.stages.items()},
+        }
@@ -0,0 +1,267 @@
+"""Offline batch scoring for directories of chest X-ray images.
+
+Walks a directory tree, preprocesses images in a process pool, runs batched
+inference and records the results in the history table under one user:
+
+    python score.py /data/xrays --user radiologi --artifacts
+
+Progress is checkpointed after every committed batch, so rerunning the same
+command after an interruption resumes where it stopped.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from itertools import islice
+from multiprocessing import Pool
+
+import numpy as np
+
+from artifacts import NO_ARTIFACTS, READY
+from cache import image_digest
+from db import get_user_by_id, get_user_by_username, insert_history_many
+from dicom_io import DICOM_EXTENSIONS
+from env import (ARTIFACT_FORMAT, ARTIFACT_QUALITY, EXPLAIN_METHOD, GRADCAM_LAYER, INFERENCE_BACKEND, MODEL_PATH,
+                 MODEL_VERSION, SMOOTHGRAD_NOISE, SMOOTHGRAD_SAMPLES, TFLITE_MODEL_PATH, TFLITE_NUM_THREADS, UPLOAD_FOLDER)
+from explain import EXPLAIN_METHODS
+from preprocessing import batch_buffers, decode_image, preprocess_image
+from storage import UploadStore
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png') + DICOM_EXTENSIONS
+
+
+def iter_image_paths(root):
+    """Yield image paths relative to `root` in a stable order"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.relpath(os.path.join(dirpath, name), root)
+
+
+def iter_chunks(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def preprocess_file(args):
+    """Pool worker: read, hash and preprocess one image file"""
+    root, rel_path = args
+    started = time.perf_counter()
+    try:
+        with open(os.path.join(root, rel_path), 'rb') as f:
+            data = f.read()
+        img_clahe, _ = preprocess_image(decode_image(data))
+        return rel_path, image_digest(data), img_clahe, None, time.perf_counter() - started
+    except Exception as e:
+        # Reported per file (e.g. a decompression bomb or malformed DICOM) instead of stopping the run
+        return rel_path, None, None, str(e), time.perf_counter() - started
+
+
+class Checkpoint:
+    """Append-only record of relative paths that are already scored and stored"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.done.update(line.rstrip('\n') for line in f if line.strip())
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def mark(self, rel_paths):
+        self._file.writelines(p + '\n' for p in rel_paths)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.done.update(rel_paths)
+
+    def close(self):
+        self._file.close()
+
+
+class StageTimer:
+    """Accumulate seconds and image counts per pipeline stage"""
+
+    def __init__(self):
+        self.seconds = OrderedDict()
+        self.images = OrderedDict()
+
+    def add(self, name, seconds, images):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.images[name] = self.images.get(name, 0) + images
+
+    @contextmanager
+    def stage(self, name, images):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started, images)
+
+    def report(self, workers):
+        print(f"{'stage':<24}{'images':>10}{'seconds':>12}{'images/s':>12}")
+        for name, seconds in self.seconds.items():
+            images = self.images[name]
+            # Worker time is summed across processes; divide by the pool size for wall time
+            wall = seconds / workers if name == 'preprocess' else seconds
+            label = f"{name} ({workers} workers)" if name == 'preprocess' else name
+            rate = f"{images / wall:.1f}" if images and wall > 0 else '-'
+            print(f"{label:<24}{images:>10}{wall:>12.2f}{rate:>12}")
+
+
+def flat_name(rel_path):
+    """Turn a relative path into a single filename for the history table"""
+    return rel_path.replace(os.sep, '_').replace('/', '_')
+
+
+def artifact_keys(store, rel_path, image_hash, model_version, explain_method):
+    """(original, clahe, saliency, overlay) store keys; DICOM files are shown by their CLAHE image"""
+    clahe_key, saliency_key, overlay_key = store.artifact_keys(image_hash, model_version, explain_method)
+    if rel_path.lower().endswith(DICOM_EXTENSIONS):
+        return clahe_key, clahe_key, saliency_key, overlay_key
+    return store.original_key(image_hash, rel_path), clahe_key, saliency_key, overlay_key
+
+
+def resolve_user(user):
+    found = get_user_by_id(int(user)) if user.isdigit() else get_user_by_username(user)
+    if not found:
+        sys.exit(f"User not found: {user}")
+    return found[0]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Score a directory tree of chest X-ray images offline.")
+    parser.add_argument('root', help="directory to scan for .jpg/.jpeg/.png images")
+    parser.add_argument('--user', required=True, help="username or id that owns the history records")
+    parser.add_argument('--model', default=MODEL_PATH, help="Keras model file (default: %(default)s)")
+    parser.add_argument('--backend', default=INFERENCE_BACKEND, choices=('keras', 'tflite-fp16', 'tflite-int8'),
+                        help="inference backend (default: %(default)s)")
+    parser.add_argument('--tflite-model', default=TFLITE_MODEL_PATH or None,
+                        help="TFLite file for the tflite backends (default: <model>.<fp16|int8>.tflite)")
+    parser.add_argument('--batch-size', type=int, default=32, help="images per forward pass (default: %(default)s)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="preprocessing processes (default: %(default)s)")
+    parser.add_argument('--artifacts', action='store_true',
+                        help="store originals and CLAHE/saliency/overlay images in the upload store")
+    parser.add_argument('--explain-method', default=EXPLAIN_METHOD, choices=EXPLAIN_METHODS,
+                        help="saliency map method for --artifacts (default: %(default)s)")
+    parser.add_argument('--upload-folder', default=UPLOAD_FOLDER, help="artifact destination (default: %(default)s)")
+    parser.add_argument('--checkpoint', help="progress file (default: <root>/.score_checkpoint)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    root = os.path.abspath(args.root)
+    checkpoint = Checkpoint(args.checkpoint or os.path.join(root, '.score_checkpoint'))
+    user_id = resolve_user(args.user)
+    store = UploadStore(args.upload_folder, ARTIFACT_FORMAT, ARTIFACT_QUALITY)
+
+    # Start the pool before TensorFlow spins up its threads in this process
+    pool = Pool(args.workers)
+    from engine import load_engine, model_file_digest
+    from render import render_batch, write_artifacts, write_heatmap
+
+    timer = StageTimer()
+    with timer.stage('model load', 0):
+        engine, serving_model_path = load_engine(args.backend, args.model, args.tflite_model,
+                                                 num_threads=TFLITE_NUM_THREADS or None,
+                                                 explain_method=args.explain_method,
+                                                 gradcam_layer=GRADCAM_LAYER or None,
+                                                 smoothgrad_samples=SMOOTHGRAD_SAMPLES, smoothgrad_noise=SMOOTHGRAD_NOISE)
+    model_version = MODEL_VERSION or model_file_digest(serving_model_path)[:16]
+
+    if checkpoint.done:
+        print(f"Resuming: {len(checkpoint.done)} images already scored")
+    pending_paths = (p for p in iter_image_paths(root) if p not in checkpoint.done)
+    windows = iter_chunks(pending_paths, args.batch_size)
+    chunksize = max(1, args.batch_size // args.workers)
+
+    # Keep a bounded number of batches preprocessing ahead of inference
+    in_flight = deque()
+
+    def submit_next():
+        window = next(windows, None)
+        if window is not None:
+            in_flight.append(pool.map_async(preprocess_file, [(root, p) for p in window], chunksize=chunksize))
+
+    for _ in range(2):
+        submit_next()
+
+    # Model input buffer reused for every batch
+    _, inputs = batch_buffers(args.batch_size)
+    scored = failed = 0
+    started = time.perf_counter()
+    try:
+        while in_flight:
+            with timer.stage('wait for preprocess', 0):
+                results = in_flight.popleft().get()
+            submit_next()
+
+            ok = []
+            for rel_path, image_hash, img_clahe, error, seconds in results:
+                timer.add('preprocess', seconds, 1)
+                if error is not None:
+                    print(f"Skipping {rel_path}: {error}")
+                    failed += 1
+                else:
+                    ok.append((rel_path, image_hash, img_clahe))
+
+            rows = []
+            if ok:
+                clahe_batch = np.stack([item[2] for item in ok])
+                batch = inputs[:len(ok)]
+                np.divide(clahe_batch, np.float32(255.0), out=batch[..., 0])
+                with timer.stage('inference', len(ok)):
+                    # Saliency maps are only needed for the artifact images
+                    probabilities, saliencies = engine.predict_batch(batch, saliency=args.artifacts)
+
+                keys = [artifact_keys(store, rel_path, image_hash, model_version, args.explain_method)
+                        if args.artifacts else (None, None, None, None) for rel_path, image_hash, _ in ok]
+                if args.artifacts:
+                    with timer.stage('artifacts', len(ok)):
+                        saliency_rgb, overlay_rgb = render_batch(clahe_batch, saliencies)
+                        for i, (rel_path, image_hash, img_clahe) in enumerate(ok):
+                            # Identical images share one original and one set of artifacts
+                            if keys[i][0] != keys[i][1]:
+                                with open(os.path.join(root, rel_path), 'rb') as f:
+                                    store.put_bytes(keys[i][0], f.read())
+                            write_artifacts(args.upload_folder, *keys[i][1:], img_clahe, saliency_rgb[i],
+                                            overlay_rgb[i], quality=store.quality)
+                            write_heatmap(args.upload_folder, store.heatmap_key(image_hash, model_version, args.explain_method),
+                                          saliencies[i])
+
+                for (rel_path, image_hash, _), probability, (image_key, *artifact_names) in zip(ok, probabilities, keys):
+                    result = engine.to_prediction(probability, None)
+                    rows.append((user_id, flat_name(rel_path), result.label, f"{result.confidence:.2f}%",
+                                 *artifact_names, image_hash, model_version, image_key,
+                                 args.explain_method if args.artifacts else None,
+                                 READY if args.artifacts else NO_ARTIFACTS))
+
+                with timer.stage('db insert', len(rows)):
+                    inserted = insert_history_many(rows)
+                if inserted != len(rows):
+                    sys.exit("Database insert failed; rerun the same command to resume from the last checkpoint")
+
+            checkpoint.mark([item[0] for item in results])
+            scored += len(rows)
+            elapsed = time.perf_counter() - started
+            print(f"{scored} scored, {failed} skipped, {scored / elapsed:.1f} images/s")
+    finally:
+        pool.terminate()
+        checkpoint.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Done: {scored} scored, {failed} skipped in {elapsed:.1f}s "
+          f"({scored / elapsed if elapsed > 0 else 0.0:.1f} images/s overall)")
+    timer.report(args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+"""Pre-fork production server.
+
+The master process imports the app (cheap: no TensorFlow, no DB, see
+create_app), preloads the serving model file and binds the listening socket,
+then forks the workers. Each worker gets a TensorFlow/TFLite thread
+budget of cores // workers so the workers together do not oversubscribe the
+CPU, loads the engine, and serves requests on the shared socket with a
+threaded WSGI server. Dead workers are restarted; a worker that dies within
+`--min-uptime` seconds of starting is restarted after an exponentially
+growing delay, and after `--max-rapid-restarts` such deaths in a row (e.g.
+a broken model file or database settings) the master stops the pool and
+exits with status 1 instead of forking in a loop.
+
+    python serve.py --workers 4 --port 8000
+
+TensorFlow is never initialized in the master: its thread pools do not
+survive fork(). With a TFLite backend the model bytes read by the master are
+used in place by every worker's interpreter, so they stay shared
+copy-on-write. A Keras model has to be materialized per worker; the master
+then only warms the page cache for the .h5 file.
+
+Every `--report-interval` seconds the master prints RSS, PSS (RSS with shared
+pages divided among the processes sharing them) and throughput per worker.
+Admins can fetch the same numbers from /admin/worker-stats.
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from multiprocessing import RawArray
+
+FIELDS = ('pid', 'started_at', 'ready', 'requests', 'busy_seconds', 'rss_bytes', 'pss_bytes')
+SAMPLE_INTERVAL = 5.0
+RESTART_DELAY_INITIAL = 1.0
+RESTART_DELAY_MAX = 60.0
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def thread_budget(cores, workers):
+    """(intra-op, inter-op) threads per worker so that workers x intra-op fits the cores"""
+    intra_op = max(1, cores // workers)
+    inter_op = 2 if intra_op >= 4 else 1
+    return intra_op, inter_op
+
+
+def read_memory():
+    """(RSS, PSS) of the current process in bytes; PSS is 0 where /proc/self/smaps_rollup is missing"""
+    values = {}
+    try:
+        with open('/proc/self/smaps_rollup', encoding='ascii') as f:
+            for line in f:
+                key, _, rest = line.partition(':')
+                if key in ('Rss', 'Pss'):
+                    values[key] = int(rest.split()[0]) * 1024
+    except OSError:
+        import resource
+        # ru_maxrss is the peak RSS in kB on Linux
+        values['Rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return values.get('Rss', 0), values.get('Pss', 0)
+
+
+class WorkerStats:
+    """Per-worker counters in a shared RawArray; each worker only writes its own slot"""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._array = RawArray('d', workers * len(FIELDS))
+
+    def _offset(self, slot, field):
+        return slot * len(FIELDS) + FIELDS.index(field)
+
+    def get(self, slot, field):
+        return self._array[self._offset(slot, field)]
+
+    def set(self, slot, field, value):
+        self._array[self._offset(slot, field)] = value
+
+    def add(self, slot, field, value):
+        self._array[self._offset(slot, field)] += value
+
+    def reset(self, slot, pid):
+        for field in FIELDS:
+            self.set(slot, field, 0.0)
+        self.set(slot, 'pid', pid)
+        self.set(slot, 'started_at', time.time())
+
+    def snapshot(self):
+        now = time.time()
+        rows = []
+        for slot in range(self.workers):
+            row = {field: self.get(slot, field) for field in FIELDS}
+            uptime = now - row['started_at'] if row['started_at'] else 0.0
+            rows.append({
+                'worker': slot,
+                'pid': int(row['pid']),
+                'ready': bool(row['ready']),
+                'uptime_seconds': uptime,
+                'requests': int(row['requests']),
+                'requests_per_second': row['requests'] / uptime if uptime > 0 else 0.0,
+                'busy_seconds': row['busy_seconds'],
+                'rss_mb': row['rss_bytes'] / 2**20,
+                'pss_mb': row['pss_bytes'] / 2**20,
+            })
+        return rows
+
+
+def count_requests(wsgi_app, stats, slot):
+    """WSGI middleware adding each request and its handler time to this worker's slot"""
+    lock = threading.Lock()
+
+    def middleware(environ, start_response):
+        started = time.perf_counter()
+        try:
+            return wsgi_app(environ, start_response)
+        finally:
+            with lock:
+                stats.add(slot, 'requests', 1)
+                stats.add(slot, 'busy_seconds', time.perf_counter() - started)
+
+    return middleware
+
+
+def sample_memory(stats, slot, runtime):
+    while True:
+        rss, pss = read_memory()
+        stats.set(slot, 'rss_bytes', rss)
+        stats.set(slot, 'pss_bytes', pss)
+        stats.set(slot, 'ready', 1.0 if runtime.ready() else 0.0)
+        time.sleep(SAMPLE_INTERVAL)
+
+
+def run_worker(slot, args, sock, stats, app_module, intra_op, inter_op):
+    """Worker process body: apply the thread budget, load the model and serve"""
+    from werkzeug.serving import make_server
+
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    # Native libraries read these when they start their thread pools
+    os.environ['OMP_NUM_THREADS'] = str(intra_op)
+    app_module.runtime.num_threads = intra_op
+    from engine import set_thread_budget
+    set_thread_budget(intra_op, inter_op)
+
+    app = app_module.create_app()
+    app.wsgi_app = count_requests(app.wsgi_app, stats, slot)
+    app.config['WORKER_STATS'] = stats.snapshot
+    threading.Thread(target=sample_memory, args=(stats, slot, app_module.runtime), daemon=True).start()
+
+    server = make_server(args.host, args.port, app, threaded=True, fd=sock.fileno())
+    server.serve_forever()
+
+
+def print_report(stats, previous):
+    """Print one line per worker; req/s is measured since the previous report"""
+    now = time.monotonic()
+    print(f"{'worker':>6}{'pid':>9}{'ready':>7}{'rss MB':>9}{'pss MB':>9}{'requests':>10}{'req/s':>8}")
+    for row in stats.snapshot():
+        last_requests, last_time = previous.get(row['pid'], (0, now - row['uptime_seconds']))
+        seconds = now - last_time
+        rate = (row['requests'] - last_requests) / seconds if seconds > 0 else 0.0
+        previous[row['pid']] = (row['requests'], now)
+        print(f"{row['worker']:>6}{row['pid']:>9}{'yes' if row['ready'] else 'no':>7}{row['rss_mb']:>9.1f}"
+              f"{row['pss_mb']:>9.1f}{row['requests']:>10}{rate:>8.1f}")
+    sys.stdout.flush()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the app with a pre-forked pool of workers.")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=max(1, min(4, available_cores())),
+                        help="worker processes (default: %(default)s)")
+    parser.add_argument('--intra-op-threads', type=int,
+                        help="TensorFlow/TFLite threads per worker (default: cores // workers)")
+    parser.add_argument('--inter-op-threads', type=int, help="TensorFlow inter-op threads per worker")
+    parser.add_argument('--report-interval', type=float, default=60.0,
+                        help="seconds between per-worker reports, 0 to disable (default: %(default)s)")
+    parser.add_argument('--min-uptime', type=float, default=30.0,
+                        help="a worker exiting sooner counts as a rapid failure (default: %(default)s)")
+    parser.add_argument('--max-rapid-restarts', type=int, default=5,
+                        help="consecutive rapid failures of one worker before the master gives up "
+                             "(default: %(default)s)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cores = available_cores()
+    intra_op, inter_op = thread_budget(cores, args.workers)
+    intra_op = args.intra_op_threads or intra_op
+    inter_op = args.inter_op_threads or inter_op
+
+    import app as app_module
+    from engine import serving_model_path
+    from env import INFERENCE_BACKEND, MODEL_PATH, TFLITE_MODEL_PATH
+
+    path = serving_model_path(INFERENCE_BACKEND, MODEL_PATH, TFLITE_MODEL_PATH or None)
+    if INFERENCE_BACKEND == 'keras':
+        # Keras weights are copied into TensorFlow per worker; only warm the page cache
+        with open(path, 'rb') as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+    else:
+        with open(path, 'rb') as f:
+            app_module.runtime.model_content = f.read()
+    print(f"Master {os.getpid()}: {args.workers} workers on {args.host}:{args.port}, {cores} cores, "
+          f"{intra_op} intra-op / {inter_op} inter-op threads per worker, "
+          f"model {path} ({os.path.getsize(path) / 2**20:.1f} MB, backend {INFERENCE_BACKEND})")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    stats = WorkerStats(args.workers)
+    children = {}
+    started = {}
+    rapid_failures = [0] * args.workers
+    # slot -> monotonic time of its delayed restart
+    restart_at = {}
+
+    def spawn(slot):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(slot, args, sock, stats, app_module, intra_op, inter_op)
+            finally:
+                os._exit(1)
+        stats.reset(slot, pid)
+        children[pid] = slot
+        started[slot] = time.monotonic()
+
+    for slot in range(args.workers):
+        spawn(slot)
+
+    stopping = False
+    exit_status = 0
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        restart_at.clear()
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    previous = {}
+    next_report = time.monotonic() + args.report_interval
+    while children or restart_at:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid:
+            slot = children.pop(pid)
+            if stopping:
+                continue
+            uptime = time.monotonic() - started[slot]
+            rapid_failures[slot] = rapid_failures[slot] + 1 if uptime < args.min_uptime else 0
+            if rapid_failures[slot] >= args.max_rapid_restarts:
+                print(f"Worker {slot} (pid {pid}) exited with status {status} after {uptime:.1f}s, "
+                      f"{rapid_failures[slot]} rapid failures in a row: giving up")
+                exit_status = 1
+                stop(None, None)
+                continue
+            delay = 0.0
+            if rapid_failures[slot]:
+                delay = min(RESTART_DELAY_MAX, RESTART_DELAY_INITIAL * 2 ** (rapid_failures[slot] - 1))
+            print(f"Worker {slot} (pid {pid}) exited with status {status} after {uptime:.1f}s, "
+                  f"restarting in {delay:.1f}s")
+            restart_at[slot] = time.monotonic() + delay
+            continue
+        now = time.monotonic()
+        for slot, due in list(restart_at.items()):
+            if due <= now:
+                del restart_at[slot]
+                spawn(slot)
+        if args.report_interval and time.monotonic() >= next_report:
+            print_report(stats, previous)
+            next_report = time.monotonic() + args.report_interval
+        time.sleep(0.5)
+
+    if args.report_interval:
+        print_report(stats, previous)
+    return exit_status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
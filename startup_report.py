@@ -0,0 +1,80 @@
+"""Break down where application startup time goes.
+
+Imports `app` in a fresh interpreter with `-X importtime`, groups the
+cumulative import time by top-level package, then loads the model the same
+way the background warm-up does and reports each stage:
+
+    python startup_report.py
+    python startup_report.py --skip-model --top 10
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+
+
+def import_times(module):
+    """Return (total seconds, {package: seconds}) for importing `module` in a new interpreter"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        sys.exit(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    total = 0.0
+    packages = OrderedDict()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        seconds = int(cumulative) / 1e6
+        if depth == 0:
+            if name.strip() == module:
+                total = seconds
+            else:
+                # Imported before `module` itself (interpreter start-up, site packages)
+                packages.setdefault('(startup) ' + name.strip().split('.')[0], 0.0)
+                packages['(startup) ' + name.strip().split('.')[0]] += seconds
+        elif depth == 1:
+            package = name.strip().split('.')[0]
+            packages[package] = packages.get(package, 0.0) + seconds
+    return total, packages
+
+
+def print_table(title, rows):
+    print(title)
+    for name, seconds in rows:
+        print(f"  {name:<32}{seconds:>9.3f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report application import and model warm-up times.")
+    parser.add_argument('--module', default='app', help="module to import (default: %(default)s)")
+    parser.add_argument('--top', type=int, default=15, help="packages to list (default: %(default)s)")
+    parser.add_argument('--skip-model', action='store_true', help="only report import times")
+    args = parser.parse_args(argv)
+
+    total, packages = import_times(args.module)
+    ranked = sorted(((name, s) for name, s in packages.items() if not name.startswith('(startup)')),
+                    key=lambda item: item[1], reverse=True)
+    print_table(f"import {args.module}: {total:.3f}s, slowest direct imports:", ranked[:args.top])
+
+    if args.skip_model:
+        return
+    started = time.perf_counter()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    app_module = __import__(args.module)
+    runtime = app_module.runtime
+    ok = runtime.load()
+    status = runtime.status()
+    rows = [(name, seconds) for name, seconds in status['stages'].items()]
+    rows.append(('total until ready', time.perf_counter() - started))
+    print_table(f"model warm-up ({'ready' if ok else 'failed: ' + str(status['error'])}):", rows)
+
+
+if __name__ == '__main__':
+    main()
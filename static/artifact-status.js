@@ -0,0 +1,37 @@
+// Visualisasi (CLAHE, saliency, overlay) dibuat di background setelah prediksi.
+// Selama statusnya 'pending', tampilkan placeholder dan polling endpoint status.
+var ARTIFACT_PLACEHOLDER = '/static/artifact-pending.svg';
+// Status 'none': dinilai offline (score.py tanpa --artifacts), tidak ada gambar yang disimpan
+var ARTIFACT_UNAVAILABLE = '/static/artifact-unavailable.svg';
+
+function waitForArtifacts(historyId, onReady, onFailed, interval) {
+    interval = interval || 1000;
+    var stopped = false;
+    function poll() {
+        if (stopped) {
+            return;
+        }
+        fetch('/predict/status/' + historyId)
+            .then(function (response) { return response.json(); })
+            .then(function (data) {
+                if (stopped) {
+                    return;
+                }
+                if (data.status === 'ready') {
+                    onReady(data);
+                } else if (data.status === 'pending') {
+                    setTimeout(poll, interval);
+                } else {
+                    onFailed(data);
+                }
+            })
+            .catch(function () {
+                if (!stopped) {
+                    setTimeout(poll, interval * 2);
+                }
+            });
+    }
+    poll();
+    // Fungsi untuk menghentikan polling (mis. saat modal ditutup)
+    return function () { stopped = true; };
+}
@@ -0,0 +1,48 @@
+// DataTables server-side dengan keyset pagination.
+// Server mengembalikan cursor (timestamp, id) baris terakhir; cursor itu dikirim
+// kembali saat halaman berikutnya diminta sehingga query tidak memakai OFFSET.
+function keysetAjax(url) {
+    var cursors = {};
+    var signature = null;
+    return {
+        url: url,
+        data: function (d) {
+            // Cursor hanya berlaku untuk pencarian, urutan dan ukuran halaman yang sama
+            var current = JSON.stringify([d.search.value, d.order, d.length]);
+            if (current !== signature) {
+                cursors = {};
+                signature = current;
+            }
+            var cursor = cursors[d.start];
+            if (cursor) {
+                d.after_ts = cursor.ts;
+                d.after_id = cursor.id;
+            }
+        },
+        dataSrc: function (json) {
+            if (json.cursor) {
+                cursors[json.next_start] = json.cursor;
+            }
+            return json.data;
+        }
+    };
+}
+
+function escapeHtml(value) {
+    return String(value === null || value === undefined ? '' : value)
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;')
+        .replace(/'/g, '&#39;');
+}
+
+// infoCallback DataTables: jumlah hasil pencarian yang dihitung sampai batas
+// (filtered_capped) ditampilkan sebagai "setidaknya N", bukan sebagai total pasti
+function keysetInfo(settings, start, end, max, total, pre) {
+    if (settings.json && settings.json.filtered_capped) {
+        return 'Menampilkan ' + start + ' sampai ' + end + ' dari setidaknya ' + total.toLocaleString('id-ID') +
+            ' entri (disaring dari ' + max.toLocaleString('id-ID') + ' entri keseluruhan)';
+    }
+    return pre;
+}
@@ -0,0 +1,54 @@
+// Heatmap saliency mentah (PNG grayscale 8-bit, 150x150) diambil hanya saat
+// pengguna membuka bagian "Periksa nilai saliency", bukan disisipkan ke HTML.
+// Nilai piksel 0-255 dikembalikan ke rentang 0-1 saat ditampilkan.
+(function () {
+    var inspector = document.getElementById('heatmapInspector');
+    if (!inspector) {
+        return;
+    }
+    var canvas = document.getElementById('heatmapCanvas');
+    var readout = document.getElementById('heatmapValue');
+    var context = canvas.getContext('2d');
+    var pixels = null;
+    var loading = false;
+
+    function load() {
+        if (pixels || loading) {
+            return;
+        }
+        loading = true;
+        readout.textContent = 'Memuat heatmap...';
+        var img = new Image();
+        img.onload = function () {
+            loading = false;
+            canvas.width = img.naturalWidth;
+            canvas.height = img.naturalHeight;
+            context.drawImage(img, 0, 0);
+            pixels = context.getImageData(0, 0, canvas.width, canvas.height).data;
+            readout.textContent = 'Arahkan kursor ke heatmap';
+        };
+        img.onerror = function () {
+            // Visualisasi mungkin masih dibuat: coba lagi saat bagian ini dibuka kembali
+            loading = false;
+            readout.textContent = 'Heatmap belum tersedia';
+        };
+        img.src = inspector.dataset.src;
+    }
+
+    inspector.addEventListener('toggle', function () {
+        if (inspector.open) {
+            load();
+        }
+    });
+
+    canvas.addEventListener('mousemove', function (event) {
+        if (!pixels) {
+            return;
+        }
+        var rect = canvas.getBoundingClientRect();
+        var x = Math.min(canvas.width - 1, Math.floor((event.clientX - rect.left) * canvas.width / rect.width));
+        var y = Math.min(canvas.height - 1, Math.floor((event.clientY - rect.top) * canvas.height / rect.height));
+        var value = pixels[(y * canvas.width + x) * 4] / 255;
+        readout.textContent = 'Nilai saliency (' + x + ', ' + y + '): ' + value.toFixed(3);
+    });
+})();
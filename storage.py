@@ -0,0 +1,195 @@
+"""Content-addressed store for uploaded images and their visualization artifacts.
+
+Keys are paths relative to the upload folder, sharded by the SHA-256 of the
+image so no directory grows without bound:
+
+    originals/ab/cd/abcd...ef.png
+    artifacts/ab/cd/abcd...ef_<model version>_overlay.webp
+
+Identical uploads map to the same key and are stored once. Keys are stored in
+the history table and served from /static/uploads/<key>, the same URL scheme
+as the flat filenames of older records, so both keep resolving.
+
+Retention (age and total size caps) runs as a separate job:
+
+    python storage.py prune --max-age-days 90 --max-size-gb 5
+"""
+import argparse
+import os
+import re
+import tempfile
+import time
+
+from PIL import Image
+
+ORIGINAL_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+# Encoder settings per artifact extension
+SAVE_OPTIONS = {
+    '.png': {'optimize': True},
+    '.webp': {'quality': 85, 'method': 4},
+}
+
+
+def _shard(image_hash):
+    return f"{image_hash[:2]}/{image_hash[2:4]}"
+
+
+def _safe(value):
+    return re.sub(r'[^A-Za-z0-9._-]', '_', value)
+
+
+def _atomic_write(path, write):
+    """Write via a temporary file in the same directory and rename it into place"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_image(path, img, options=None):
+    """Atomically encode a PIL image to `path`, using SAVE_OPTIONS for its extension"""
+    ext = os.path.splitext(path)[1].lower()
+    options = dict(SAVE_OPTIONS.get(ext, {}), **(options or {}))
+    image_format = Image.registered_extensions()[ext]
+    _atomic_write(path, lambda f: img.save(f, format=image_format, **options))
+
+
+class UploadStore:
+    """Hash-sharded, deduplicating file store rooted at the upload folder"""
+
+    def __init__(self, root, artifact_format='webp', quality=85):
+        # `quality` applies to lossy WebP saliency/overlay images
+        self.root = root
+        self.artifact_ext = '.' + artifact_format.lower().lstrip('.')
+        if self.artifact_ext not in SAVE_OPTIONS:
+            raise ValueError(f"Unsupported artifact format: {artifact_format}")
+        self.quality = int(quality)
+
+    def original_key(self, image_hash, filename):
+        ext = os.path.splitext(filename)[1].lower()
+        if ext not in ORIGINAL_EXTENSIONS:
+            ext = '.png'
+        return f"originals/{_shard(image_hash)}/{image_hash}{ext}"
+
+    def _artifact_prefix(self, image_hash, model_version, explain_method):
+        return f"artifacts/{_shard(image_hash)}/{image_hash}_{_safe(model_version or 'model')}_{_safe(explain_method)}"
+
+    def artifact_keys(self, image_hash, model_version, explain_method):
+        """(clahe, saliency, overlay) keys; saliency depends on the model and the explanation method,
+        so both are part of the key"""
+        prefix = self._artifact_prefix(image_hash, model_version, explain_method)
+        # The CLAHE image is exact grayscale data, so it is always lossless PNG
+        return (f"{prefix}_clahe.png",
+                f"{prefix}_saliency{self.artifact_ext}",
+                f"{prefix}_overlay{self.artifact_ext}")
+
+    def heatmap_key(self, image_hash, model_version, explain_method):
+        """Key of the raw saliency map, quantized to 8-bit grayscale PNG"""
+        return f"{self._artifact_prefix(image_hash, model_version, explain_method)}_heatmap.png"
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key):
+        return bool(key) and os.path.exists(self.path(key))
+
+    def put_bytes(self, key, data):
+        """Store raw bytes under `key` unless an identical upload is already there.
+
+        Returns True when the file was written. A duplicate only refreshes the
+        modification time, so retention treats it as recently used.
+        """
+        path = self.path(key)
+        if os.path.exists(path):
+            os.utime(path)
+            return False
+        _atomic_write(path, lambda f: f.write(data))
+        return True
+
+    def iter_files(self):
+        """Yield (path, size, mtime) for every stored file, sharded and legacy flat ones alike"""
+        stack = [self.root]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'):
+                    stat = entry.stat(follow_symlinks=False)
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+    def prune(self, max_age_seconds=None, max_bytes=None, now=None, dry_run=False):
+        """Delete files older than `max_age_seconds`, then the oldest ones until at most `max_bytes` remain"""
+        now = time.time() if now is None else now
+        files = sorted(self.iter_files(), key=lambda item: item[2])
+        total = sum(size for _, size, _ in files)
+        removed = removed_bytes = 0
+        for path, size, mtime in files:
+            too_old = max_age_seconds is not None and now - mtime > max_age_seconds
+            too_big = max_bytes is not None and total - removed_bytes > max_bytes
+            if not (too_old or too_big):
+                # Files are oldest first: nothing later is older, and the size cap is met
+                break
+            if not dry_run:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+            removed += 1
+            removed_bytes += size
+        if not dry_run:
+            self._remove_empty_dirs()
+        return {
+            'files': len(files),
+            'bytes': total,
+            'removed_files': removed,
+            'removed_bytes': removed_bytes,
+        }
+
+    def _remove_empty_dirs(self):
+        for name in ('originals', 'artifacts'):
+            for dirpath, _, _ in sorted(os.walk(os.path.join(self.root, name)), reverse=True):
+                if dirpath != os.path.join(self.root, name):
+                    try:
+                        os.rmdir(dirpath)
+                    except OSError:
+                        pass
+
+
+def parse_args(argv=None):
+    from env import UPLOAD_MAX_AGE_DAYS, UPLOAD_MAX_SIZE_GB, UPLOAD_FOLDER
+
+    parser = argparse.ArgumentParser(description="Manage the upload store.")
+    parser.add_argument('--root', default=UPLOAD_FOLDER, help="upload folder (default: %(default)s)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    prune_parser = commands.add_parser('prune', help="apply the retention policy")
+    prune_parser.add_argument('--max-age-days', type=float, default=UPLOAD_MAX_AGE_DAYS or None,
+                              help="delete files not used for this many days (default: %(default)s)")
+    prune_parser.add_argument('--max-size-gb', type=float, default=UPLOAD_MAX_SIZE_GB or None,
+                              help="then delete the least recently used files above this total (default: %(default)s)")
+    prune_parser.add_argument('--dry-run', action='store_true', help="only report what would be deleted")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    store = UploadStore(args.root)
+    result = store.prune(max_age_seconds=args.max_age_days * 86400 if args.max_age_days else None,
+                         max_bytes=int(args.max_size_gb * 2**30) if args.max_size_gb else None,
+                         dry_run=args.dry_run)
+    action = 'Would remove' if args.dry_run else 'Removed'
+    print(f"{action} {result['removed_files']} of {result['files']} files "
+          f"({result['removed_bytes'] / 2**20:.1f} of {result['bytes'] / 2**20:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main()
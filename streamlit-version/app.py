@@ -1,15 +1,26 @@
 import streamlit as st
-import cv2
 import numpy as np
 import tensorflow as tf
 from tensorflow import keras
-from PIL import Image
-import matplotlib.pyplot as plt
 import tempfile
 import os
+import sys
 import requests
 from pathlib import Path
 
+# Share the inference engine with the Flask app in the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from cache import image_digest
+from engine import InferenceEngine
+from explain import EXPLAIN_LABELS, EXPLAIN_METHODS
+from preprocessing import decode_image, preprocess_image
+from render import render_batch
+# Streamlit-only helper next to this script
+from model_download import DEFAULT_CACHE_DIR, ChecksumError, UnexpectedContentError, fetch_model
+
+# Analyzed uploads kept across reruns (~160 KB each: CLAHE image plus two rendered RGB images)
+RESULT_CACHE_ENTRIES = int(os.getenv("RESULT_CACHE_ENTRIES", 64))
+
 # Set page config
 st.set_page_config(
     page_title="Pneumonia Classification",
@@ -24,30 +35,50 @@ This application uses deep learning to classify chest X-ray images as Normal or
 Upload an X-ray image to get the classification result along with visual explanations.
 """)
 
-# Load model - modified to download from external source using secrets
+def setting(name, default=None):
+    """Value from Streamlit secrets, falling back to the environment"""
+    try:
+        return st.secrets[name]
+    except (KeyError, FileNotFoundError):
+        return os.getenv(name, default)
+
+# Load model - downloaded once into a local cache directory shared by app instances
 @st.cache_resource(show_spinner="Loading model...")
 def load_model():
+    # A model file next to the app (e.g. committed with it) is used as is
     model_path = Path("modelPneumonia.h5")
 
     if not model_path.exists():
-        with st.spinner("Downloading model... This may take a moment."):
-            try:
-                # Get the Google Drive file ID from secrets
-                file_id = st.secrets["GOOGLE_DRIVE_MODEL_ID"]
-
-                # Construct the download URL for Google Drive
-                model_url = f"https://drive.google.com/uc?export=download&id={file_id}"
+        model_url = setting("MODEL_URL")
+        file_id = setting("GOOGLE_DRIVE_MODEL_ID")
+        if not model_url and not file_id:
+            st.error("Google Drive model ID not found in secrets.")
+            st.info("Please set GOOGLE_DRIVE_MODEL_ID (or MODEL_URL) in Streamlit Secrets")
+            return None
+        # Construct the download URL for Google Drive
+        model_url = model_url or f"https://drive.google.com/uc?export=download&id={file_id}"
+        expected_sha256 = setting("MODEL_SHA256")
+        if not expected_sha256:
+            st.warning("MODEL_SHA256 is not set; the downloaded model cannot be verified.")
 
-                response = requests.get(model_url)
-                response.raise_for_status()
+        with st.spinner("Downloading model... This may take a moment."):
+            bar = st.progress(0.0)
 
-                with open(model_path, "wb") as f:
-                    f.write(response.content)
+            def report(done, total):
+                if total:
+                    bar.progress(min(done / total, 1.0))
 
-                st.success("Model downloaded successfully!")
-            except KeyError:
-                st.error("Google Drive model ID not found in secrets.")
-                st.info("Please set GOOGLE_DRIVE_MODEL_ID in Streamlit Secrets")
+            try:
+                # Streamed to a partial file, resumed after interruptions, verified, then renamed into place
+                model_path = Path(fetch_model(model_url, setting("MODEL_CACHE_DIR", DEFAULT_CACHE_DIR),
+                                              sha256=expected_sha256, progress=report))
+            except ChecksumError as e:
+                st.error(f"Downloaded model failed verification: {e}")
+                st.info("Please check MODEL_SHA256 and the model ID in Streamlit Secrets")
+                return None
+            except UnexpectedContentError as e:
+                st.error(f"Model download returned a web page: {e}")
+                st.info("Please make sure the model file is shared publicly, or set MODEL_URL to a direct download link")
                 return None
             except requests.exceptions.RequestException as e:
                 st.error(f"Network error downloading model: {e}")
@@ -57,57 +88,73 @@ def load_model():
                 st.error(f"Unexpected error downloading model: {e}")
                 st.info("Please make sure the Google Drive model ID is correctly set in Streamlit Secrets")
                 return None
+            finally:
+                bar.empty()
 
     try:
         model = tf.keras.models.load_model(model_path)
-        return model
+        # Traced and warmed up once here (every explanation method), then reused across reruns
+        return InferenceEngine(model, explain_method='smoothgrad')
     except Exception as e:
         st.error(f"Error loading model: {e}")
         st.info("Please make sure modelPneumonia.h5 is accessible")
         return None
 
-model = load_model()
-
-if model is not None:
-    # Define labels
-    labels = ["Normal", "Pneumonia"]
-    
+engine = load_model()
+
+# Streamlit reruns the whole script on every widget interaction. Results are
+# cached on the upload's content hash and the explanation method, so a rerun
+# with the same file skips preprocessing, inference and rendering entirely.
+# `_data` is not hashed by Streamlit; the digest already identifies it.
+@st.cache_data(max_entries=RESULT_CACHE_ENTRIES, show_spinner=False)
+def analyze(image_hash, explain_method, _data):
+    # Grayscale, resize, CLAHE and normalize exactly like the Flask app
+    img_clahe, img_input = preprocess_image(decode_image(_data))
+    # Label, confidence and saliency map from one forward/backward pass
+    result = engine.predict(img_input, method=explain_method)
+    # Rendered with the Flask app's colormap lookup table instead of matplotlib figures;
+    # this version has always blended the overlay at 0.5 (the Flask app uses OVERLAY_ALPHA)
+    saliency_rgb, overlay_rgb = render_batch(img_clahe, result.saliency, alpha=0.5)
+    return {
+        "prediction": result.label,
+        "confidence": result.confidence,
+        "clahe": np.array(img_clahe),
+        "saliency": saliency_rgb,
+        "overlay": overlay_rgb,
+    }
+
+if engine is not None:
     # File upload
     uploaded_file = st.file_uploader(
         "Choose a chest X-ray image...", 
         type=["jpg", "jpeg", "png"],
         help="Upload a chest X-ray image for pneumonia classification"
     )
+    explain_method = st.selectbox(
+        "Explanation method",
+        EXPLAIN_METHODS,
+        index=EXPLAIN_METHODS.index("gradient"),
+        format_func=EXPLAIN_LABELS.get,
+        help="Grad-CAM is the fastest; SmoothGrad averages gradients over noisy copies for a less noisy map"
+    )
     
     if uploaded_file is not None:
         # Display the uploaded image
         col1, col2 = st.columns(2)
 
+        data = uploaded_file.getvalue()
+
         with col1:
-            # Read and display original image
-            image = Image.open(uploaded_file)
+            # Display the original image straight from the uploaded bytes
             st.subheader("Uploaded X-ray Image")
-            st.image(image, caption="Original Image", use_container_width=True)
+            st.image(data, caption="Original Image", use_container_width=True)
         
         with col2:
-            # Process image for prediction
-            # Convert to grayscale and resize
-            img = image.convert('L').resize((150, 150))
-            img_array = np.array(img)
-
-            # Apply CLAHE for contrast enhancement
-            clahe = cv2.createCLAHE(clipLimit=1.0, tileGridSize=(8, 8))
-            img_clahe = clahe.apply(img_array)
-
-            # Normalize and prepare for model
-            img_clahe_normalized = img_clahe / 255.0
-            img_input = img_clahe_normalized.reshape(1, 150, 150, 1)
-            
-            # Make prediction
+            # Make prediction (instant when this file and method were analyzed before)
             with st.spinner('Analyzing the image...'):
-                pred = model.predict(img_input)[0][0]
-                prediction = labels[int(pred >= 0.5)]
-                confidence = (pred if pred >= 0.5 else 1 - pred) * 100
+                result = analyze(image_digest(data), explain_method, data)
+                prediction = result["prediction"]
+                confidence = result["confidence"]
 
                 # Display results
                 st.subheader("Prediction Results")
@@ -122,50 +169,22 @@ if model is not None:
                     st.warning("The model indicates signs of pneumonia. Consult with a healthcare professional for proper diagnosis.")
         
         # Additional visualizations
-        st.subheader("Visual Explanations")
-
-        # Generate saliency map
-        with st.spinner('Generating visual explanations...'):
-            # Saliency Map
-            input_tensor = tf.convert_to_tensor(img_input)
-            with tf.GradientTape() as tape:
-                tape.watch(input_tensor)
-                preds = model(input_tensor)
-                top_class = tf.argmax(preds[0])
-                top_output = preds[:, top_class]
-
-            grads = tape.gradient(top_output, input_tensor)[0]
-            saliency = np.abs(grads.numpy())
-            saliency = np.max(saliency, axis=-1)
-            saliency = (saliency - saliency.min()) / (saliency.max() - saliency.min())
+        st.subheader(f"Visual Explanations ({EXPLAIN_LABELS[explain_method]})")
 
         # Display additional visualizations
         col3, col4, col5 = st.columns(3)
 
         with col3:
             st.subheader("CLAHE Enhanced Image")
-            fig, ax = plt.subplots(figsize=(6, 6))
-            ax.imshow(img_clahe, cmap='gray') # Display the CLAHE image on the axis
-            ax.axis('off')
-            ax.set_title('CLAHE Enhancement')
-            st.pyplot(fig)
+            st.image(result["clahe"], caption="CLAHE Enhancement", use_container_width=True)
 
         with col4:
             st.subheader("Saliency Map Overlay")
-            fig, ax = plt.subplots(figsize=(6, 6))
-            ax.imshow(img_clahe, cmap='gray')
-            ax.imshow(saliency, cmap='hot', alpha=0.5)
-            ax.axis('off')
-            ax.set_title('Saliency Map Overlay')
-            st.pyplot(fig)
+            st.image(result["overlay"], caption="Saliency Map Overlay", use_container_width=True)
 
         with col5:
             st.subheader("Saliency Heatmap")
-            fig2, ax2 = plt.subplots(figsize=(6, 6))
-            ax2.imshow(saliency, cmap='hot')
-            ax2.axis('off')
-            ax2.set_title('Saliency Heatmap')
-            st.pyplot(fig2)
+            st.image(result["saliency"], caption="Saliency Heatmap", use_container_width=True)
 
         # Show interpretation
         st.subheader("Interpretation")
@@ -0,0 +1,158 @@
+"""Streamed, resumable and verified download of the model file.
+
+    path = fetch_model(url, cache_dir, sha256='...', filename='modelPneumonia.h5')
+
+The response is streamed in chunks to `<cache_dir>/<filename>.part`. If a
+previous attempt was interrupted, the download resumes from the partial
+file with an HTTP Range request. When the server ignores the range, it
+starts over. An HTML response (such as a sign-in or virus-scan page) is
+rejected before anything is written. The SHA-256 of the complete file is checked against the
+configured digest before the file is renamed into place, so a cached model
+is always complete. App instances that share the cache directory share one
+copy, and a lock file makes concurrent starts wait for a single download.
+
+Can be run on its own, e.g. against a local stand-in server:
+
+    python model_download.py http://127.0.0.1:8000/model.h5 --cache-dir /tmp/models --sha256 <digest>
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+from contextlib import contextmanager
+
+import requests
+
+CHUNK_SIZE = 1024 * 1024
+RETRIES = 3
+TIMEOUT = (10, 60)
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pneumonia-classification')
+
+
+class ChecksumError(ValueError):
+    pass
+
+
+class UnexpectedContentError(ValueError):
+    """The server answered with a web page (e.g. a Drive sign-in or confirmation page) instead of the file"""
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextmanager
+def _locked(path):
+    """Exclusive lock on `path` across processes (no-op where fcntl is unavailable)"""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _download(url, part_path, progress=None, session=None):
+    """Stream `url` into `part_path`, resuming from its current size; returns the SHA-256 of the result"""
+    http = session or requests
+    digest = hashlib.sha256()
+    offset = 0
+    if os.path.exists(part_path):
+        # Hash what is already on disk so the digest covers the whole file
+        with open(part_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                offset += len(chunk)
+
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+    with http.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+        if response.status_code == 416 and offset:
+            # Nothing left to fetch: the partial file is already complete
+            return digest.hexdigest()
+        response.raise_for_status()
+        content_type = response.headers.get('Content-Type', '')
+        if content_type.split(';')[0].strip().lower() == 'text/html':
+            raise UnexpectedContentError(f"{url} returned an HTML page instead of the model file")
+        match = re.match(r'bytes (\d+)-', response.headers.get('Content-Range', ''))
+        if response.status_code == 206 and match and int(match.group(1)) == offset:
+            mode = 'ab'
+        else:
+            # Range not honored: start again from the first byte
+            digest, offset, mode = hashlib.sha256(), 0, 'wb'
+        length = response.headers.get('Content-Length')
+        total = offset + int(length) if length else None
+
+        with open(part_path, mode) as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                digest.update(chunk)
+                offset += len(chunk)
+                if progress:
+                    progress(offset, total)
+            f.flush()
+            os.fsync(f.fileno())
+    if total is not None and offset != total:
+        raise requests.exceptions.ConnectionError(f"Download ended after {offset} of {total} bytes")
+    return digest.hexdigest()
+
+
+def fetch_model(url, cache_dir=DEFAULT_CACHE_DIR, sha256=None, filename='modelPneumonia.h5',
+                progress=None, retries=RETRIES, session=None):
+    """Path of the model in `cache_dir`, downloading it first if it is missing or does not match `sha256`"""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, filename)
+    part_path = path + '.part'
+    expected = sha256.lower() if sha256 else None
+
+    with _locked(path + '.lock'):
+        if os.path.exists(path):
+            # Another instance may have finished the download while we waited for the lock
+            if expected is None or file_sha256(path) == expected:
+                return path
+            os.remove(path)
+
+        for attempt in range(retries + 1):
+            try:
+                actual = _download(url, part_path, progress, session)
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError):
+                # Keep the partial file; the next attempt resumes from it
+                if attempt == retries:
+                    raise
+
+        if expected is not None and actual != expected:
+            os.remove(part_path)
+            raise ChecksumError(f"SHA-256 of the downloaded model is {actual}, expected {expected}")
+        os.replace(part_path, path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Download the model into the local model cache.')
+    parser.add_argument('url')
+    parser.add_argument('--cache-dir', default=os.getenv('MODEL_CACHE_DIR', DEFAULT_CACHE_DIR))
+    parser.add_argument('--sha256', default=os.getenv('MODEL_SHA256'))
+    parser.add_argument('--filename', default='modelPneumonia.h5')
+    args = parser.parse_args()
+
+    def report(done, total):
+        sys.stderr.write(f"\r{done / 1e6:.1f} MB" + (f" / {total / 1e6:.1f} MB" if total else ''))
+
+    path = fetch_model(args.url, args.cache_dir, args.sha256, args.filename, progress=report)
+    sys.stderr.write('\n')
+    print(path)
+
+
+if __name__ == '__main__':
+    main()
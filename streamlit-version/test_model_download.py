@@ -0,0 +1,154 @@
+"""Tests for model_download against a local Range-capable http.server stand-in.
+
+    python -m unittest test_model_download
+"""
+import hashlib
+import http.server
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+
+import requests
+
+import model_download
+from model_download import ChecksumError, UnexpectedContentError, fetch_model
+
+DATA = os.urandom(3 * model_download.CHUNK_SIZE + 123)
+DIGEST = hashlib.sha256(DATA).hexdigest()
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Serves DATA, honoring `Range: bytes=N-` unless told otherwise"""
+    protocol_version = 'HTTP/1.1'
+    ignore_range = False
+    fail_after = None        # bytes sent before the connection is cut (once)
+    content_type = 'application/octet-stream'
+    ranges = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        cls = type(self)
+        requested = self.headers.get('Range')
+        cls.ranges.append(requested)
+        start = 0
+        if requested and not cls.ignore_range:
+            start = int(re.match(r'bytes=(\d+)-', requested).group(1))
+            if start >= len(DATA):
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(DATA) - 1}/{len(DATA)}')
+        else:
+            self.send_response(200)
+        body = DATA[start:]
+        self.send_header('Content-Type', cls.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if cls.fail_after is not None:
+            sent, cls.fail_after = cls.fail_after, None
+            self.wfile.write(body[:sent])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+class FetchModelTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_port}/modelPneumonia.h5'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StandInHandler.ignore_range = False
+        StandInHandler.fail_after = None
+        StandInHandler.content_type = 'application/octet-stream'
+        StandInHandler.ranges = []
+        self.cache_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.cache_dir, 'modelPneumonia.h5')
+        self.part_path = self.path + '.part'
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_download_is_verified_and_moved_into_place(self):
+        self.assertEqual(fetch_model(self.url, self.cache_dir, sha256=DIGEST), self.path)
+        self.assertEqual(self.read(self.path), DATA)
+        self.assertFalse(os.path.exists(self.part_path))
+        # A second start uses the cached file without another request
+        fetch_model(self.url, self.cache_dir, sha256=DIGEST)
+        self.assertEqual(StandInHandler.ranges, [None])
+
+    def test_interrupted_download_resumes_with_206(self):
+        StandInHandler.fail_after = model_download.CHUNK_SIZE + 17
+        fetch_model(self.url, self.cache_dir, sha256=DIGEST)
+        self.assertEqual(self.read(self.path), DATA)
+        self.assertEqual(StandInHandler.ranges[0], None)
+        resumed_from = int(re.match(r'bytes=(\d+)-', StandInHandler.ranges[1]).group(1))
+        self.assertGreater(resumed_from, 0)
+
+    def test_ignored_range_restarts_with_200(self):
+        with open(self.part_path, 'wb') as f:
+            f.write(b'stale partial download')
+        StandInHandler.ignore_range = True
+        fetch_model(self.url, self.cache_dir, sha256=DIGEST)
+        self.assertEqual(StandInHandler.ranges, ['bytes=22-'])
+        self.assertEqual(self.read(self.path), DATA)
+
+    def test_complete_partial_file_is_finished_on_416(self):
+        with open(self.part_path, 'wb') as f:
+            f.write(DATA)
+        fetch_model(self.url, self.cache_dir, sha256=DIGEST)
+        self.assertEqual(self.read(self.path), DATA)
+        self.assertFalse(os.path.exists(self.part_path))
+
+    def test_truncated_download_keeps_partial_and_no_model(self):
+        StandInHandler.fail_after = model_download.CHUNK_SIZE + 1000
+        with self.assertRaises(requests.exceptions.RequestException):
+            fetch_model(self.url, self.cache_dir, sha256=DIGEST, retries=0)
+        self.assertFalse(os.path.exists(self.path))
+        # Whole chunks received before the cut are kept for the next resume
+        partial = self.read(self.part_path)
+        self.assertTrue(partial)
+        self.assertEqual(partial, DATA[:len(partial)])
+
+    def test_digest_mismatch_discards_download(self):
+        with self.assertRaises(ChecksumError):
+            fetch_model(self.url, self.cache_dir, sha256='0' * 64)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.part_path))
+
+    def test_cached_file_with_wrong_digest_is_replaced(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'corrupt')
+        fetch_model(self.url, self.cache_dir, sha256=DIGEST)
+        self.assertEqual(self.read(self.path), DATA)
+
+    def test_html_page_is_rejected_before_caching(self):
+        StandInHandler.content_type = 'text/html; charset=utf-8'
+        with self.assertRaises(UnexpectedContentError):
+            fetch_model(self.url, self.cache_dir)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.part_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
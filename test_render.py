@@ -0,0 +1,90 @@
+"""Parity of render.py against the matplotlib output it replaced.
+
+    python -m unittest test_render
+
+The reference (testdata/render_reference.npz) holds a CLAHE/saliency pair and
+what matplotlib made of it: `plt.imsave(cmap='hot')` for the saliency map and an
+unpadded `imshow` gray + hot (alpha 0.7) composite for the overlay. Regenerate it
+with `python test_render.py --regenerate` (needs matplotlib).
+"""
+import io
+import os
+import sys
+import unittest
+
+import numpy as np
+
+import render
+
+REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata', 'render_reference.npz')
+SIZE = 64
+DPI = 100
+
+# The overlay blends in uint8 instead of float RGBA, so allow rounding drift
+OVERLAY_MAX_DIFF = 2
+OVERLAY_MEAN_DIFF = 1.0
+
+
+def make_reference(path=REFERENCE):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from PIL import Image
+
+    yy, xx = np.mgrid[0:SIZE, 0:SIZE] / (SIZE - 1)
+    rng = np.random.default_rng(0)
+    img_clahe = np.clip(255 * (0.3 + 0.5 * yy) + rng.normal(0, 30, (SIZE, SIZE)), 0, 255).astype(np.uint8)
+    saliency = np.exp(-((xx - 0.6) ** 2 + (yy - 0.4) ** 2) / 0.05) + 0.3 * rng.random((SIZE, SIZE))
+    # Saliency maps leave the engine min-max normalized to [0, 1]
+    saliency = ((saliency - saliency.min()) / (saliency.max() - saliency.min())).astype(np.float32)
+
+    buf = io.BytesIO()
+    plt.imsave(buf, saliency, cmap='hot', format='png')
+    saliency_rgb = np.asarray(Image.open(buf).convert('RGB'))
+
+    fig = plt.figure(figsize=(SIZE / DPI, SIZE / DPI), dpi=DPI)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.axis('off')
+    ax.imshow(img_clahe, cmap='gray', interpolation='nearest')
+    ax.imshow(saliency, cmap='hot', alpha=render.OVERLAY_ALPHA, interpolation='nearest')
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=DPI)
+    plt.close(fig)
+    overlay_rgb = np.asarray(Image.open(buf).convert('RGB'))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez_compressed(path, img_clahe=img_clahe, saliency=saliency,
+                        saliency_rgb=saliency_rgb, overlay_rgb=overlay_rgb)
+
+
+class MatplotlibParityTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with np.load(REFERENCE) as ref:
+            cls.ref = dict(ref)
+
+    def diff(self, actual, expected):
+        self.assertEqual(actual.shape, expected.shape)
+        return np.abs(actual.astype(np.int16) - expected.astype(np.int16))
+
+    def test_saliency_matches_imsave_exactly(self):
+        np.testing.assert_array_equal(render.colorize(self.ref['saliency']), self.ref['saliency_rgb'])
+
+    def test_overlay_is_within_rounding_of_imshow(self):
+        diff = self.diff(render.overlay(self.ref['img_clahe'], self.ref['saliency']), self.ref['overlay_rgb'])
+        self.assertLessEqual(diff.max(), OVERLAY_MAX_DIFF)
+        self.assertLess(diff.mean(), OVERLAY_MEAN_DIFF)
+
+    def test_batch_matches_single_images(self):
+        saliency_rgb, overlay_rgb = render.render_batch(self.ref['img_clahe'][np.newaxis],
+                                                        self.ref['saliency'][np.newaxis])
+        np.testing.assert_array_equal(saliency_rgb[0], render.colorize(self.ref['saliency']))
+        np.testing.assert_array_equal(overlay_rgb[0], render.overlay(self.ref['img_clahe'], self.ref['saliency']))
+
+
+if __name__ == '__main__':
+    if '--regenerate' in sys.argv:
+        make_reference()
+    else:
+        unittest.main()